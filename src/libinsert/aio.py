@@ -0,0 +1,259 @@
+"""asyncio flavour of DistroManager and SysProbe for embedding libinsert in an event loop.
+
+Commands are the same ones the blocking classes build, they are just started with
+asyncio.create_subprocess_exec and limited by a semaphore instead of run in threads.
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+from .distro import DistroManager, QUERY_TIMEOUT
+from .probe import SysProbe, PCI_COMMAND, USB_COMMAND, PROBE_TIMEOUT, FIRMWARE_TIMEOUT, firmware_command, parse_firmware_result
+from .devices import parse_devices
+from .helper import build_operation
+from .runner import CommandResult, STATS, KILL_GRACE
+
+logger = logging.getLogger("AsyncInsert")
+
+# child processes one manager or probe keeps in flight at once
+MAX_CONCURRENCY = 16
+# package manager output can have very long lines, the default 64 KiB would raise
+LINE_LIMIT = 1024 * 1024
+
+async def kill_group_async(process, grace=KILL_GRACE):
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        except PermissionError:
+            logger.warning(f"Not allowed to signal process group {process.pid}")
+            return
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+            return
+        except asyncio.TimeoutError:
+            continue
+
+async def run_async(cmd, timeout=None, on_line=None, capture=True, merge_stderr=False, env=None):
+    """Coroutine twin of runner.run. Cancelling the awaiting task kills the process group.
+
+    CPU time and RSS are not filled in, the event loop reaps the child itself.
+    """
+    start = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE,
+        env=env,
+        start_new_session=True,
+        limit=LINE_LIMIT,
+    )
+    result = CommandResult(cmd)
+    stdout_lines = []
+    stderr_chunks = []
+
+    async def read_stdout():
+        async for raw in process.stdout:
+            line = raw.decode("utf-8", "replace")
+            if on_line is not None:
+                on_line(line.rstrip("\n"))
+            if capture:
+                stdout_lines.append(line)
+
+    async def read_stderr():
+        if process.stderr is not None:
+            stderr_chunks.append((await process.stderr.read()).decode("utf-8", "replace"))
+
+    async def communicate():
+        await asyncio.gather(read_stdout(), read_stderr())
+        await process.wait()
+
+    try:
+        await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out: {' '.join(cmd)}")
+        result.timed_out = True
+        await kill_group_async(process)
+    except asyncio.CancelledError:
+        logger.warning(f"Cancelling: {' '.join(cmd)}")
+        result.cancelled = True
+        # shielded so the kill finishes even though our task is being cancelled
+        await asyncio.shield(kill_group_async(process))
+        raise
+    finally:
+        result.returncode = process.returncode
+        result.stdout = "".join(stdout_lines)
+        result.stderr = "".join(stderr_chunks)
+        result.wall_time = time.monotonic() - start
+        STATS.record(result)
+    logger.debug(f"{' '.join(cmd)} -> {result.returncode} in {result.wall_time:.2f}s")
+    return result
+
+class AsyncDistroManager:
+    """Package queries and transactions on the event loop, at most `concurrency` children at a time."""
+
+    def __init__(self, distro_mgr=None, concurrency=MAX_CONCURRENCY):
+        self.distro_mgr = distro_mgr or DistroManager()
+        self._limit = asyncio.Semaphore(concurrency)
+
+    @property
+    def family(self):
+        return self.distro_mgr.family
+
+    @property
+    def pkg_mgr(self):
+        return self.distro_mgr.pkg_mgr
+
+    async def _run(self, cmd, **kwargs):
+        async with self._limit:
+            return await run_async(cmd, **kwargs)
+
+    async def installed_packages(self):
+        """Every installed package name, one listing call."""
+        cmd = self.distro_mgr.get_installed_packages_command()
+        if not cmd:
+            return set()
+        try:
+            result = await self._run(cmd, timeout=QUERY_TIMEOUT)
+        except OSError as e:
+            logger.error(f"Failed to list installed packages: {e}")
+            return set()
+        if not result.ok:
+            logger.error(f"Listing installed packages failed with code {result.returncode}")
+            return set()
+        return {line.strip() for line in result.stdout.split("\n") if line.strip()}
+
+    async def is_installed(self, package):
+        cmd = self.distro_mgr.get_query_command(package)
+        if not cmd:
+            return False
+        try:
+            return (await self._run(cmd, timeout=QUERY_TIMEOUT, capture=False)).ok
+        except OSError:
+            return False
+
+    async def installed(self, packages):
+        """package -> installed, from one listing when the package manager has one, else concurrent queries."""
+        packages = list(dict.fromkeys(packages))
+        listing = await self.installed_packages()
+        if listing:
+            return {p: p in listing for p in packages}
+        results = await asyncio.gather(*(self.is_installed(p) for p in packages))
+        return dict(zip(packages, results))
+
+    async def orphans(self):
+        cmd = self.distro_mgr.get_orphans_command()
+        if not cmd:
+            return []
+        try:
+            result = await self._run(cmd, timeout=QUERY_TIMEOUT)
+        except OSError:
+            return []
+        return [line.strip() for line in result.stdout.split("\n") if line.strip()] if result.ok else []
+
+    async def run_transaction(self, operations):
+        """Run typed operations like TaskWorker does and yield ("progress", line), then ("finished", True)
+        or ("error", message). Closing the generator early kills the running command.
+        """
+        for op, args in operations:
+            try:
+                cmd = build_operation(self.distro_mgr, op, args)
+            except ValueError as e:
+                yield "error", str(e)
+                return
+            queue = asyncio.Queue()
+            def on_line(line, queue=queue):
+                if line.strip():
+                    queue.put_nowait(line.strip())
+            task = asyncio.ensure_future(self._run(cmd, on_line=on_line, capture=False, merge_stderr=True))
+            getter = None
+            try:
+                while True:
+                    getter = asyncio.ensure_future(queue.get())
+                    await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                    if getter.done():
+                        yield "progress", getter.result()
+                        continue
+                    getter.cancel()
+                    break
+                while not queue.empty():
+                    yield "progress", queue.get_nowait()
+                try:
+                    result = task.result()
+                except OSError as e:
+                    yield "error", str(e)
+                    return
+            finally:
+                if getter is not None:
+                    getter.cancel()
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            logger.info(f"{op} finished with return code {result.returncode} in {result.wall_time:.1f}s")
+            if result.returncode != 0:
+                yield "error", f"Command failed with code {result.returncode}!"
+                return
+        yield "finished", True
+
+class AsyncSysProbe:
+    """Hardware probing and driver matching without blocking the loop.
+
+    lspci, lsusb and fwupdmgr share the distro manager's semaphore, so `concurrency`
+    bounds every child of a scan. It only applies when no distro manager is passed in.
+    """
+
+    def __init__(self, probe=None, distro=None, concurrency=MAX_CONCURRENCY):
+        self.sysprobe = probe or SysProbe()
+        self.distro = distro or AsyncDistroManager(concurrency=concurrency)
+        self._limit = self.distro._limit
+
+    async def _lines(self, cmd, timeout):
+        try:
+            async with self._limit:
+                result = await run_async(cmd, timeout=timeout)
+        except FileNotFoundError:
+            return None
+        if not result.ok:
+            logger.error(f"{cmd[0]} failed with code {result.returncode}: {result.stderr.strip()}")
+            return []
+        return result.stdout.strip().split("\n") if result.stdout.strip() else []
+
+    async def probe(self):
+        """lspci and lsusb side by side, parsed into Device records. sysfs stands in for a missing tool."""
+        pci, usb = await asyncio.gather(self._lines(PCI_COMMAND, PROBE_TIMEOUT), self._lines(USB_COMMAND, PROBE_TIMEOUT))
+        sysfs, names = self.sysprobe.sysfs, self.sysprobe.names
+        devices = parse_devices(pci) if pci is not None else await asyncio.to_thread(sysfs.pci_devices, names)
+        devices += parse_devices([], usb) if usb is not None else await asyncio.to_thread(sysfs.usb_devices, names)
+        self.sysprobe.devices = devices
+        return devices
+
+    async def find_needed_packages(self, devices=None, family=None):
+        """Driver matches with installed state and kernel bindings, like ScanState.refresh."""
+        family = family or self.distro.family
+        if devices is None:
+            devices, installed = await asyncio.gather(self.probe(), self.distro.installed_packages())
+        else:
+            installed = await self.distro.installed_packages()
+        matches = self.sysprobe.match_devices(family, devices)
+        if installed:
+            for match in matches:
+                match.set_installed(installed.__contains__)
+        else:
+            states = await self.distro.installed({p for m in matches for p in m.packages})
+            for match in matches:
+                match.set_installed(states.__getitem__)
+        # sysfs reads are quick but still file io
+        await asyncio.to_thread(self.sysprobe.check_bindings, matches)
+        return matches
+
+    async def firmware_updates(self):
+        try:
+            async with self._limit:
+                result = await run_async(firmware_command(), timeout=FIRMWARE_TIMEOUT)
+        except FileNotFoundError:
+            logger.info("fwupdmgr not found, skipping firmware check.")
+            return None
+        return parse_firmware_result(result)
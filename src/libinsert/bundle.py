@@ -0,0 +1,300 @@
+import os
+import glob
+import json
+import time
+import base64
+import shutil
+import hashlib
+import logging
+import tarfile
+import binascii
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from .distro import parse_os_release, family_for, SIMULATOR
+from .devices import parse_devices
+from .runner import run
+from .pkgindex import _parse_pacman_desc
+
+logger = logging.getLogger("Bundle")
+
+MANIFEST = "insert-bundle.json"
+BUNDLE_VERSION = 1
+REPO_NAME = "insert-bundle"
+PACMAN_SYNC = "/var/lib/pacman/sync"
+PACMAN_LOCAL = "/var/lib/pacman/local"
+PACMAN_LOCK = "/var/lib/pacman/db.lck"
+PACKAGE_GLOBS = {
+    "pacman": ["*.pkg.tar.*"],
+    "apt": ["*.deb"],
+    "dnf": ["*.rpm"],
+    "simulated": ["*.sim"],
+}
+
+class BundleError(Exception):
+    pass
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _essentials(probe, family, resolver=None):
+    names = probe.drivers_db.get("essentials", {}).get(family, [])
+    if resolver is None:
+        return names
+    return [n for n in (resolver.resolve(name) for name in names) if n is not None]
+
+def bundle_packages(probe, family, snapshots=(), essentials=True, extra=(), resolver=None):
+    """Every driver package any of the snapshots matches, plus the essentials, for one family."""
+    packages = set(extra)
+    for snapshot in snapshots:
+        snap_family = family_for(parse_os_release(snapshot.get("os_release", "")).get("ID", "unknown"))
+        if snap_family != family:
+            logger.warning(f"Skipping {snapshot.get('hostname', '?')}: {snap_family} snapshot, bundle is for {family}")
+            continue
+        devices = parse_devices(snapshot.get("pci", []), snapshot.get("usb", []))
+        for match in probe.match_devices(family, devices):
+            # everything the driver needs, a fresh machine has none of it
+            packages.update(match.packages)
+    if essentials:
+        packages.update(_essentials(probe, family, resolver))
+    return sorted(packages)
+
+# export: download the closure as if nothing were installed, then index it
+
+def download_commands(pkg_mgr, packages, directory, workdir):
+    if pkg_mgr == "pacman":
+        # an empty local db next to the real sync dbs makes pacman fetch the whole closure
+        dbpath = os.path.join(workdir, "db")
+        os.makedirs(dbpath, exist_ok=True)
+        os.symlink(PACMAN_SYNC, os.path.join(dbpath, "sync"))
+        return [["pacman", "-Sw", "--noconfirm", "--dbpath", dbpath, "--cachedir", directory] + packages]
+    if pkg_mgr == "apt":
+        status = os.path.join(workdir, "status")
+        open(status, "w").close()
+        os.makedirs(os.path.join(directory, "partial"), exist_ok=True)
+        return [["apt-get", "install", "--download-only", "-y", "-o", f"Dir::Cache::archives={directory}",
+                 "-o", f"Dir::State::status={status}", "-o", "Debug::NoLocking=1"] + packages]
+    if pkg_mgr == "dnf":
+        return [["dnf", "download", "--resolve", "--alldeps", "--destdir", directory] + packages]
+    if pkg_mgr == "simulated":
+        return [SIMULATOR + ["download", directory] + packages]
+    raise BundleError(f"bundles are not supported for {pkg_mgr}")
+
+def carry_signatures(directory, sync_dir=PACMAN_SYNC):
+    """Write <package>.sig next to every downloaded package from the PGPSIG in the sync dbs.
+
+    pacman -Sw doesn't fetch detached signatures when the db embeds them, and repo-add only
+    puts a signature into the bundle db when the .sig file is there. Returns the packages
+    that stay unsigned.
+    """
+    wanted = {f for f in os.listdir(directory) if ".pkg.tar." in f and not f.endswith(".sig")
+              and not os.path.exists(os.path.join(directory, f + ".sig"))}
+    for db_path in sorted(glob.glob(os.path.join(sync_dir, "*.db"))):
+        if not wanted:
+            break
+        try:
+            with tarfile.open(db_path, "r:*") as tar:
+                for member in tar:
+                    if not member.name.endswith("/desc"):
+                        continue
+                    fields = _parse_pacman_desc(tar.extractfile(member).read().decode("utf-8", "replace"))
+                    filename = (fields.get("FILENAME") or [None])[0]
+                    if filename not in wanted or not fields.get("PGPSIG"):
+                        continue
+                    with open(os.path.join(directory, filename + ".sig"), "wb") as f:
+                        f.write(base64.b64decode("".join(fields["PGPSIG"]), validate=True))
+                    wanted.discard(filename)
+        except (tarfile.TarError, OSError, binascii.Error) as e:
+            logger.warning(f"Could not read signatures from {db_path}: {e}")
+    for name in sorted(wanted):
+        logger.warning(f"No signature for {name}, installing it from the bundle will fail")
+    return sorted(wanted)
+
+def _deb_packages_index(directory, files):
+    # dpkg-deb reads any control compression, tarfile can't do zstd
+    stanzas = []
+    for name in files:
+        path = os.path.join(directory, name)
+        result = run(["dpkg-deb", "-f", path])
+        if not result.ok:
+            raise BundleError(f"dpkg-deb could not read {name}: {result.stderr.strip()}")
+        stanza = result.stdout.rstrip("\n")
+        stanza += f"\nFilename: ./{name}\nSize: {os.path.getsize(path)}\nSHA256: {_sha256(path)}"
+        stanzas.append(stanza)
+    with open(os.path.join(directory, "Packages"), "w") as f:
+        f.write("\n\n".join(stanzas) + "\n")
+
+def build_repo_index(pkg_mgr, directory, files):
+    if pkg_mgr == "pacman":
+        packages = [os.path.join(directory, f) for f in files if not f.endswith(".sig")]
+        result = run(["repo-add", "--quiet", os.path.join(directory, f"{REPO_NAME}.db.tar.gz")] + packages)
+        if not result.ok:
+            raise BundleError(f"repo-add failed: {result.stderr.strip()}")
+    elif pkg_mgr == "apt":
+        _deb_packages_index(directory, files)
+    elif pkg_mgr == "dnf":
+        result = run(["createrepo_c", "--quiet", directory])
+        if not result.ok:
+            raise BundleError(f"createrepo_c failed: {result.stderr.strip()}")
+    # the simulated manager reads the directory directly
+
+def package_files(pkg_mgr, directory):
+    files = set()
+    for pattern in PACKAGE_GLOBS.get(pkg_mgr, []):
+        files.update(os.path.basename(p) for p in glob.glob(os.path.join(directory, pattern)))
+    return sorted(files)
+
+def write_manifest(directory, distro_mgr, packages, files, max_workers=4):
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        digests = list(pool.map(_sha256, (os.path.join(directory, f) for f in files)))
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "created_at": int(time.time()),
+        "distro": distro_mgr.id,
+        "family": distro_mgr.family,
+        "pkg_mgr": distro_mgr.pkg_mgr,
+        "packages": packages,
+        "files": {f: {"sha256": d, "size": os.path.getsize(os.path.join(directory, f))} for f, d in zip(files, digests)},
+    }
+    tmp_path = os.path.join(directory, MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST))
+    return manifest
+
+def export_bundle(distro_mgr, packages, directory, on_line=None):
+    """Download packages and their full dependency closure into directory and index it."""
+    if not packages:
+        raise BundleError("nothing to export")
+    os.makedirs(directory, exist_ok=True)
+    directory = os.path.abspath(directory)
+    workdir = os.path.join(directory, ".insert-work")
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    try:
+        for cmd in download_commands(distro_mgr.pkg_mgr, packages, directory, workdir):
+            result = run(cmd, on_line=on_line, merge_stderr=True)
+            if not result.ok:
+                raise BundleError(f"{cmd[0]} exited with {result.returncode}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        shutil.rmtree(os.path.join(directory, "partial"), ignore_errors=True)
+    if distro_mgr.pkg_mgr == "pacman":
+        carry_signatures(directory)
+    # package globs also pick up the .sig files, so they are checksummed like the packages
+    files = package_files(distro_mgr.pkg_mgr, directory)
+    build_repo_index(distro_mgr.pkg_mgr, directory, files)
+    manifest = write_manifest(directory, distro_mgr, packages, files)
+    logger.info(f"Exported {len(packages)} packages as {len(files)} files to {directory}")
+    return manifest
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BundleError(f"no readable {MANIFEST} in {directory}: {e}")
+    if manifest.get("version") != BUNDLE_VERSION:
+        raise BundleError(f"unsupported bundle version {manifest.get('version')}")
+    return manifest
+
+def verify_bundle(directory, manifest, max_workers=4):
+    """Names of files that are missing or don't match their checksum."""
+    def check(item):
+        name, info = item
+        path = os.path.join(directory, name)
+        try:
+            return None if _sha256(path) == info["sha256"] else name
+        except OSError:
+            return name
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return sorted(n for n in pool.map(check, manifest["files"].items()) if n)
+
+# install: point the package manager at the bundle only, nothing goes over the network
+
+def install_commands(pkg_mgr, directory, packages, workdir):
+    if pkg_mgr == "pacman":
+        conf = os.path.join(workdir, "pacman.conf")
+        with open(conf, "w") as f:
+            f.write(f"[options]\nArchitecture = auto\nSigLevel = Required DatabaseOptional\n\n"
+                    f"[{REPO_NAME}]\nServer = file://{directory}\n")
+        # the bundle repo gets its own sync dir, the real one is never touched. pacman locks
+        # this private dbpath, so install_bundle holds the real lock around the whole transaction
+        dbpath = os.path.join(workdir, "db")
+        os.makedirs(os.path.join(dbpath, "sync"))
+        os.symlink(PACMAN_LOCAL, os.path.join(dbpath, "local"))
+        base = ["pacman", "--config", conf, "--dbpath", dbpath]
+        return [base + ["-Sy"], base + ["-S", "--needed", "--noconfirm"] + packages]
+    if pkg_mgr == "apt":
+        sources = os.path.join(workdir, "sources.list")
+        with open(sources, "w") as f:
+            f.write(f"deb [trusted=yes] file:{directory} ./\n")
+        lists = os.path.join(workdir, "lists")
+        os.makedirs(os.path.join(lists, "partial"))
+        options = ["-o", f"Dir::Etc::SourceList={sources}", "-o", "Dir::Etc::SourceParts=/dev/null",
+                   "-o", f"Dir::State::Lists={lists}"]
+        return [["apt-get", "update"] + options, ["apt-get", "install", "-y"] + options + packages]
+    if pkg_mgr == "dnf":
+        return [["dnf", "install", "-y", "--disablerepo=*", f"--repofrompath={REPO_NAME},{directory}",
+                 f"--enablerepo={REPO_NAME}"] + packages]
+    if pkg_mgr == "simulated":
+        return [SIMULATOR + ["install", "--from", directory] + packages]
+    raise BundleError(f"bundles are not supported for {pkg_mgr}")
+
+@contextlib.contextmanager
+def transaction_lock(pkg_mgr, lock_path=PACMAN_LOCK):
+    """Hold the system pacman lock, the way pacman itself does, so nothing else writes the local db meanwhile."""
+    if pkg_mgr != "pacman":
+        # apt and dnf take their own system locks
+        yield
+        return
+    try:
+        fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o000)
+    except FileExistsError:
+        raise BundleError(f"pacman database is locked, remove {lock_path} if no package manager is running")
+    except OSError as e:
+        raise BundleError(f"could not lock the pacman database: {e}")
+    os.close(fd)
+    try:
+        yield
+    finally:
+        os.unlink(lock_path)
+
+def install_bundle(distro_mgr, directory, packages, on_line=None):
+    directory = os.path.abspath(directory)
+    manifest = load_manifest(directory)
+    if manifest["pkg_mgr"] != distro_mgr.pkg_mgr:
+        raise BundleError(f"bundle was made for {manifest['pkg_mgr']}, this system uses {distro_mgr.pkg_mgr}")
+    broken = verify_bundle(directory, manifest)
+    if broken:
+        raise BundleError(f"{len(broken)} files are missing or corrupt, first: {broken[0]}")
+    if not packages:
+        return True
+    workdir = os.path.join(directory, ".insert-work")
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    try:
+        with transaction_lock(distro_mgr.pkg_mgr):
+            for cmd in install_commands(distro_mgr.pkg_mgr, directory, packages, workdir):
+                result = run(cmd, on_line=on_line, merge_stderr=True)
+                if not result.ok:
+                    raise BundleError(f"{cmd[0]} exited with {result.returncode}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return True
+
+def needed_from_bundle(manifest, distro_mgr, probe, essentials=True, resolver=None):
+    """What this machine is missing that the bundle can provide, and what it is missing that it can't."""
+    installed = set(distro_mgr.get_installed_packages())
+    is_installed = installed.__contains__ if installed else distro_mgr.is_package_installed
+    wanted = set()
+    for match in probe.find_needed_packages(distro_mgr.family):
+        match.set_installed(is_installed)
+        wanted.update(match.missing_packages)
+    if essentials:
+        wanted.update(p for p in _essentials(probe, distro_mgr.family, resolver) if not is_installed(p))
+    available = set(manifest["packages"])
+    return sorted(wanted & available), sorted(wanted - available)
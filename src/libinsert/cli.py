@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+logger = logging.getLogger("InsertCLI")
+
+def cmd_snapshot(args):
+    from .distro import DistroManager
+    from .probe import SysProbe
+    from .snapshot import capture_snapshot, save_snapshot, SNAPSHOT_SUFFIX
+
+    snapshot = capture_snapshot(DistroManager(), SysProbe(db_path=args.db))
+    path = args.output or f"{snapshot['hostname']}{SNAPSHOT_SUFFIX}"
+    save_snapshot(snapshot, path)
+    print(f"Snapshot written to {path}")
+    return 0
+
+def cmd_fleet(args):
+    from .snapshot import analyze_fleet, format_report
+
+    if not os.path.isdir(args.directory):
+        print(f"Not a directory: {args.directory}", file=sys.stderr)
+        return 1
+    report = analyze_fleet(args.directory, db_path=args.db, jobs=args.jobs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return 0
+
+def cmd_mirrors(args):
+    from .distro import DistroManager
+    from .mirrors import load_candidates, rank_mirrors, apply_mirrors, mirror_source
+
+    pkg_mgr = DistroManager().pkg_mgr
+    if mirror_source(pkg_mgr) is None:
+        print(f"Mirror ranking is not supported for {pkg_mgr}", file=sys.stderr)
+        return 1
+    if args.apply:
+        try:
+            path = apply_mirrors(pkg_mgr, args.urls)
+        except (ValueError, OSError) as e:
+            print(f"Could not apply mirrors: {e}", file=sys.stderr)
+            return 1
+        print(f"Mirror list written to {path}")
+        return 0
+
+    ranked = rank_mirrors(load_candidates(pkg_mgr), concurrency=args.concurrency, timeout=args.timeout)
+    for result in ranked:
+        if result.ok:
+            print(f"{result.latency * 1000:>7.0f} ms {result.throughput / 1e6:>8.2f} MB/s  {result.url}")
+        else:
+            print(f"{'failed':>7}    {'':>8}       {result.url} ({result.error})")
+    return 0
+
+def cmd_prune(args):
+    from .pkgcache import prune_cache
+
+    try:
+        removed, freed = prune_cache(args.pkg_mgr, keep=args.keep)
+    except OSError as e:
+        print(f"Could not prune the package cache: {e}", file=sys.stderr)
+        return 1
+    print(f"Removed {removed} old package files, {freed / 1e6:.1f} MB")
+    return 0
+
+def cmd_metrics(args):
+    from .distro import DistroManager
+    from .probe import SysProbe
+    from .metrics import MetricsFile, collect_scan
+
+    metrics = MetricsFile(directory=args.directory)
+    if metrics.path is None:
+        print("No textfile collector directory found, pass one with --directory or $INSERT_METRICS_DIR", file=sys.stderr)
+        return 1
+    collect_scan(metrics, DistroManager(), SysProbe(db_path=args.db), firmware=not args.no_firmware)
+    path = metrics.write()
+    if path is None:
+        print(f"Could not write {metrics.path}", file=sys.stderr)
+        return 1
+    print(f"Metrics written to {path}")
+    return 0
+
+def cmd_service(args):
+    from .probe import SysProbe
+    from .service import InsertService
+    from .state import ScanState
+    from .history import HistoryStore
+
+    state = ScanState(probe=SysProbe(db_path=args.db), history=HistoryStore())
+    InsertService(state, idle_timeout=args.idle_timeout).run()
+    return 0
+
+def cmd_status_roots(args):
+    from .probe import SysProbe
+    from .snapshot import load_snapshot
+    from .devices import parse_devices
+    from .rootscan import scan_roots, format_results
+
+    if args.hardware:
+        try:
+            snapshot = load_snapshot(args.hardware)
+        except (OSError, ValueError) as e:
+            print(f"Could not load {args.hardware}: {e}", file=sys.stderr)
+            return 1
+        devices = parse_devices(snapshot.get("pci", []), snapshot.get("usb", []))
+    else:
+        # images have no hardware of their own, check them against this machine's
+        devices = SysProbe(db_path=args.db).scan_devices()
+    results = scan_roots(args.root, devices, db_path=args.db, jobs=args.jobs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_results(results))
+    return 1 if any(r["error"] for r in results) else 0
+
+def cmd_status(args):
+    from .distro import DistroManager
+    from .probe import SysProbe
+    from .state import ScanState
+
+    if args.root:
+        return cmd_status_roots(args)
+    state = None
+    try:
+        from .service import ServiceClient
+        state = ServiceClient(autostart=not args.no_autostart).get_state()
+    except ImportError:
+        logger.debug("PyGObject is not available, scanning locally")
+    if state is None:
+        # nothing warm to ask, do the scan here
+        scan = ScanState(DistroManager(), SysProbe(db_path=args.db), index_builder=lambda pkg_mgr: None)
+        scan.refresh()
+        state = scan.to_dict()
+    if args.json:
+        print(json.dumps(state, indent=2))
+        return 0
+    distro = state["distro"]
+    print(f"{distro['id']} ({distro['family']}, {distro['pkg_mgr']}): {len(state['devices'])} devices, "
+          f"{state['installed_count']} packages installed")
+    for match in state["matches"]:
+        status = "installed" if match["is_installed"] else "missing " + " ".join(match["missing_packages"])
+        if match["is_installed"] and match["state"] == "inactive":
+            status = "installed, not loaded"
+        print(f"  {match['driver_name']:<40} {status}")
+    return 0
+
+def cmd_bundle_export(args):
+    from .distro import DistroManager
+    from .probe import SysProbe
+    from .snapshot import find_snapshots, load_snapshot
+    from .bundle import bundle_packages, export_bundle, BundleError
+    from .resolver import build_resolver
+
+    distro_mgr = DistroManager()
+    snapshots = []
+    for directory in args.snapshots:
+        for path in find_snapshots(directory):
+            try:
+                snapshots.append(load_snapshot(path))
+            except (OSError, ValueError) as e:
+                print(f"Skipping {path}: {e}", file=sys.stderr)
+    packages = bundle_packages(SysProbe(db_path=args.db), distro_mgr.family, snapshots,
+                               essentials=not args.no_essentials, extra=args.packages,
+                               resolver=build_resolver(distro_mgr))
+    try:
+        manifest = export_bundle(distro_mgr, packages, args.directory, on_line=print)
+    except (BundleError, OSError) as e:
+        print(f"Could not export bundle: {e}", file=sys.stderr)
+        return 1
+    print(f"{len(packages)} packages from {len(snapshots)} snapshots, {len(manifest['files'])} files "
+          f"({sum(f['size'] for f in manifest['files'].values()) / 1e6:.1f} MB) in {args.directory}")
+    return 0
+
+def cmd_bundle_install(args):
+    from .distro import DistroManager
+    from .probe import SysProbe
+    from .bundle import load_manifest, needed_from_bundle, install_bundle, BundleError
+    from .resolver import build_resolver
+
+    distro_mgr = DistroManager()
+    try:
+        manifest = load_manifest(args.directory)
+        if args.packages:
+            packages, unavailable = args.packages, []
+        else:
+            packages, unavailable = needed_from_bundle(manifest, distro_mgr, SysProbe(db_path=args.db),
+                                                       essentials=not args.no_essentials,
+                                                       resolver=build_resolver(distro_mgr))
+        for package in unavailable:
+            print(f"Not in the bundle: {package}", file=sys.stderr)
+        if not packages:
+            print("Nothing to install")
+        install_bundle(distro_mgr, args.directory, packages, on_line=print)
+    except (BundleError, OSError) as e:
+        print(f"Could not install from bundle: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+def cmd_history_list(args):
+    from .history import HistoryStore
+
+    scans = HistoryStore().scans(limit=args.limit)
+    if args.json:
+        print(json.dumps(scans, indent=2))
+        return 0
+    if not scans:
+        print("No scans recorded yet")
+    for scan in scans:
+        taken = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(scan["taken_at"]))
+        print(f"{scan['id']:>6}  {taken}  {scan['installed_count'] or 0:>6} installed  {', '.join(scan['captured'])}")
+    return 0
+
+def cmd_history_record(args):
+    from .distro import DistroManager
+    from .probe import SysProbe
+    from .history import HistoryStore, make_record, firmware_summary, diff_scans, format_diff
+
+    distro_mgr = DistroManager()
+    probe = SysProbe(db_path=args.db)
+    devices = probe.scan_devices()
+    matches = probe.match_devices(distro_mgr.family, devices)
+    installed = set(distro_mgr.get_installed_packages())
+    for match in matches:
+        match.set_installed(installed.__contains__ if installed else distro_mgr.is_package_installed)
+    probe.check_bindings(matches)
+    orphans = None
+    if not args.no_orphans:
+        names = distro_mgr.get_orphans()
+        sizes = distro_mgr.get_package_sizes(names)
+        orphans = {name: sizes.get(name, 0) for name in names}
+    firmware = None if args.no_firmware else firmware_summary(probe.get_firmware_updates())
+
+    store = HistoryStore(max_bytes=int(args.max_size * 1024 * 1024))
+    previous = store.load()
+    scan_id = store.record(make_record(distro_mgr, devices, matches, len(installed), orphans, firmware))
+    print(f"Recorded scan {scan_id}")
+    if previous is not None:
+        print(format_diff(diff_scans(previous, store.load(scan_id))))
+    return 0
+
+def cmd_history_diff(args):
+    from .history import HistoryStore, format_diff
+
+    store = HistoryStore()
+    if store.latest_id(1) is None and args.old is None:
+        print("Need at least two recorded scans", file=sys.stderr)
+        return 1
+    diff = store.diff(args.old, args.new)
+    print(json.dumps(diff, indent=2) if args.json else format_diff(diff))
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="insert", description="Insert command line tools")
+    parser.add_argument("--db", help="path to drivers.json", default=None)
+    parser.add_argument("-v", "--verbose", action="store_true", help="show debug logging")
+    parser.add_argument("--stats", action="store_true", help="print per-command wall/cpu/rss statistics at the end")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    snap = sub.add_parser("snapshot", help="capture this machine for offline analysis")
+    snap.add_argument("-o", "--output", help="output file (default: <hostname>.insert.json)")
+    snap.set_defaults(func=cmd_snapshot)
+
+    fleet = sub.add_parser("fleet", help="analyze a directory of snapshots")
+    fleet.add_argument("directory")
+    fleet.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: cpu count)")
+    fleet.add_argument("--json", action="store_true", help="print the report as JSON")
+    fleet.set_defaults(func=cmd_fleet)
+
+    mirrors = sub.add_parser("mirrors", help="rank the configured package mirrors by latency and throughput")
+    mirrors.add_argument("-c", "--concurrency", type=int, default=8, help="mirrors probed at once")
+    mirrors.add_argument("-t", "--timeout", type=float, default=5.0, help="seconds per mirror")
+    mirrors.add_argument("--apply", action="store_true", help="write the given urls to the top of the mirror list (needs root)")
+    mirrors.add_argument("urls", nargs="*", help="ranked mirror urls for --apply")
+    mirrors.set_defaults(func=cmd_mirrors)
+
+    prune = sub.add_parser("prune", help="delete cached package files beyond the newest versions (needs root)")
+    prune.add_argument("-k", "--keep", type=int, default=3, help="versions of each package to keep")
+    prune.add_argument("pkg_mgr", choices=["pacman", "apt", "dnf"])
+    prune.set_defaults(func=cmd_prune)
+
+    metrics = sub.add_parser("metrics", help="scan and write node_exporter textfile metrics")
+    metrics.add_argument("-d", "--directory", help="textfile collector directory (default: $INSERT_METRICS_DIR or the usual node_exporter paths)")
+    metrics.add_argument("--no-firmware", action="store_true", help="skip the fwupd check")
+    metrics.set_defaults(func=cmd_metrics)
+
+    service = sub.add_parser("service", help="run the background service that keeps scan results warm on the session bus")
+    service.add_argument("--idle-timeout", type=int, default=0, help="exit after this many seconds without calls (0: stay resident)")
+    service.set_defaults(func=cmd_service)
+
+    status = sub.add_parser("status", help="show detected drivers, from the background service when it is running")
+    status.add_argument("--no-autostart", action="store_true", help="don't D-Bus activate the service, scan locally instead")
+    status.add_argument("--json", action="store_true", help="print the full state as JSON")
+    status.add_argument("--root", action="extend", nargs="+", default=[], metavar="PATH",
+                        help="check the system mounted at PATH instead, from its own package database (repeatable, checked in parallel)")
+    status.add_argument("--hardware", metavar="SNAPSHOT", help="with --root, match drivers against a snapshot's hardware instead of this machine's")
+    status.add_argument("-j", "--jobs", type=int, default=None, help="with --root, worker processes (default: cpu count)")
+    status.set_defaults(func=cmd_status)
+
+    bundle = sub.add_parser("bundle", help="offline driver bundles for machines without network")
+    bundle_sub = bundle.add_subparsers(dest="bundle_command", required=True)
+    export = bundle_sub.add_parser("export", help="download the packages a fleet needs into a local repository (needs root)")
+    export.add_argument("directory")
+    export.add_argument("-s", "--snapshots", action="append", default=[], help="directory of snapshots to cover, repeatable")
+    export.add_argument("-p", "--packages", nargs="*", default=[], help="extra packages to include")
+    export.add_argument("--no-essentials", action="store_true", help="leave out the essentials list")
+    export.set_defaults(func=cmd_bundle_export)
+    install = bundle_sub.add_parser("install", help="install what this machine needs from a bundle, without network (needs root)")
+    install.add_argument("directory")
+    install.add_argument("-p", "--packages", nargs="*", default=[], help="install these instead of what the scan finds")
+    install.add_argument("--no-essentials", action="store_true", help="only install driver packages")
+    install.set_defaults(func=cmd_bundle_install)
+
+    history = sub.add_parser("history", help="recorded scans and what changed between them")
+    history_sub = history.add_subparsers(dest="history_command", required=True)
+    history_list = history_sub.add_parser("list", help="show recorded scans, newest first")
+    history_list.add_argument("-n", "--limit", type=int, default=20)
+    history_list.add_argument("--json", action="store_true")
+    history_list.set_defaults(func=cmd_history_list)
+    record = history_sub.add_parser("record", help="scan now, record it and print what changed")
+    record.add_argument("--no-orphans", action="store_true", help="don't list orphans and their sizes")
+    record.add_argument("--no-firmware", action="store_true", help="skip the fwupd check")
+    record.add_argument("--max-size", type=float, default=8, help="prune the oldest scans beyond this many MiB")
+    record.set_defaults(func=cmd_history_record)
+    diff = history_sub.add_parser("diff", help="changes between two scans (default: the last two)")
+    diff.add_argument("old", type=int, nargs="?")
+    diff.add_argument("new", type=int, nargs="?")
+    diff.add_argument("--json", action="store_true")
+    diff.set_defaults(func=cmd_history_diff)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+    )
+    try:
+        return args.func(args)
+    finally:
+        if args.stats:
+            from .runner import STATS
+            print(STATS.format(), file=sys.stderr)
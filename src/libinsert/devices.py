@@ -0,0 +1,144 @@
+import re
+
+# quoted lspci -nnmm fields, e.g. "Advanced Micro Devices, Inc. [AMD/ATI] [1002]"
+_QUOTED_RE = re.compile(r'"([^"]*)"')
+# trailing numeric id added by -nn
+_NAME_ID_RE = re.compile(r'^(.*?)\s*\[([0-9a-fA-F]{4})\]$')
+_USB_RE = re.compile(r'^Bus (\d+) Device (\d+): ID ([0-9a-fA-F]{4}):([0-9a-fA-F]{4})\s*(.*)$')
+_BRACKET_RE = re.compile(r'\[(.*?)\]')
+
+def _split_name_id(field):
+    match = _NAME_ID_RE.match(field)
+    if match:
+        return match.group(1), match.group(2).lower()
+    return field, None
+
+def _short_name(name):
+    # "Navi 21 [Radeon RX 6800/6800 XT / 6900 XT]" -> "Radeon RX 6800/6800 XT / 6900 XT"
+    match = _BRACKET_RE.search(name)
+    return match.group(1) if match else name
+
+class Device:
+    __slots__ = ("bus", "slot", "class_id", "class_name", "vendor_id", "vendor_name",
+                 "device_id", "device_name", "subsys_vendor_id", "subsys_vendor_name",
+                 "subsys_device_id", "subsys_device_name")
+
+    def __init__(self, bus, slot, class_id=None, class_name="", vendor_id=None, vendor_name="",
+                 device_id=None, device_name="", subsys_vendor_id=None, subsys_vendor_name="",
+                 subsys_device_id=None, subsys_device_name=""):
+        self.bus = bus
+        self.slot = slot
+        self.class_id = class_id
+        self.class_name = class_name
+        self.vendor_id = vendor_id
+        self.vendor_name = vendor_name
+        self.device_id = device_id
+        self.device_name = device_name
+        self.subsys_vendor_id = subsys_vendor_id
+        self.subsys_vendor_name = subsys_vendor_name
+        self.subsys_device_id = subsys_device_id
+        self.subsys_device_name = subsys_device_name
+
+    @property
+    def hardware_id(self):
+        if self.vendor_id and self.device_id:
+            return f"{self.vendor_id}:{self.device_id}"
+        return None
+
+    @property
+    def search_text(self):
+        """Lowercased names the driver database patterns are matched against."""
+        return f"{self.vendor_name} {self.device_name} {self.subsys_vendor_name}".lower()
+
+    @property
+    def short_vendor(self):
+        return _short_name(self.vendor_name)
+
+    @property
+    def short_device(self):
+        return _short_name(self.device_name)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(name) for name in cls.__slots__ if name in data})
+
+    def __repr__(self):
+        return f"Device({self.bus} {self.slot} [{self.class_id}] {self.hardware_id} {self.vendor_name} {self.device_name})"
+
+class DriverMatch:
+    __slots__ = ("driver_name", "category", "packages", "modules", "device", "missing_packages",
+                 "is_installed", "state", "bound_driver")
+
+    def __init__(self, driver_name, category, packages, device, modules=()):
+        self.driver_name = driver_name
+        self.category = category
+        self.packages = packages
+        self.modules = modules
+        self.device = device
+        self.missing_packages = []
+        self.is_installed = False
+        # active/inactive/missing once the sysfs bindings have been read
+        self.state = None
+        self.bound_driver = None
+
+    def set_installed(self, is_installed):
+        """is_installed(package) -> bool, e.g. DistroManager.is_package_installed or set.__contains__."""
+        self.missing_packages = [p for p in self.packages if not is_installed(p)]
+        self.is_installed = not self.missing_packages
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["device"] = self.device.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        match = cls(data["driver_name"], data["category"], data["packages"], Device.from_dict(data["device"]),
+                    data.get("modules", []))
+        for name in ("missing_packages", "is_installed", "state", "bound_driver"):
+            if name in data:
+                setattr(match, name, data[name])
+        return match
+
+    def __repr__(self):
+        return f"DriverMatch({self.driver_name!r}, {self.category}, {self.device.hardware_id})"
+
+def parse_lspci_line(line):
+    """Parse one `lspci -nnmm` line."""
+    line = line.strip()
+    if not line:
+        return None
+    slot = line.split(" ", 1)[0]
+    fields = _QUOTED_RE.findall(line)
+    if len(fields) < 3:
+        return None
+    class_name, class_id = _split_name_id(fields[0])
+    vendor_name, vendor_id = _split_name_id(fields[1])
+    device_name, device_id = _split_name_id(fields[2])
+    subsys_vendor_name, subsys_vendor_id = _split_name_id(fields[3]) if len(fields) > 3 else ("", None)
+    subsys_device_name, subsys_device_id = _split_name_id(fields[4]) if len(fields) > 4 else ("", None)
+    return Device("pci", slot, class_id, class_name, vendor_id, vendor_name, device_id, device_name,
+                  subsys_vendor_id, subsys_vendor_name, subsys_device_id, subsys_device_name)
+
+def parse_lsusb_line(line):
+    """Parse one plain `lsusb` line, the name there is vendor and product run together."""
+    match = _USB_RE.match(line.strip())
+    if not match:
+        return None
+    bus, dev, vendor_id, device_id, name = match.groups()
+    return Device("usb", f"{bus}:{dev}", vendor_id=vendor_id.lower(), device_id=device_id.lower(), device_name=name)
+
+def parse_devices(pci_lines, usb_lines=()):
+    devices = []
+    for line in pci_lines:
+        device = parse_lspci_line(line)
+        if device is not None:
+            devices.append(device)
+    for line in usb_lines:
+        device = parse_lsusb_line(line)
+        if device is not None:
+            devices.append(device)
+    return devices
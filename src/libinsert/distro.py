@@ -1,15 +1,88 @@
 import os
-import subprocess
+import sys
 import logging
+from .pkgcache import plan_prune
+from .runner import run
+from .downloads import apply_overrides
+from .rootfs import read_os_release, read_installed
 
 logger = logging.getLogger("DistroManager")
 
+# a dpkg or rpm lock wait shouldn't hang the ui forever
+QUERY_TIMEOUT = 30
+# INSERT_PKG_MGR=simulated swaps the real package manager for libinsert.simulated
+PKG_MGR_ENV = "INSERT_PKG_MGR"
+PRUNE_TASK = "Old Package Versions"
+# `python -m libinsert`, for the subcommands that have to run elevated
+LIBINSERT = ["env", f"PYTHONPATH={os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}",
+             sys.executable, "-m", "libinsert"]
+SIMULATOR = LIBINSERT[:-1] + ["libinsert.simulated"]
+
+FAMILIES = {
+    "arch": "arch",
+    "manjaro": "arch",
+    "endeavouros": "arch",
+    "fedora": "fedora",
+    "nobara": "fedora",
+    "opensuse": "suse",
+    "opensuse-tumbleweed": "suse",
+    "opensuse-leap": "suse",
+    "debian": "debian",
+    "ubuntu": "debian",
+    "pop": "debian",
+    "linuxmint": "debian",
+    "void": "void",
+    "gentoo": "gentoo",
+    "solus": "solus",
+    "alpine": "alpine"
+}
+
+def parse_os_release(text):
+    """Parse os-release contents into a dict."""
+    info = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        info[key] = value.strip().strip('"').strip("'")
+    return info
+
+_SIZE_UNITS = {"B": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4}
+
+def parse_pacman_sizes(text):
+    """Name -> bytes from `pacman -Qi` output."""
+    sizes = {}
+    name = None
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        key, value = key.strip(), value.strip()
+        if key == "Name":
+            name = value
+        elif key == "Installed Size" and name:
+            number, _, unit = value.partition(" ")
+            try:
+                sizes[name] = int(float(number.replace(",", ".")) * _SIZE_UNITS.get(unit, 1))
+            except ValueError:
+                pass
+    return sizes
+
+def family_for(distro_id):
+    return FAMILIES.get(distro_id, "arch")
+
 class DistroManager:
-    def __init__(self):
+    def __init__(self, root="/"):
+        # a mounted image or container tree, queried through its database files instead of host tools
+        self.root = os.path.abspath(root)
         self.id = self._detect_distro()
         self.family = self._get_family()
         self.pkg_mgr = self._get_pkg_mgr()
-        logger.info(f"Distro detected: {self.id} (Family: {self.family}), Package Manager: {self.pkg_mgr}")
+        logger.info(f"Distro detected: {self.id} (Family: {self.family}), Package Manager: {self.pkg_mgr}"
+                    + (f", root {self.root}" if self.alternate_root else ""))
+
+    @property
+    def alternate_root(self):
+        return self.root != "/"
 
     def _sudo_wrap(self, cmd):
         if os.getuid() == 0:
@@ -17,9 +90,28 @@ class DistroManager:
         logger.debug(f"Wrapping command with pkexec: {' '.join(cmd)}")
         return ["pkexec"] + cmd
 
-    def refresh_database(self):
+    def get_firmware_command(self, action):
+        """fwupdmgr refresh/update, the simulator's firmware-refresh/firmware-update in simulation."""
+        if action not in ("refresh", "update"):
+            raise ValueError(f"unknown firmware action: {action!r}")
+        if self.alternate_root:
+            return []
+        if self.pkg_mgr == "simulated":
+            return SIMULATOR + [f"firmware-{action}"]
+        return self._sudo_wrap(["fwupdmgr", "refresh"] if action == "refresh" else ["fwupdmgr", "update", "-y"])
+
+    def refresh_database(self, accelerate=False):
         """Update package manager database."""
         logger.info(f"Refreshing package database for {self.pkg_mgr}")
+        cmd = self._refresh_command()
+        return apply_overrides(cmd, self.pkg_mgr) if accelerate else cmd
+
+    def _refresh_command(self):
+        if self.alternate_root:
+            # nothing gets changed inside a mounted image
+            return []
+        if self.pkg_mgr == "simulated":
+            return SIMULATOR + ["refresh"]
         if self.pkg_mgr == "pacman":
             return self._sudo_wrap(["pacman", "-Sy"])
         elif self.pkg_mgr == "dnf":
@@ -31,38 +123,14 @@ class DistroManager:
         return []
 
     def _detect_distro(self):
-        if not os.path.exists("/etc/os-release"):
-            return "unknown"
-        
-        with open("/etc/os-release") as f:
-            lines = f.readlines()
-            for line in lines:
-                if line.startswith("ID="):
-                    return line.strip().split("=")[1].strip('"')
-        return "unknown"
+        return parse_os_release(read_os_release(self.root)).get("ID", "unknown")
 
     def _get_family(self):
-        families = {
-            "arch": "arch",
-            "manjaro": "arch",
-            "endeavouros": "arch",
-            "fedora": "fedora",
-            "nobara": "fedora",
-            "opensuse": "suse",
-            "opensuse-tumbleweed": "suse",
-            "opensuse-leap": "suse",
-            "debian": "debian",
-            "ubuntu": "debian",
-            "pop": "debian",
-            "linuxmint": "debian",
-            "void": "void",
-            "gentoo": "gentoo",
-            "solus": "solus",
-            "alpine": "alpine"
-        }
-        return families.get(self.id, "arch")
+        return family_for(self.id)
 
     def _get_pkg_mgr(self):
+        if os.environ.get(PKG_MGR_ENV) and not self.alternate_root:
+            return os.environ[PKG_MGR_ENV]
         mapping = {
             "arch": "pacman",
             "manjaro": "pacman",
@@ -78,7 +146,15 @@ class DistroManager:
         }
         return mapping.get(self.id, mapping.get(self.family, "unknown"))
 
-    def get_install_command(self, packages):
+    def get_install_command(self, packages, accelerate=False):
+        cmd = self._install_command(packages)
+        return apply_overrides(cmd, self.pkg_mgr) if accelerate else cmd
+
+    def _install_command(self, packages):
+        if self.alternate_root:
+            return []
+        if self.pkg_mgr == "simulated":
+            return SIMULATOR + ["install"] + packages
         if self.pkg_mgr == "pacman":
             return self._sudo_wrap(["pacman", "-S", "--needed", "--noconfirm"] + packages)
         elif self.pkg_mgr == "dnf":
@@ -96,6 +172,10 @@ class DistroManager:
         return []
 
     def get_query_command(self, package):
+        if self.alternate_root:
+            return []
+        if self.pkg_mgr == "simulated":
+            return SIMULATOR + ["query", package]
         if self.pkg_mgr == "pacman":
             return ["pacman", "-Qs", f"^{package}$"]
         elif self.pkg_mgr == "dnf":
@@ -113,16 +193,54 @@ class DistroManager:
         return []
 
     def is_package_installed(self, package):
+        if self.alternate_root:
+            return package in self.get_installed_packages()
         cmd = self.get_query_command(package)
         if not cmd:
             return False
         try:
-            subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            return True
+            return run(cmd, timeout=QUERY_TIMEOUT, capture=False).ok
         except:
             return False
 
+    def get_installed_packages_command(self):
+        if self.alternate_root:
+            return []
+        if self.pkg_mgr == "simulated":
+            return SIMULATOR + ["list-installed"]
+        if self.pkg_mgr == "pacman":
+            return ["pacman", "-Qq"]
+        elif self.pkg_mgr in ("dnf", "zypper"):
+            return ["rpm", "-qa", "--qf", "%{NAME}\\n"]
+        elif self.pkg_mgr == "apt":
+            return ["dpkg-query", "-W", "-f", "${Package}\\n"]
+        elif self.pkg_mgr == "apk":
+            return ["apk", "info"]
+        return []
+
+    def get_installed_packages(self):
+        """Names of every installed package, in one call."""
+        if self.alternate_root:
+            installed = read_installed(self.pkg_mgr, self.root)
+            return sorted(installed[0]) if installed else []
+        cmd = self.get_installed_packages_command()
+        if not cmd:
+            return []
+        try:
+            result = run(cmd, timeout=QUERY_TIMEOUT)
+            if not result.ok:
+                logger.error(f"Listing installed packages failed with code {result.returncode}")
+                return []
+            return [line.strip() for line in result.stdout.split("\n") if line.strip()]
+        except Exception as e:
+            logger.error(f"Failed to list installed packages: {e}")
+            return []
+
     def get_orphans_command(self):
+        if self.alternate_root:
+            return []
+        if self.pkg_mgr == "simulated":
+            return SIMULATOR + ["orphans"]
         if self.pkg_mgr == "pacman":
             return ["pacman", "-Qdtq"]
         elif self.pkg_mgr == "dnf":
@@ -136,12 +254,53 @@ class DistroManager:
         if not cmd:
             return []
         try:
-            output = subprocess.check_output(cmd, text=True, stderr=subprocess.DEVNULL)
-            return [line.strip() for line in output.strip().split("\n") if line.strip()]
+            result = run(cmd, timeout=QUERY_TIMEOUT)
+            if not result.ok:
+                return []
+            return [line.strip() for line in result.stdout.strip().split("\n") if line.strip()]
         except:
             return []
 
+    def get_package_sizes_command(self, packages):
+        if self.alternate_root:
+            return []
+        if self.pkg_mgr == "simulated":
+            return SIMULATOR + ["sizes"] + packages
+        if self.pkg_mgr == "pacman":
+            return ["pacman", "-Qi"] + packages
+        elif self.pkg_mgr in ("dnf", "zypper"):
+            return ["rpm", "-q", "--qf", "%{NAME}\\t%{SIZE}\\n"] + packages
+        elif self.pkg_mgr == "apt":
+            return ["dpkg-query", "-W", "-f", "${Package}\\t${Installed-Size}\\n"] + packages
+        return []
+
+    def get_package_sizes(self, packages):
+        """Installed size in bytes of each package, one call for all of them."""
+        cmd = self.get_package_sizes_command(list(packages)) if packages else []
+        if not cmd:
+            return {}
+        try:
+            # missing packages make these exit non-zero, the rest of the output is still good
+            # pacman translates the field names
+            result = run(cmd, timeout=QUERY_TIMEOUT, env=dict(os.environ, LC_ALL="C"))
+        except Exception as e:
+            logger.error(f"Failed to read package sizes: {e}")
+            return {}
+        if self.pkg_mgr == "pacman":
+            return parse_pacman_sizes(result.stdout)
+        sizes = {}
+        for line in result.stdout.splitlines():
+            name, _, size = line.partition("\t")
+            if size.strip().isdigit():
+                # dpkg counts KiB
+                sizes[name.strip()] = int(size) * (1024 if self.pkg_mgr == "apt" else 1)
+        return sizes
+
     def get_remove_command(self, packages):
+        if self.alternate_root:
+            return []
+        if self.pkg_mgr == "simulated":
+            return SIMULATOR + ["remove"] + packages
         if self.pkg_mgr == "pacman":
             return self._sudo_wrap(["pacman", "-Rs", "--noconfirm"] + packages)
         elif self.pkg_mgr == "dnf":
@@ -158,16 +317,37 @@ class DistroManager:
             return self._sudo_wrap(["apk", "del"] + packages)
         return []
 
-    def get_cleanup_tasks(self):
+    def can_prune(self):
+        return not self.alternate_root and self.pkg_mgr in ("pacman", "apt", "dnf")
+
+    def get_prune_command(self, keep=3):
+        """`libinsert prune` plans the cache again as root and unlinks the files itself, no rm argv to outgrow."""
+        if not self.can_prune():
+            return []
+        return self._sudo_wrap(LIBINSERT + ["prune", "--keep", str(keep), self.pkg_mgr])
+
+    def get_prune_task(self, keep=3):
+        paths, freed = plan_prune(self.pkg_mgr, keep=keep)
+        cmd = self.get_prune_command(keep) if paths else []
+        return {"name": PRUNE_TASK, "cmd": cmd, "description": f"Keep the {keep} newest cached versions of each package", "reclaimable": freed}
+
+    def get_cleanup_tasks(self, prune=True):
+        # "paths" is what the space estimator walks to show reclaimable bytes.
+        # prune=False leaves out the old versions task, planning it lists and sorts the whole package cache
+        if self.alternate_root:
+            return []
+        if self.pkg_mgr == "simulated":
+            # nothing on the real system gets cleaned in simulation
+            return [{"name": "Package Cache", "cmd": SIMULATOR + ["clean"], "description": "Clear the simulated package cache"}]
         tasks = []
-        if self.pkg_mgr == "pacman":
-            tasks.append({"name": "Package Cache", "cmd": self._sudo_wrap(["pacman", "-Sc", "--noconfirm"]), "description": "Clear old package downloads"})
-        elif self.pkg_mgr == "dnf":
-            tasks.append({"name": "DNF Cache", "cmd": self._sudo_wrap(["dnf", "clean", "all"]), "description": "Clear DNF metadata and cache"})
+        if prune and self.can_prune():
+            tasks.append(self.get_prune_task())
+        if self.pkg_mgr == "dnf":
+            tasks.append({"name": "DNF Cache", "cmd": self._sudo_wrap(["dnf", "clean", "all"]), "description": "Clear DNF metadata and cache", "paths": ["/var/cache/dnf", "/var/cache/libdnf5"]})
         elif self.pkg_mgr == "apt":
-            tasks.append({"name": "APT Cache", "cmd": self._sudo_wrap(["apt", "clean"]), "description": "Clear APT package cache"})
+            tasks.append({"name": "APT Cache", "cmd": self._sudo_wrap(["apt", "clean"]), "description": "Clear APT package cache", "paths": ["/var/cache/apt/archives"]})
         if os.path.exists("/usr/bin/journalctl"):
-            tasks.append({"name": "System Logs", "cmd": self._sudo_wrap(["journalctl", "--vacuum-time=7d"]), "description": "Remove logs older than 7 days"})
-        tasks.append({"name": "Temporary Files", "cmd": self._sudo_wrap(["rm", "-rf", "/tmp/*"]), "description": "Clear system /tmp directory"})
+            tasks.append({"name": "System Logs", "cmd": self._sudo_wrap(["journalctl", "--vacuum-time=7d"]), "description": "Remove logs older than 7 days", "paths": ["/var/log/journal"]})
+        tasks.append({"name": "Temporary Files", "cmd": self._sudo_wrap(["rm", "-rf", "/tmp/*"]), "description": "Clear system /tmp directory", "paths": ["/tmp"]})
         
         return tasks
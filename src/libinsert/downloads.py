@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import time
+import atexit
+import hashlib
+import logging
+import tempfile
+from .runner import run
+from .space import SpaceEstimator
+from .pkgcache import cache_dirs
+
+logger = logging.getLogger("Downloads")
+
+TUNED_PARALLEL = 10
+PACMAN_CONF = "/etc/pacman.conf"
+DNF_CONF = "/etc/dnf/dnf.conf"
+THROUGHPUT_FILE = os.path.expanduser("~/.cache/insert-source/throughput.json")
+
+_PACMAN_PARALLEL_RE = re.compile(r'^\s*ParallelDownloads\s*=\s*(\d+)', re.MULTILINE)
+_DNF_PARALLEL_RE = re.compile(r'^\s*max_parallel_downloads\s*=\s*(\d+)', re.MULTILINE)
+_APT_QUEUE_RE = re.compile(r'^Acquire::Queue-Mode "([^"]*)";', re.MULTILINE)
+_DNF_KEEPCACHE_RE = re.compile(r'^\s*keepcache\s*=\s*(\S+)', re.MULTILINE)
+# package managers detect_parallelism knows about
+TUNABLE = ("pacman", "dnf", "apt")
+# (parallel, source digest) -> config copy, one file per process however many transactions run
+_tuned_confs = {}
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def detect_parallelism(pkg_mgr):
+    """What the system config currently asks for, as {"setting", "value", "source"}."""
+    if pkg_mgr == "pacman":
+        match = _PACMAN_PARALLEL_RE.search(_read(PACMAN_CONF))
+        # commented out or missing means one download at a time
+        return {"setting": "ParallelDownloads", "value": int(match.group(1)) if match else 1, "source": PACMAN_CONF}
+    if pkg_mgr == "dnf":
+        match = _DNF_PARALLEL_RE.search(_read(DNF_CONF))
+        return {"setting": "max_parallel_downloads", "value": int(match.group(1)) if match else 3, "source": DNF_CONF}
+    if pkg_mgr == "apt":
+        value = "host"
+        try:
+            result = run(["apt-config", "dump"], timeout=10)
+            match = _APT_QUEUE_RE.search(result.stdout)
+            if match:
+                value = match.group(1)
+        except OSError:
+            pass
+        return {"setting": "Acquire::Queue-Mode", "value": value, "source": "apt-config"}
+    return None
+
+def _remove_tuned_confs():
+    for path in _tuned_confs.values():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    _tuned_confs.clear()
+
+atexit.register(_remove_tuned_confs)
+
+def _tuned_pacman_conf(parallel):
+    """Copy of pacman.conf with ParallelDownloads set, the system file is left alone.
+
+    Written once per process and reused while pacman.conf stays the same, removed at exit.
+    """
+    text = _read(PACMAN_CONF)
+    key = (parallel, hashlib.sha256(text.encode()).hexdigest())
+    path = _tuned_confs.get(key)
+    if path is not None and os.path.exists(path):
+        return path
+    line = f"ParallelDownloads = {parallel}"
+    if re.search(r'^\s*#?\s*ParallelDownloads\s*=.*$', text, re.MULTILINE):
+        text = re.sub(r'^\s*#?\s*ParallelDownloads\s*=.*$', line, text, count=1, flags=re.MULTILINE)
+    else:
+        text = re.sub(r'^\[options\]\s*$', f"[options]\n{line}", text, count=1, flags=re.MULTILINE)
+    fd, path = tempfile.mkstemp(prefix="insert-pacman-", suffix=".conf")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    # pacman runs as root, but keep it readable for --print runs as the user
+    os.chmod(path, 0o644)
+    _tuned_confs[key] = path
+    return path
+
+def tuned_overrides(pkg_mgr, parallel=TUNED_PARALLEL):
+    """Command-line options that raise download parallelism for one transaction."""
+    if pkg_mgr == "pacman":
+        if not os.path.exists(PACMAN_CONF):
+            return []
+        return ["--config", _tuned_pacman_conf(parallel)]
+    if pkg_mgr == "dnf":
+        return [f"--setopt=max_parallel_downloads={parallel}"]
+    if pkg_mgr == "apt":
+        # one queue per host plus deep http pipelining, apt has no per-host parallelism knob
+        return ["-o", "Acquire::Queue-Mode=host", "-o", f"Acquire::http::Pipeline-Depth={parallel}"]
+    return []
+
+def apply_overrides(cmd, pkg_mgr, parallel=TUNED_PARALLEL):
+    """Insert the overrides right after the package manager binary, wrappers like pkexec stay in front."""
+    for i, arg in enumerate(cmd):
+        if os.path.basename(arg) == pkg_mgr:
+            overrides = tuned_overrides(pkg_mgr, parallel)
+            if overrides:
+                logger.info(f"Download tuning for {pkg_mgr}: {' '.join(overrides)}")
+            return cmd[:i + 1] + overrides + cmd[i + 1:]
+    return cmd
+
+def keeps_downloads(pkg_mgr):
+    """False when the package manager deletes packages after installing them, dnf's keepcache=0 default."""
+    if pkg_mgr == "dnf":
+        match = _DNF_KEEPCACHE_RE.search(_read(DNF_CONF))
+        return bool(match) and match.group(1).lower() in ("1", "true", "yes")
+    return True
+
+class ThroughputLog:
+    """Bytes landing in the package cache per second of transaction, kept per mode.
+
+    This is cache growth over the whole transaction, install time included, not the
+    line rate of the downloads. Package managers that delete packages after installing
+    them (dnf unless keepcache is on) are not measured at all.
+    """
+
+    def __init__(self, path=THROUGHPUT_FILE):
+        self.path = path
+        self.estimator = SpaceEstimator()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def cache_bytes(self, pkg_mgr):
+        # fresh estimator every time, cached directory totals would hide new downloads
+        self.estimator.clear()
+        return sum(self.estimator.estimate(cache_dirs(pkg_mgr)).values())
+
+    def start(self, pkg_mgr):
+        if not keeps_downloads(pkg_mgr):
+            logger.info(f"{pkg_mgr} does not keep downloaded packages, throughput is not measured")
+            return None
+        return {"pkg_mgr": pkg_mgr, "bytes": self.cache_bytes(pkg_mgr), "time": time.monotonic()}
+
+    def finish(self, mark, tuned):
+        downloaded = self.cache_bytes(mark["pkg_mgr"]) - mark["bytes"]
+        elapsed = time.monotonic() - mark["time"]
+        if downloaded <= 0 or elapsed <= 0:
+            return None
+        rate = downloaded / elapsed
+        mode = "tuned" if tuned else "default"
+        data = self._load()
+        entry = data.setdefault(mode, {"transactions": 0, "bytes": 0, "seconds": 0.0})
+        entry["transactions"] += 1
+        entry["bytes"] += downloaded
+        entry["seconds"] += elapsed
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+        logger.info(f"Downloaded {downloaded} bytes in {elapsed:.1f}s ({rate / 1e6:.2f} MB/s, {mode})")
+        return rate
+
+    def summary(self):
+        """e.g. "default 3.1 MB/s, tuned 9.8 MB/s", or None before any measurement."""
+        data = self._load()
+        parts = []
+        for mode in ("default", "tuned"):
+            entry = data.get(mode)
+            if entry and entry["seconds"] > 0:
+                parts.append(f"{mode} {entry['bytes'] / entry['seconds'] / 1e6:.1f} MB/s")
+        return ", ".join(parts) or None
@@ -0,0 +1,168 @@
+"""Flatpak apps next to the native packages: installed state from the installation
+directories, search and name resolution from the appstream data remotes already downloaded.
+"""
+import os
+import re
+import glob
+import gzip
+import shutil
+import logging
+import platform
+import xml.etree.ElementTree as ET
+from .runner import run
+from .pkgindex import PackageIndex
+from .resolver import Resolver, load_aliases, ALIASES_FILE
+
+logger = logging.getLogger("Flatpak")
+
+FAMILY = "flatpak"
+SYSTEM_DIR = "var/lib/flatpak"
+USER_DIR = os.path.expanduser("~/.local/share/flatpak")
+LIST_TIMEOUT = 30
+# reverse-DNS with at least three parts, the same rule flatpak itself applies
+_APP_ID_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_-]*(\.[A-Za-z_][A-Za-z0-9_-]*){2,}$')
+_REMOTE_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+def available():
+    return shutil.which("flatpak") is not None
+
+def enabled(distro_mgr):
+    """Flatpak next to this package manager, never in simulation where nothing may touch the system."""
+    return distro_mgr.pkg_mgr != "simulated" and available()
+
+def installations(root="/", user_dir=USER_DIR):
+    """The system installation under root, then the user's."""
+    dirs = [os.path.join(root, SYSTEM_DIR)]
+    if user_dir:
+        dirs.append(user_dir)
+    return dirs
+
+def read_installed(dirs):
+    """App ids with a deployed `current` ref in any of the installations, None if none could be read."""
+    apps = set()
+    found = False
+    for directory in dirs:
+        app_dir = os.path.join(directory, "app")
+        try:
+            entries = os.listdir(app_dir)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.warning(f"Cannot read {app_dir}: {e}")
+            continue
+        found = True
+        for app_id in entries:
+            # a half-removed app leaves its directory without the current link
+            if os.path.lexists(os.path.join(app_dir, app_id, "current")):
+                apps.add(app_id)
+    return apps if found else None
+
+def list_command():
+    return ["flatpak", "list", "--app", "--columns=application"]
+
+def installed_apps(dirs=None):
+    """Installed app ids, from the directories when they are readable, else one `flatpak list` call."""
+    apps = read_installed(dirs if dirs is not None else installations())
+    if apps is not None or not available():
+        return apps or set()
+    try:
+        result = run(list_command(), timeout=LIST_TIMEOUT)
+    except OSError as e:
+        logger.error(f"Failed to list flatpaks: {e}")
+        return set()
+    if not result.ok:
+        logger.error(f"flatpak list failed with code {result.returncode}")
+        return set()
+    return {line.strip() for line in result.stdout.split("\n") if line.strip()}
+
+def slug(name):
+    """"OBS Studio" -> "obs-studio", the way the optional tools are named."""
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip("-")
+
+def appstream_files(dirs, arch=None):
+    arch = arch or platform.machine()
+    files = []
+    for directory in dirs:
+        for name in ("appstream.xml.gz", "appstream.xml"):
+            files += sorted(glob.glob(os.path.join(directory, "appstream", "*", arch, "active", name)))
+    return files
+
+def _app_id(component):
+    # <bundle type="flatpak">app/org.example.App/x86_64/stable</bundle> is exact, <id> may carry .desktop
+    bundle = component.findtext("bundle")
+    if bundle and bundle.startswith("app/"):
+        return bundle.split("/")[1]
+    app_id = component.findtext("id") or ""
+    return app_id[:-len(".desktop")] if app_id.endswith(".desktop") else app_id
+
+def load_appstream(index, path):
+    remote = path.split(os.sep + "appstream" + os.sep, 1)[1].split(os.sep, 1)[0]
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rb") as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag != "component":
+                    continue
+                app_id = _app_id(elem)
+                # untranslated name and summary, the xml:lang ones come after it
+                name = next((e.text for e in elem.findall("name") if not e.attrib), None) or app_id
+                summary = next((e.text for e in elem.findall("summary") if not e.attrib), None) or ""
+                if app_id and _APP_ID_RE.match(app_id) and elem.get("type", "desktop-application") in ("desktop-application", "desktop", "console-application"):
+                    index.add(app_id, f"{name}: {summary}", remote)
+                    index.add_provides(app_id, [slug(name), app_id.rsplit(".", 1)[-1].lower()])
+                elem.clear()
+    except (ET.ParseError, OSError, EOFError) as e:
+        logger.warning(f"Skipping appstream {path}: {e}")
+    return index
+
+def build_index(dirs=None, arch=None):
+    """PackageIndex of every app the configured remotes offer, names are app ids and repos are remotes."""
+    index = PackageIndex()
+    for path in appstream_files(dirs if dirs is not None else installations(), arch):
+        load_appstream(index, path)
+    index.finish()
+    logger.info(f"Indexed {len(index)} flatpak apps")
+    return index
+
+def build_resolver(index, installed, aliases_path=ALIASES_FILE):
+    """Resolver for the flatpak names in aliases.json and the appstream names, None without appstream data."""
+    if not len(index):
+        # an empty index would make the resolver accept every name
+        return None
+    aliases, _ = load_aliases(aliases_path)
+    return Resolver(FAMILY, FAMILY, set(index.names), index.provides, installed, aliases)
+
+def _apps(apps):
+    if not isinstance(apps, list) or not apps:
+        raise ValueError("expected a non-empty app list")
+    for app_id in apps:
+        if not isinstance(app_id, str) or not _APP_ID_RE.match(app_id):
+            raise ValueError(f"invalid flatpak app id: {app_id!r}")
+    return apps
+
+def install_command(remote, apps):
+    """All apps in one flatpak transaction, shared runtimes are resolved and downloaded once."""
+    if not isinstance(remote, str) or not _REMOTE_RE.match(remote):
+        raise ValueError(f"invalid flatpak remote: {remote!r}")
+    return ["flatpak", "install", "-y", "--noninteractive", "--system", remote] + _apps(apps)
+
+def remove_command(apps):
+    return ["flatpak", "uninstall", "-y", "--noninteractive", "--system"] + _apps(apps)
+
+def refresh_command():
+    # only the appstream data, app updates stay the user's call
+    return ["flatpak", "update", "-y", "--noninteractive", "--system", "--appstream"]
+
+def batch_operations(operations):
+    """Adjacent flatpak installs from one remote, and adjacent removals, merged into single transactions."""
+    batched = []
+    for op, args in operations:
+        if batched and op in ("flatpak_install", "flatpak_remove") and batched[-1][0] == op \
+                and batched[-1][1].get("remote") == args.get("remote") and isinstance(args.get("apps"), list):
+            previous = batched[-1][1]
+            apps = list(previous.get("apps") or [])
+            apps += [a for a in args.get("apps") or [] if a not in apps]
+            batched[-1] = (op, dict(previous, apps=apps))
+        else:
+            batched.append((op, args))
+    return batched
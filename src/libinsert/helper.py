@@ -0,0 +1,356 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import socket
+import secrets
+import struct
+import logging
+import argparse
+import threading
+import subprocess
+from .runner import run
+from .priority import MODES, background_command
+from .distro import PRUNE_TASK
+from . import flatpak
+
+logger = logging.getLogger("PrivHelper")
+
+# package names as the package managers accept them, never an option
+_PACKAGE_RE = re.compile(r'^[A-Za-z0-9@_+][A-Za-z0-9@._+:-]*$')
+_MIRROR_RE = re.compile(r'^https?://[^\s]+$')
+START_TIMEOUT = 120
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _packages(args):
+    packages = args.get("packages")
+    if not isinstance(packages, list) or not packages:
+        raise ValueError("expected a non-empty package list")
+    for pkg in packages:
+        if not isinstance(pkg, str) or not _PACKAGE_RE.match(pkg):
+            raise ValueError(f"invalid package name: {pkg!r}")
+    return packages
+
+def _cleanup(distro_mgr, args):
+    # the prune command plans the cache by itself, no need to list it here as well
+    if args.get("name") == PRUNE_TASK and distro_mgr.can_prune():
+        return distro_mgr.get_prune_command()
+    for task in distro_mgr.get_cleanup_tasks(prune=False):
+        if task["name"] == args.get("name"):
+            return task["cmd"]
+    raise ValueError(f"unknown cleanup task: {args.get('name')!r}")
+
+def _mirrors(distro_mgr, args):
+    urls = args.get("urls")
+    if not isinstance(urls, list) or not urls:
+        raise ValueError("expected a non-empty mirror list")
+    for url in urls:
+        if not isinstance(url, str) or not _MIRROR_RE.match(url):
+            raise ValueError(f"invalid mirror url: {url!r}")
+    # the module itself refuses anything that is not already in the mirror list
+    return distro_mgr._sudo_wrap(["env", f"PYTHONPATH={SRC_DIR}", sys.executable, "-m", "libinsert",
+                                  "mirrors", "--apply", "--"] + urls)
+
+def _flatpak(distro_mgr, cmd):
+    # the simulated backend has no flatpak counterpart, the real one must not run
+    if distro_mgr.pkg_mgr == "simulated":
+        raise ValueError("flatpak is not available in simulation")
+    return distro_mgr._sudo_wrap(cmd)
+
+# the only things the helper will ever run, arguments are validated before a command is built
+OPERATIONS = {
+    "refresh": lambda dm, args: dm.refresh_database(accelerate=args.get("accelerate") is True),
+    "install": lambda dm, args: dm.get_install_command(_packages(args), accelerate=args.get("accelerate") is True),
+    "remove": lambda dm, args: dm.get_remove_command(_packages(args)),
+    "firmware_refresh": lambda dm, args: dm.get_firmware_command("refresh"),
+    "firmware_update": lambda dm, args: dm.get_firmware_command("update"),
+    "cleanup": _cleanup,
+    "mirrors": _mirrors,
+    "flatpak_install": lambda dm, args: _flatpak(dm, flatpak.install_command(args.get("remote"), args.get("apps"))),
+    "flatpak_remove": lambda dm, args: _flatpak(dm, flatpak.remove_command(args.get("apps"))),
+    "flatpak_refresh": lambda dm, args: _flatpak(dm, flatpak.refresh_command()),
+}
+
+def build_operation(distro_mgr, op, args=None):
+    """Turn a typed operation into a command line, sudo-wrapped unless we are root."""
+    if op not in OPERATIONS:
+        raise ValueError(f"unknown operation: {op!r}")
+    cmd = OPERATIONS[op](distro_mgr, args or {})
+    if not cmd:
+        raise ValueError(f"operation {op} is not supported on this system")
+    if (args or {}).get("background") is True:
+        mode = args.get("priority", "auto")
+        if mode not in MODES:
+            raise ValueError(f"invalid priority mode: {mode!r}")
+        cmd = background_command(cmd, mode)
+    return cmd
+
+def _peer_uid(conn):
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    pid, uid, gid = struct.unpack("3i", creds)
+    return uid
+
+class HelperServer:
+    """Runs as root for one session and executes queued operations in order."""
+
+    def __init__(self, socket_path, uid, distro_mgr):
+        self.socket_path = socket_path
+        self.uid = uid
+        self.distro_mgr = distro_mgr
+        self.cancel_event = threading.Event()
+        # requests sharing a batch id stop at the first one that fails or gets cancelled
+        self._batch = None
+        self._batch_failed = False
+
+    def serve(self):
+        # abstract namespace: nothing on disk, so there is no path the user could swap for a symlink
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind("\0" + self.socket_path)
+        except OSError as e:
+            # somebody else already holds the name, do not serve anything
+            logger.error(f"Cannot bind helper socket: {e}")
+            server.close()
+            return 1
+        server.listen(1)
+        logger.info(f"Helper listening on @{self.socket_path}")
+        try:
+            while True:
+                conn, _ = server.accept()
+                # anyone can connect to an abstract socket, only our user gets a session
+                if _peer_uid(conn) in (self.uid, 0):
+                    break
+                logger.error("Rejected connection from a different user")
+                conn.close()
+        finally:
+            server.close()
+
+        with conn:
+            self._handle(conn)
+        return 0
+
+    def _send(self, wfile, message):
+        wfile.write(json.dumps(message) + "\n")
+        wfile.flush()
+
+    def _handle(self, conn):
+        rfile = conn.makefile("r", encoding="utf-8")
+        wfile = conn.makefile("w", encoding="utf-8")
+        pending = queue.Queue()
+
+        # keep reading while an operation runs so the client can pipeline requests and cancel
+        def reader():
+            for line in rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    logger.warning("Dropping malformed request")
+                    continue
+                if request.get("op") == "cancel":
+                    self.cancel_event.set()
+                else:
+                    pending.put(request)
+            pending.put(None)
+
+        threading.Thread(target=reader, daemon=True).start()
+        while True:
+            request = pending.get()
+            if request is None or request.get("op") == "shutdown":
+                logger.info("Session over, helper exiting")
+                return
+            self._run(wfile, request)
+
+    def _start_request(self, request):
+        """False when an earlier step of the same batch already failed or was cancelled."""
+        batch = request.get("batch")
+        if batch is None or batch != self._batch:
+            self._batch = batch
+            self._batch_failed = False
+            self.cancel_event.clear()
+            return True
+        # a cancel that came in between two steps counts for the rest of the batch
+        if self.cancel_event.is_set():
+            self._batch_failed = True
+        return not self._batch_failed
+
+    def _run(self, wfile, request):
+        req_id = request.get("id")
+        if not self._start_request(request):
+            self._send(wfile, {"id": req_id, "event": "error", "message": "Skipped, an earlier step failed or was cancelled"})
+            return
+        try:
+            cmd = build_operation(self.distro_mgr, request.get("op"), request.get("args"))
+        except ValueError as e:
+            self._batch_failed = True
+            self._send(wfile, {"id": req_id, "event": "error", "message": str(e)})
+            return
+        logger.info(f"Running {request.get('op')}: {' '.join(cmd)}")
+
+        def on_line(line):
+            msg = line.strip()
+            if msg:
+                self._send(wfile, {"id": req_id, "event": "progress", "line": msg})
+
+        try:
+            background = (request.get("args") or {}).get("background") is True
+            result = run(cmd, cancel_event=self.cancel_event, on_line=on_line, capture=False, merge_stderr=True,
+                         measure_throttle=background)
+            if background:
+                self._send(wfile, {"id": req_id, "event": "throttled", "seconds": result.throttled_time,
+                                   "wall": result.wall_time})
+            if not result.ok:
+                self._batch_failed = True
+            if result.cancelled:
+                self._send(wfile, {"id": req_id, "event": "error", "message": "Cancelled"})
+            else:
+                self._send(wfile, {"id": req_id, "event": "finished", "returncode": result.returncode})
+        except (OSError, ValueError) as e:
+            self._batch_failed = True
+            self._send(wfile, {"id": req_id, "event": "error", "message": str(e)})
+
+class HelperClient:
+    """Starts the helper once through pkexec and sends it operations over its socket."""
+
+    def __init__(self):
+        self.process = None
+        self.sock = None
+        self.wfile = None
+        self._next_id = 0
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def is_running(self):
+        return self.sock is not None and self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """Blocks until the user has authenticated and the helper accepted our connection."""
+        with self._lock:
+            if self.is_running():
+                return
+            # abstract socket name, the helper binds it itself and nothing is created on disk
+            name = f"insert-helper-{secrets.token_hex(16)}"
+            cmd = ["pkexec", "env", f"PYTHONPATH={SRC_DIR}", sys.executable, "-m", "libinsert.helper",
+                   "--socket", name, "--uid", str(os.getuid())]
+            logger.info("Starting privileged helper")
+            self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL)
+
+            deadline = time.monotonic() + START_TIMEOUT
+            while True:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.connect("\0" + name)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    sock.close()
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"helper exited with code {self.process.returncode} (authentication cancelled?)")
+                if time.monotonic() > deadline:
+                    self.process.kill()
+                    raise RuntimeError("timed out waiting for the privileged helper")
+                time.sleep(0.05)
+
+            # the name is visible in our command line, make sure it is really root on the other end
+            if _peer_uid(sock) != 0:
+                sock.close()
+                self.process.kill()
+                raise RuntimeError("privileged helper socket is not owned by root")
+            self.sock = sock
+            self.wfile = self.sock.makefile("w", encoding="utf-8")
+            threading.Thread(target=self._read_events, daemon=True).start()
+
+    def submit(self, op, args, callback):
+        """Queue an operation, callback(event_type, data) gets progress/throttled/finished/error."""
+        return self.submit_batch([(op, args, callback)])[0]
+
+    def submit_batch(self, requests):
+        """Queue (op, args, callback) requests that stop at the first failed or cancelled one."""
+        failed = []
+        ids = []
+        with self._lock:
+            batch = self._next_id + 1
+            for op, args, callback in requests:
+                self._next_id += 1
+                req_id = self._next_id
+                ids.append(req_id)
+                if failed:
+                    failed.append(callback)
+                    continue
+                self._callbacks[req_id] = callback
+                try:
+                    self.wfile.write(json.dumps({"id": req_id, "batch": batch, "op": op, "args": args or {}}) + "\n")
+                    self.wfile.flush()
+                except OSError as e:
+                    # helper died under us, nobody would ever answer these
+                    logger.error(f"Could not reach the privileged helper: {e}")
+                    self._callbacks.pop(req_id, None)
+                    failed.append(callback)
+        for callback in failed:
+            callback("error", "Privileged helper is not running")
+        return ids
+
+    def _read_events(self):
+        rfile = self.sock.makefile("r", encoding="utf-8")
+        for line in rfile:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            callback = self._callbacks.get(event.get("id"))
+            if callback is None:
+                continue
+            if event["event"] == "progress":
+                callback("progress", event["line"])
+            elif event["event"] == "throttled":
+                callback("throttled", (event.get("seconds", 0.0), event.get("wall", 0.0)))
+            elif event["event"] == "finished":
+                self._callbacks.pop(event["id"], None)
+                if event["returncode"] == 0:
+                    callback("finished", True)
+                else:
+                    callback("error", f"Command failed with code {event['returncode']}!")
+            else:
+                self._callbacks.pop(event["id"], None)
+                callback("error", event.get("message", "unknown helper error"))
+
+        # helper went away, fail whatever was still queued
+        logger.warning("Privileged helper connection closed")
+        for callback in list(self._callbacks.values()):
+            callback("error", "Privileged helper exited")
+        self._callbacks.clear()
+        self.sock = None
+
+    def cancel(self):
+        """Kill the operation the helper is running right now, the rest of its batch is skipped."""
+        with self._lock:
+            if self.wfile is not None:
+                self.wfile.write(json.dumps({"op": "cancel"}) + "\n")
+                self.wfile.flush()
+
+    def stop(self):
+        with self._lock:
+            if self.sock is not None:
+                try:
+                    self.wfile.write(json.dumps({"op": "shutdown"}) + "\n")
+                    self.wfile.flush()
+                    self.sock.close()
+                except OSError:
+                    pass
+                self.sock = None
+
+def main(argv=None):
+    from .distro import DistroManager
+
+    parser = argparse.ArgumentParser(description="Insert privileged helper")
+    parser.add_argument("--socket", required=True, help="abstract socket name, without the leading NUL")
+    parser.add_argument("--uid", type=int, required=True)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    if os.getuid() != 0:
+        logger.error("The helper must run as root")
+        return 1
+    return HelperServer(args.socket, args.uid, DistroManager()).serve()
+
+if __name__ == "__main__":
+    sys.exit(main())
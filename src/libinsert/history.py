@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger("ScanHistory")
+
+HISTORY_FILE = os.path.expanduser("~/.cache/insert-source/history.sqlite")
+MAX_BYTES = 8 * 1024 * 1024
+# never prune below this many scans, a diff needs two
+KEEP_SCANS = 2
+KINDS = ("devices", "matches", "orphans", "firmware")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    taken_at REAL NOT NULL,
+    distro TEXT,
+    family TEXT,
+    pkg_mgr TEXT,
+    installed_count INTEGER,
+    captured TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scans_taken_at ON scans(taken_at);
+-- one row per distinct value, valid from scan `since` through scan `until`
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    since INTEGER NOT NULL,
+    until INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_until ON items(until, kind);
+CREATE INDEX IF NOT EXISTS items_since ON items(since);
+"""
+
+def _device_key(device):
+    return f"{device.get('bus')}:{device.get('vendor_id')}:{device.get('device_id')}" if device.get("device_id") \
+        else f"{device.get('bus')}:{device.get('slot')}"
+
+def _keyed(kind, values):
+    """(key, value) pairs, identical devices get a counter so neither is lost."""
+    if kind == "orphans":
+        return [(name, {"name": name, "size": size}) for name, size in sorted(values.items())]
+    seen = {}
+    pairs = []
+    for value in values:
+        if kind == "devices":
+            key = _device_key(value)
+        elif kind == "matches":
+            key = f"{value['driver_name']}|{_device_key(value['device'])}"
+        else:
+            key = value.get("device", "")
+        seen[key] = seen.get(key, 0) + 1
+        pairs.append((key if seen[key] == 1 else f"{key}#{seen[key]}", value))
+    return pairs
+
+def firmware_summary(fw_updates):
+    """The parts of a fwupdmgr get-updates result worth keeping."""
+    summary = []
+    for device in (fw_updates or {}).get("Devices", []):
+        releases = device.get("Releases") or [{}]
+        summary.append({"device": device.get("Name", "?"), "version": device.get("Version"),
+                        "update": releases[0].get("Version")})
+    return summary
+
+def make_record(distro_mgr, devices, matches, installed_count, orphans=None, firmware=None):
+    """A scan in the shape HistoryStore.record takes, orphans and firmware are left out when not checked."""
+    scan = {
+        "distro": {"id": distro_mgr.id, "family": distro_mgr.family, "pkg_mgr": distro_mgr.pkg_mgr},
+        "devices": [d.to_dict() for d in devices],
+        "matches": [m.to_dict() for m in matches],
+        "installed_count": installed_count,
+    }
+    if orphans is not None:
+        scan["orphans"] = orphans
+    if firmware is not None:
+        scan["firmware"] = firmware
+    return scan
+
+class HistoryStore:
+    """Timestamped scans in SQLite, unchanged values are shared between scans instead of copied."""
+
+    def __init__(self, path=HISTORY_FILE, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # has to be set before the first table exists for pruning to give space back
+        self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def record(self, scan, taken_at=None):
+        """Store a scan, kinds missing from it are carried over from the previous one. Returns the scan id."""
+        captured = [kind for kind in KINDS if kind in scan]
+        distro = scan.get("distro", {})
+        with self._lock, self._db:
+            # the GUI and the service share this file: take the write lock before reading the
+            # previous scan, or two writers could both extend the same open rows
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute("SELECT MAX(id) FROM scans").fetchone()
+            previous = row[0]
+            cursor = self._db.execute(
+                "INSERT INTO scans (taken_at, distro, family, pkg_mgr, installed_count, captured) VALUES (?, ?, ?, ?, ?, ?)",
+                (taken_at or time.time(), distro.get("id"), distro.get("family"), distro.get("pkg_mgr"),
+                 scan.get("installed_count"), ",".join(captured)))
+            scan_id = cursor.lastrowid
+
+            carried = []
+            inserted = []
+            for kind in KINDS:
+                open_rows = {}
+                if previous is not None:
+                    for item_id, key, data in self._db.execute(
+                            "SELECT id, key, data FROM items WHERE until = ? AND kind = ?", (previous, kind)):
+                        open_rows[key] = (item_id, data)
+                if kind not in captured:
+                    # not checked this time, assume nothing changed
+                    carried += [item_id for item_id, _ in open_rows.values()]
+                    continue
+                for key, value in _keyed(kind, scan[kind]):
+                    data = json.dumps(value, sort_keys=True)
+                    current = open_rows.get(key)
+                    if current and current[1] == data:
+                        carried.append(current[0])
+                    else:
+                        inserted.append((kind, key, data, scan_id, scan_id))
+            self._db.executemany("UPDATE items SET until = ? WHERE id = ?", [(scan_id, i) for i in carried])
+            self._db.executemany("INSERT INTO items (kind, key, data, since, until) VALUES (?, ?, ?, ?, ?)", inserted)
+        logger.info(f"Recorded scan {scan_id}: {len(inserted)} new values, {len(carried)} unchanged")
+        self.prune()
+        return scan_id
+
+    def scans(self, limit=20):
+        """Newest first: id, taken_at, distro, installed_count and captured kinds."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, taken_at, distro, family, pkg_mgr, installed_count, captured FROM scans "
+                "ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [{"id": r[0], "taken_at": r[1], "distro": {"id": r[2], "family": r[3], "pkg_mgr": r[4]},
+                 "installed_count": r[5], "captured": r[6].split(",") if r[6] else []} for r in rows]
+
+    def latest_id(self, offset=0):
+        with self._lock:
+            row = self._db.execute("SELECT id FROM scans ORDER BY id DESC LIMIT 1 OFFSET ?", (offset,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, scan_id=None):
+        """The scan as recorded, the newest one by default. None if there is none."""
+        scan_id = self.latest_id() if scan_id is None else scan_id
+        if scan_id is None:
+            return None
+        with self._lock:
+            meta = self._db.execute("SELECT taken_at, distro, family, pkg_mgr, installed_count FROM scans WHERE id = ?",
+                                    (scan_id,)).fetchone()
+            if meta is None:
+                return None
+            rows = self._db.execute("SELECT kind, data FROM items WHERE since <= ? AND until >= ? ORDER BY id",
+                                    (scan_id, scan_id)).fetchall()
+        scan = {"id": scan_id, "taken_at": meta[0], "distro": {"id": meta[1], "family": meta[2], "pkg_mgr": meta[3]},
+                "installed_count": meta[4], "devices": [], "matches": [], "orphans": {}, "firmware": []}
+        for kind, data in rows:
+            value = json.loads(data)
+            if kind == "orphans":
+                scan["orphans"][value["name"]] = value["size"]
+            else:
+                scan[kind].append(value)
+        return scan
+
+    def diff(self, old_id=None, new_id=None):
+        """What was added, removed or changed between two scans, the last two by default."""
+        new_id = self.latest_id() if new_id is None else new_id
+        old_id = self.latest_id(1) if old_id is None else old_id
+        new = self.load(new_id) if new_id is not None else None
+        old = self.load(old_id) if old_id is not None else None
+        return diff_scans(old, new)
+
+    def size(self):
+        with self._lock:
+            page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+            pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+            free = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    def prune(self):
+        """Drop the oldest scans until the database fits in max_bytes."""
+        removed = 0
+        while self.max_bytes and self.size() > self.max_bytes:
+            with self._lock, self._db:
+                count = self._db.execute("SELECT COUNT(*) FROM scans").fetchone()[0]
+                batch = min(max(1, count // 10), count - KEEP_SCANS)
+                if batch <= 0:
+                    break
+                cutoff = self._db.execute("SELECT id FROM scans ORDER BY id LIMIT 1 OFFSET ?", (batch,)).fetchone()[0]
+                self._db.execute("DELETE FROM scans WHERE id < ?", (cutoff,))
+                # values nothing from cutoff on still refers to
+                self._db.execute("DELETE FROM items WHERE until < ?", (cutoff,))
+            removed += batch
+        if removed:
+            with self._lock:
+                self._db.execute("PRAGMA incremental_vacuum")
+            logger.info(f"Pruned {removed} old scans, history is {self.size()} bytes")
+        return removed
+
+def diff_scans(old, new):
+    diff = {}
+    for kind in KINDS:
+        before = dict(_keyed(kind, old[kind])) if old else {}
+        after = dict(_keyed(kind, new[kind])) if new else {}
+        diff[kind] = {
+            "added": [after[k] for k in after if k not in before],
+            "removed": [before[k] for k in before if k not in after],
+            "changed": [{"old": before[k], "new": after[k]} for k in after if k in before and before[k] != after[k]],
+        }
+    return diff
+
+def count_changes(diff):
+    return sum(len(entries) for kinds in diff.values() for entries in kinds.values())
+
+def _describe(kind, value):
+    if kind == "devices":
+        return f"{value.get('vendor_name', '')} {value.get('device_name', '')}".strip() or value.get("slot", "?")
+    if kind == "matches":
+        status = "installed" if value.get("is_installed") else "missing " + " ".join(value.get("missing_packages", []))
+        return f"{value['driver_name']} ({status})"
+    if kind == "orphans":
+        return f"{value['name']} ({value['size'] / 1e6:.1f} MB)"
+    return f"{value['device']} {value.get('version')} -> {value.get('update')}"
+
+def format_diff(diff):
+    labels = {"devices": "device", "matches": "driver", "orphans": "orphan", "firmware": "firmware"}
+    lines = []
+    for kind in KINDS:
+        for value in diff[kind]["added"]:
+            lines.append(f"+ {labels[kind]} {_describe(kind, value)}")
+        for value in diff[kind]["removed"]:
+            lines.append(f"- {labels[kind]} {_describe(kind, value)}")
+        for change in diff[kind]["changed"]:
+            lines.append(f"~ {labels[kind]} {_describe(kind, change['old'])} -> {_describe(kind, change['new'])}")
+    return "\n".join(lines) if lines else "No changes"
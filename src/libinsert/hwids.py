@@ -0,0 +1,221 @@
+"""Vendor, device and class names from pci.ids/usb.ids without parsing them into dicts.
+
+The ids file is memory-mapped. A sorted array of numeric keys with the file offset of
+each name is built once and cached next to the other caches. A lookup is a bisect in
+that array plus one slice of the mapped file.
+"""
+import os
+import mmap
+import array
+import bisect
+import struct
+import logging
+import tempfile
+
+logger = logging.getLogger("HwIds")
+
+PCI_IDS_PATHS = ("usr/share/hwdata/pci.ids", "usr/share/misc/pci.ids", "usr/share/pci.ids")
+USB_IDS_PATHS = ("usr/share/hwdata/usb.ids", "usr/share/misc/usb.ids", "usr/share/usb.ids")
+CACHE_DIR = os.path.expanduser("~/.cache/insert-source")
+
+# key = kind << 32 | ids, one sorted key space for everything in the file
+VENDOR = 1
+DEVICE = 2
+CLASS = 3
+SUBCLASS = 4
+
+_HEADER = struct.Struct("<8sQqQ")
+_MAGIC = b"INSIDX1\0"
+
+def _key(kind, value):
+    return kind << 32 | value
+
+def _hex(value):
+    return value if isinstance(value, int) else int(value, 16)
+
+def build_index(data):
+    """(keys, offsets) for a pci.ids/usb.ids style buffer, offsets point at the start of each name.
+
+    Subsystem entries (two tabs) are skipped, matching only needs the vendor of a subsystem.
+    """
+    entries = []
+    section = None
+    parent = None
+    pos = 0
+    end = len(data)
+    while pos < end:
+        nl = data.find(b"\n", pos)
+        if nl < 0:
+            nl = end
+        line = data[pos:nl]
+        start = pos
+        pos = nl + 1
+        if not line or line[:1] == b"#":
+            continue
+        try:
+            if line[:1] != b"\t":
+                # usb.ids has HID, language and other tables after the classes
+                section = None
+                # "C 03  Display controller" has its two spaces where a vendor line has them too
+                if line[:2] == b"C ":
+                    section, parent = CLASS, int(line[2:4], 16)
+                    entries.append((_key(CLASS, parent), start + 6))
+                elif line[4:6] == b"  ":
+                    section, parent = VENDOR, int(line[:4], 16)
+                    entries.append((_key(VENDOR, parent), start + 6))
+            elif line[1:2] != b"\t":
+                if section == VENDOR:
+                    entries.append((_key(DEVICE, parent << 16 | int(line[1:5], 16)), start + 7))
+                elif section == CLASS:
+                    entries.append((_key(SUBCLASS, parent << 8 | int(line[1:3], 16)), start + 5))
+        except ValueError:
+            continue
+    entries.sort()
+    keys = array.array("Q", (k for k, _ in entries))
+    offsets = array.array("I", (o for _, o in entries))
+    return keys, offsets
+
+class IdsFile:
+    """One ids file, mapped and indexed on the first lookup."""
+
+    def __init__(self, path, cache_dir=CACHE_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        self._data = None
+        self._keys = None
+        self._offsets = None
+        self._maps = []
+
+    def _cache_path(self):
+        if not self.cache_dir:
+            return None
+        name = os.path.abspath(self.path).strip("/").replace("/", "_")
+        return os.path.join(self.cache_dir, f"{name}.idx")
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(self._data)
+        cache_path = self._cache_path()
+        if cache_path and self._load_cache(cache_path, st):
+            return
+        self._keys, self._offsets = build_index(self._data)
+        logger.info(f"Indexed {len(self._keys)} names from {self.path}")
+        if cache_path:
+            self._write_cache(cache_path, st)
+
+    def _load_cache(self, cache_path, st):
+        try:
+            with open(cache_path, "rb") as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        try:
+            magic, size, mtime, count = _HEADER.unpack_from(index, 0)
+        except struct.error:
+            index.close()
+            return False
+        if magic != _MAGIC or size != st.st_size or mtime != st.st_mtime_ns or \
+                len(index) != _HEADER.size + count * 12:
+            index.close()
+            return False
+        self._maps.append(index)
+        # views straight into the mapped cache, nothing is copied
+        view = memoryview(index)
+        self._keys = view[_HEADER.size:_HEADER.size + count * 8].cast("Q")
+        self._offsets = view[_HEADER.size + count * 8:].cast("I")
+        return True
+
+    def _write_cache(self, cache_path, st):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".hwids-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, st.st_size, st.st_mtime_ns, len(self._keys)))
+                f.write(self._keys.tobytes())
+                f.write(self._offsets.tobytes())
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write ids index {cache_path}: {e}")
+
+    def _name(self, key):
+        if self._data is None:
+            self._open()
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return None
+        start = self._offsets[i]
+        end = self._data.find(b"\n", start)
+        return self._data[start:end if end >= 0 else len(self._data)].decode("utf-8", "replace").strip()
+
+    def vendor(self, vendor_id):
+        return self._name(_key(VENDOR, _hex(vendor_id)))
+
+    def device(self, vendor_id, device_id):
+        return self._name(_key(DEVICE, _hex(vendor_id) << 16 | _hex(device_id)))
+
+    def device_class(self, class_id):
+        """Subclass name for "0300", class name for "03"."""
+        class_id = _hex(class_id)
+        if class_id > 0xff:
+            return self._name(_key(SUBCLASS, class_id)) or self._name(_key(CLASS, class_id >> 8))
+        return self._name(_key(CLASS, class_id))
+
+    def close(self):
+        # the memoryviews have to go before their maps can close
+        self._keys = self._offsets = self._data = None
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+        self._maps = []
+
+def _find(root, paths):
+    for path in paths:
+        path = os.path.join(root, path)
+        if os.path.exists(path):
+            return path
+    return None
+
+class HardwareNames:
+    """pci and usb name lookups, each ids file is only opened when first asked about."""
+
+    def __init__(self, root="/", cache_dir=CACHE_DIR):
+        self.root = root
+        self.cache_dir = cache_dir
+        self._files = {}
+
+    def _ids(self, bus):
+        if bus not in self._files:
+            path = _find(self.root, PCI_IDS_PATHS if bus == "pci" else USB_IDS_PATHS)
+            if path is None:
+                logger.warning(f"No {bus}.ids found, devices will only have numeric ids")
+            self._files[bus] = IdsFile(path, self.cache_dir) if path else None
+        return self._files[bus]
+
+    def _lookup(self, bus, method, *ids):
+        ids_file = self._ids(bus)
+        if ids_file is None or any(i is None for i in ids):
+            return None
+        try:
+            return getattr(ids_file, method)(*ids)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not look up {bus} ids {ids}: {e}")
+            return None
+
+    def vendor(self, bus, vendor_id):
+        return self._lookup(bus, "vendor", vendor_id)
+
+    def device(self, bus, vendor_id, device_id):
+        return self._lookup(bus, "device", vendor_id, device_id)
+
+    def pci_class(self, class_id):
+        return self._lookup("pci", "device_class", class_id)
+
+    def close(self):
+        for ids_file in self._files.values():
+            if ids_file is not None:
+                ids_file.close()
+        self._files = {}
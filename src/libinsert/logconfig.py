@@ -0,0 +1,96 @@
+import os
+import gzip
+import queue
+import shutil
+import atexit
+import logging
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+DEFAULT_LOG_FILE = os.path.expanduser("~/.cache/insert-source.log")
+MAX_BYTES = 2 * 1024 * 1024
+BACKUP_COUNT = 5
+
+# per-subsystem levels, overridable with INSERT_LOG_LEVELS="TaskWorker=DEBUG,SysProbe=WARNING"
+DEFAULT_LEVELS = {
+    "InsertApp": logging.INFO,
+    "SysProbe": logging.INFO,
+    "DistroManager": logging.INFO,
+    "TaskWorker": logging.INFO,
+}
+
+_listener = None
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+def _gzip_rotator(source, dest):
+    # runs on the listener thread, so compressing here never blocks the ui or the worker
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def parse_levels(spec):
+    """Parse a "Name=LEVEL,Name=LEVEL" string into a {name: level} dict."""
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        level = logging.getLevelName(level.strip().upper())
+        if isinstance(level, int):
+            levels[name.strip()] = level
+    return levels
+
+def make_file_handler(path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    return handler
+
+def setup_logging(log_file=DEFAULT_LOG_FILE, levels=None, console=True):
+    """Route all records through a queue to a background listener that owns the real handlers."""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if console:
+        handlers.append(logging.StreamHandler())
+    try:
+        handlers.append(make_file_handler(log_file))
+    except OSError as e:
+        # read-only home or similar, keep going with the console only
+        logging.getLogger("InsertApp").warning(f"Could not open log file {log_file}: {e}")
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    merged = dict(DEFAULT_LEVELS)
+    merged.update(levels or {})
+    merged.update(parse_levels(os.environ.get("INSERT_LOG_LEVELS")))
+    for name, level in merged.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+def shutdown_logging():
+    """Flush whatever is still queued and stop the listener thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
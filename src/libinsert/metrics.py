@@ -0,0 +1,227 @@
+import os
+import re
+import time
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger("Metrics")
+
+METRICS_DIR_ENV = "INSERT_METRICS_DIR"
+# where node_exporter's --collector.textfile.directory usually points
+DEFAULT_DIRS = ["/var/lib/prometheus/node-exporter", "/var/lib/node_exporter/textfile_collector"]
+METRICS_FILE = "insert.prom"
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+def metrics_dir():
+    """$INSERT_METRICS_DIR, else the first writable textfile collector directory, else None."""
+    configured = os.environ.get(METRICS_DIR_ENV)
+    if configured:
+        return configured
+    for directory in DEFAULT_DIRS:
+        if os.path.isdir(directory) and os.access(directory, os.W_OK):
+            return directory
+    return None
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _unescape(value):
+    return value.replace("\\n", "\n").replace('\\"', '"').replace("\\\\", "\\")
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsFile:
+    """One .prom file for the node_exporter textfile collector.
+
+    Values from an earlier write (another run, the CLI timer) are read back first so
+    partial updates like "orphans only" keep everything else. Every write replaces the
+    whole file through a rename, so the collector never sees half of it.
+    """
+
+    def __init__(self, directory=None, name=METRICS_FILE):
+        self.directory = directory if directory is not None else metrics_dir()
+        self.name = name
+        self._lock = threading.Lock()
+        # render and replace as one step, so an older render can't land after a newer one
+        self._write_lock = threading.Lock()
+        # metric name -> (type, help)
+        self._meta = {}
+        # metric name -> {labels tuple: value}
+        self._samples = {}
+        self._warned = False
+        if self.path:
+            self._load()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.name) if self.directory else None
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            if line.startswith("# TYPE "):
+                parts = line.split(" ", 3)
+                if len(parts) == 4:
+                    self._meta[parts[2]] = (parts[3], self._meta.get(parts[2], ("", ""))[1])
+            elif line.startswith("# HELP "):
+                parts = line.split(" ", 3)
+                if len(parts) == 4:
+                    self._meta[parts[2]] = (self._meta.get(parts[2], ("gauge", ""))[0], parts[3])
+            elif line and not line.startswith("#"):
+                match = _SAMPLE_RE.match(line)
+                if not match:
+                    continue
+                labels = tuple((k, _unescape(v)) for k, v in _LABEL_RE.findall(match.group(2) or ""))
+                try:
+                    self._samples.setdefault(match.group(1), {})[labels] = float(match.group(3))
+                except ValueError:
+                    continue
+
+    def set(self, name, value, labels=None, help="", kind="gauge"):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            if help or name not in self._meta:
+                self._meta[name] = (kind, help)
+            self._samples.setdefault(name, {})[key] = value
+
+    def inc(self, name, labels=None, amount=1, help=""):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            if help or name not in self._meta:
+                self._meta[name] = ("counter", help)
+            samples = self._samples.setdefault(name, {})
+            samples[key] = samples.get(key, 0) + amount
+
+    def reset(self, name):
+        """Drop every sample of a metric, e.g. categories that no longer have missing drivers."""
+        with self._lock:
+            self._samples.pop(name, None)
+
+    def get(self, name, labels=None):
+        return self._samples.get(name, {}).get(tuple(sorted((labels or {}).items())))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted(self._samples):
+                kind, help = self._meta.get(name, ("gauge", ""))
+                if help:
+                    lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(self._samples[name].items()):
+                    label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                    lines.append(f"{name}{{{label_text}}} {_format_value(value)}" if label_text
+                                 else f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Atomically replace the .prom file, returns its path or None when there is nowhere to write."""
+        if not self.path:
+            return None
+        with self._write_lock:
+            text = self.render()
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{self.name}.")
+                try:
+                    with os.fdopen(fd, "w") as f:
+                        f.write(text)
+                    # node_exporter often runs as its own user
+                    os.chmod(tmp_path, 0o644)
+                    os.replace(tmp_path, self.path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            except OSError as e:
+                # usually a root-owned collector directory while running as a user, say it once
+                if not self._warned:
+                    logger.warning(f"Could not write metrics to {self.path}: {e}")
+                    self._warned = True
+                return None
+            return self.path
+
+# recorders, one per data source, each only touches its own metrics
+
+def record_phase(metrics, phase, seconds):
+    metrics.set("insert_scan_phase_duration_seconds", round(seconds, 6), {"phase": phase},
+                help="Wall time of the last run of each scan phase.")
+
+def record_matches(metrics, matches):
+    missing = {}
+    inactive = 0
+    for match in matches:
+        missing.setdefault(match.category, 0)
+        if not match.is_installed:
+            missing[match.category] += 1
+        elif match.state == "inactive":
+            inactive += 1
+    metrics.reset("insert_missing_drivers")
+    for category, count in missing.items():
+        metrics.set("insert_missing_drivers", count, {"category": category},
+                    help="Matched drivers with at least one package not installed, per category.")
+    metrics.set("insert_inactive_drivers", inactive, help="Installed drivers whose kernel module is not bound to the device.")
+    metrics.set("insert_driver_matches", len(matches), help="Devices matched against the driver database.")
+    metrics.set("insert_last_scan_timestamp_seconds", int(time.time()), help="Unix time of the last hardware scan.")
+
+def record_orphans(metrics, orphans):
+    metrics.set("insert_orphan_packages", len(orphans), help="Packages no longer required by anything.")
+
+def record_reclaimable(metrics, tasks):
+    metrics.reset("insert_reclaimable_bytes")
+    for task in tasks:
+        if "reclaimable" in task:
+            metrics.set("insert_reclaimable_bytes", task["reclaimable"], {"task": task["name"]},
+                        help="Bytes each cleanup task would free.")
+
+def record_firmware(metrics, fw_updates):
+    devices = fw_updates.get("Devices", []) if isinstance(fw_updates, dict) else []
+    metrics.set("insert_firmware_updates_pending", len(devices), help="Devices with a firmware update available.")
+
+def record_transaction(metrics, op, ok, seconds):
+    labels = {"op": op}
+    metrics.inc("insert_transactions_total", {"op": op, "result": "success" if ok else "failure"},
+                help="Privileged operations run, by result.")
+    metrics.set("insert_transaction_last_success", 1 if ok else 0, labels, help="Whether the last run of each operation succeeded.")
+    metrics.set("insert_transaction_last_duration_seconds", round(seconds, 3), labels, help="Wall time of the last run of each operation.")
+    metrics.set("insert_transaction_last_timestamp_seconds", int(time.time()), labels, help="Unix time the last run of each operation ended.")
+
+def record_throttled(metrics, op, seconds):
+    metrics.set("insert_transaction_last_throttled_seconds", round(seconds, 3), {"op": op},
+                help="Time the last background run of each operation waited on CPU or disk.")
+
+def collect_scan(metrics, distro_mgr, probe, space=None, firmware=True):
+    """Headless full scan for timers/cron, every phase timed."""
+    from .space import SpaceEstimator
+
+    def timed(phase, func):
+        start = time.monotonic()
+        try:
+            return func()
+        finally:
+            record_phase(metrics, phase, time.monotonic() - start)
+
+    devices = timed("devices", probe.scan_devices)
+    matches = timed("match", lambda: probe.match_devices(distro_mgr.family, devices))
+    installed = set(timed("installed", distro_mgr.get_installed_packages))
+    for match in matches:
+        match.set_installed(installed.__contains__ if installed else distro_mgr.is_package_installed)
+    timed("bindings", lambda: probe.check_bindings(matches))
+    record_matches(metrics, matches)
+
+    record_orphans(metrics, timed("orphans", distro_mgr.get_orphans))
+    tasks = distro_mgr.get_cleanup_tasks()
+    timed("reclaimable", lambda: (space or SpaceEstimator()).estimate_tasks(tasks))
+    record_reclaimable(metrics, tasks)
+
+    if firmware:
+        record_firmware(metrics, timed("firmware", probe.get_firmware_updates))
+    return matches
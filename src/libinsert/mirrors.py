@@ -0,0 +1,215 @@
+import os
+import re
+import ssl
+import time
+import shutil
+import asyncio
+import logging
+import platform
+import tempfile
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("Mirrors")
+
+PACMAN_MIRRORLIST = "/etc/pacman.d/mirrorlist"
+APT_SOURCES = "/etc/apt/sources.list"
+PROBE_TIMEOUT = 5.0
+PROBE_CONCURRENCY = 8
+# enough of the probe file to tell a fast mirror from a slow one
+PROBE_BYTES = 512 * 1024
+BACKUP_SUFFIX = ".insert-bak"
+# mirrors put on top when a ranking is applied, everything else keeps its line
+PROPOSAL_SIZE = 5
+
+_PACMAN_SERVER_RE = re.compile(r'^\s*(#)?\s*Server\s*=\s*(\S+)\s*$')
+_APT_LINE_RE = re.compile(r'^\s*(deb|deb-src)\s+(\[[^\]]*\]\s+)?(\S+)\s+(\S+)')
+_URL_RE = re.compile(r'^https?://[^\s]+$')
+
+class MirrorResult:
+    def __init__(self, url, probe_url):
+        self.url = url
+        self.probe_url = probe_url
+        # seconds until the status line arrived
+        self.latency = None
+        # bytes per second for the body that followed
+        self.throughput = None
+        self.elapsed = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.elapsed is not None
+
+    def __repr__(self):
+        if not self.ok:
+            return f"MirrorResult({self.url} failed: {self.error})"
+        return f"MirrorResult({self.url} {self.latency * 1000:.0f}ms {self.throughput / 1e6:.2f}MB/s)"
+
+def mirror_source(pkg_mgr):
+    if pkg_mgr == "pacman":
+        return PACMAN_MIRRORLIST
+    if pkg_mgr == "apt":
+        return APT_SOURCES
+    return None
+
+def pacman_candidates(text, arch=None):
+    """Every Server line, commented out or not, with the core db as the probe file."""
+    arch = arch or platform.machine()
+    candidates = []
+    seen = set()
+    for line in text.splitlines():
+        match = _PACMAN_SERVER_RE.match(line)
+        if not match or match.group(2) in seen:
+            continue
+        url = match.group(2)
+        seen.add(url)
+        probe = url.replace("$repo", "core").replace("$arch", arch).rstrip("/") + "/core.db"
+        candidates.append(MirrorResult(url, probe))
+    return candidates
+
+def apt_candidates(text):
+    """Each archive URL from the one-line sources format, probed through its first suite's InRelease."""
+    candidates = []
+    seen = set()
+    for line in text.splitlines():
+        match = _APT_LINE_RE.match(line)
+        if not match:
+            continue
+        url, suite = match.group(3), match.group(4)
+        if url in seen or not _URL_RE.match(url):
+            continue
+        seen.add(url)
+        candidates.append(MirrorResult(url, f"{url.rstrip('/')}/dists/{suite}/InRelease"))
+    return candidates
+
+def load_candidates(pkg_mgr, path=None):
+    path = path or mirror_source(pkg_mgr)
+    if path is None:
+        return []
+    try:
+        with open(path, "r") as f:
+            text = f.read()
+    except OSError as e:
+        logger.warning(f"Could not read {path}: {e}")
+        return []
+    return pacman_candidates(text) if pkg_mgr == "pacman" else apt_candidates(text)
+
+async def probe_mirror(result, timeout=PROBE_TIMEOUT, max_bytes=PROBE_BYTES):
+    """GET the probe file with a plain HTTP/1.1 request, fills in latency and throughput."""
+    parts = urlsplit(result.probe_url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    writer = None
+    start = time.monotonic()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if https else None),
+            timeout)
+        writer.write((f"GET {path} HTTP/1.1\r\nHost: {parts.hostname}\r\n"
+                      f"User-Agent: insert-mirror-probe\r\nConnection: close\r\n\r\n").encode())
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        first_byte = time.monotonic()
+        fields = status.decode("latin-1").split()
+        if len(fields) < 2 or fields[1] != "200":
+            result.error = f"HTTP {fields[1] if len(fields) > 1 else '?'}"
+            return result
+        while (await asyncio.wait_for(reader.readline(), timeout)) not in (b"\r\n", b"\n", b""):
+            pass
+        received = 0
+        deadline = start + timeout
+        while received < max_bytes:
+            chunk = await asyncio.wait_for(reader.read(65536), max(0.01, deadline - time.monotonic()))
+            if not chunk:
+                break
+            received += len(chunk)
+        end = time.monotonic()
+        result.latency = first_byte - start
+        result.elapsed = end - start
+        result.throughput = received / max(end - first_byte, 1e-6)
+    except asyncio.TimeoutError:
+        result.error = "timed out"
+    except (OSError, ssl.SSLError, UnicodeError) as e:
+        result.error = str(e) or type(e).__name__
+    finally:
+        if writer is not None:
+            writer.close()
+    return result
+
+async def _probe_all(candidates, concurrency, timeout, max_bytes):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(result):
+        async with semaphore:
+            return await probe_mirror(result, timeout, max_bytes)
+
+    return await asyncio.gather(*(bounded(c) for c in candidates))
+
+def rank_mirrors(candidates, concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT, max_bytes=PROBE_BYTES):
+    """Probe at most `concurrency` mirrors at a time, fastest fetch of the probe file first, failures last."""
+    if not candidates:
+        return []
+    results = asyncio.run(_probe_all(candidates, concurrency, timeout, max_bytes))
+    ranked = sorted(results, key=lambda r: (not r.ok, r.elapsed if r.ok else 0))
+    logger.info(f"Ranked {len(ranked)} mirrors, {sum(1 for r in ranked if r.ok)} reachable")
+    return ranked
+
+def proposal(ranked, count=PROPOSAL_SIZE):
+    """The fastest `count` reachable mirrors, the ones shown and then applied."""
+    return [r for r in ranked if r.ok][:count]
+
+def reorder_pacman_mirrorlist(text, urls):
+    """Ranked servers go on top, the rest of the file is kept below them as fallback."""
+    ranked = set(urls)
+    lines = [f"## Ranked by Insert on {time.strftime('%Y-%m-%d')}"]
+    lines += [f"Server = {url}" for url in urls]
+    lines.append("")
+    for line in text.splitlines():
+        match = _PACMAN_SERVER_RE.match(line)
+        if match and match.group(2) in ranked:
+            continue
+        if line.startswith("## Ranked by Insert"):
+            continue
+        lines.append(line)
+    return "\n".join(lines).rstrip("\n") + "\n"
+
+def reorder_apt_sources(text, urls):
+    """Sort the deb lines by rank in place, apt prefers the first source for identical versions."""
+    rank = {url: i for i, url in enumerate(urls)}
+    lines = text.splitlines()
+    positions = [i for i, line in enumerate(lines) if _APT_LINE_RE.match(line)]
+    entries = [lines[i] for i in positions]
+    # stable, so unranked lines and deb/deb-src pairs keep their order
+    entries.sort(key=lambda line: rank.get(_APT_LINE_RE.match(line).group(3), len(rank)))
+    for i, line in zip(positions, entries):
+        lines[i] = line
+    return "\n".join(lines) + "\n"
+
+def apply_mirrors(pkg_mgr, urls, path=None):
+    """Rewrite the mirror list with urls first. Only mirrors already listed there are accepted."""
+    path = path or mirror_source(pkg_mgr)
+    if path is None:
+        raise ValueError(f"mirror ranking is not supported for {pkg_mgr}")
+    with open(path, "r") as f:
+        text = f.read()
+    known = {c.url for c in (pacman_candidates(text) if pkg_mgr == "pacman" else apt_candidates(text))}
+    unknown = [url for url in urls if url not in known]
+    if unknown:
+        raise ValueError(f"not in {path}: {', '.join(unknown)}")
+    new_text = reorder_pacman_mirrorlist(text, urls) if pkg_mgr == "pacman" else reorder_apt_sources(text, urls)
+
+    shutil.copy2(path, path + BACKUP_SUFFIX)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".insert-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(new_text)
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logger.info(f"Wrote {len(urls)} ranked mirrors to {path} (backup in {path + BACKUP_SUFFIX})")
+    return path
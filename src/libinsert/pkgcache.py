@@ -0,0 +1,218 @@
+import os
+import re
+import glob
+import logging
+from functools import cmp_to_key
+from urllib.parse import unquote
+
+logger = logging.getLogger("PackageCache")
+
+CACHE_DIRS = {
+    "pacman": ["/var/cache/pacman/pkg"],
+    "apt": ["/var/cache/apt/archives"],
+    "dnf": ["/var/cache/dnf/*/packages", "/var/cache/libdnf5/*/packages"],
+}
+
+_PACMAN_RE = re.compile(r'^(?P<name>.+)-(?P<version>[^-]+-[^-]+)-(?P<arch>[^-]+)\.pkg\.tar(\.[a-z0-9]+)?$')
+_DEB_RE = re.compile(r'^(?P<name>[^_]+)_(?P<version>[^_]+)_(?P<arch>[^_]+)\.deb$')
+_RPM_RE = re.compile(r'^(?P<name>.+)-(?P<version>[^-]+-[^-]+)\.(?P<arch>[^.]+)\.rpm$')
+_SEGMENT_RE = re.compile(r'[0-9]+|[a-zA-Z]+')
+
+def rpmvercmp(a, b, alpha_tail_older=False):
+    """rpm segment comparison: digits beat letters, longer wins on a tie.
+
+    pacman differs only in treating a letter segment right after the last common one as
+    older (1.0a < 1.0), with a separator in between it is newer like in rpm (1.0.a > 1.0).
+    """
+    if a == b:
+        return 0
+    match_a = list(_SEGMENT_RE.finditer(a))
+    match_b = list(_SEGMENT_RE.finditer(b))
+    seg_a = [m.group() for m in match_a]
+    seg_b = [m.group() for m in match_b]
+    for x, y in zip(seg_a, seg_b):
+        x_num = x.isdigit()
+        y_num = y.isdigit()
+        if x_num != y_num:
+            return 1 if x_num else -1
+        if x_num:
+            x, y = int(x), int(y)
+        if x != y:
+            return 1 if x > y else -1
+    if len(seg_a) != len(seg_b):
+        longer_wins = 1 if len(seg_a) > len(seg_b) else -1
+        longer, common = (match_a, len(seg_b)) if len(seg_a) > len(seg_b) else (match_b, len(seg_a))
+        tail = longer[common]
+        attached = common == 0 or tail.start() == longer[common - 1].end()
+        if alpha_tail_older and attached and not tail.group().isdigit():
+            return -longer_wins
+        return longer_wins
+    return 0
+
+def _split_evr(version):
+    epoch = "0"
+    if ":" in version:
+        epoch, version = version.split(":", 1)
+    release = None
+    if "-" in version:
+        version, release = version.rsplit("-", 1)
+    return int(epoch or 0), version, release
+
+def evr_compare(a, b, alpha_tail_older=False):
+    """Compare [epoch:]version[-release] strings the way rpm does."""
+    epoch_a, ver_a, rel_a = _split_evr(a)
+    epoch_b, ver_b, rel_b = _split_evr(b)
+    if epoch_a != epoch_b:
+        return 1 if epoch_a > epoch_b else -1
+    result = rpmvercmp(ver_a, ver_b, alpha_tail_older)
+    if result or rel_a is None or rel_b is None:
+        return result
+    return rpmvercmp(rel_a, rel_b, alpha_tail_older)
+
+def pacman_vercmp(a, b):
+    return evr_compare(a, b, alpha_tail_older=True)
+
+def _dpkg_order(c):
+    if c == "~":
+        return -1
+    if c.isdigit():
+        return 0
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+def _dpkg_verrevcmp(a, b):
+    i = j = 0
+    while i < len(a) or j < len(b):
+        first_diff = 0
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ac = _dpkg_order(a[i]) if i < len(a) and not a[i].isdigit() else 0
+            bc = _dpkg_order(b[j]) if j < len(b) and not b[j].isdigit() else 0
+            if ac != bc:
+                return 1 if ac > bc else -1
+            i += 1
+            j += 1
+        while i < len(a) and a[i] == "0":
+            i += 1
+        while j < len(b) and b[j] == "0":
+            j += 1
+        while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if i < len(a) and a[i].isdigit():
+            return 1
+        if j < len(b) and b[j].isdigit():
+            return -1
+        if first_diff:
+            return 1 if first_diff > 0 else -1
+    return 0
+
+def dpkg_compare(a, b):
+    """Debian version comparison, including ~ sorting before everything."""
+    epoch_a, ver_a, rev_a = _split_evr(a)
+    epoch_b, ver_b, rev_b = _split_evr(b)
+    if epoch_a != epoch_b:
+        return 1 if epoch_a > epoch_b else -1
+    result = _dpkg_verrevcmp(ver_a, ver_b)
+    if result:
+        return result
+    return _dpkg_verrevcmp(rev_a or "", rev_b or "")
+
+COMPARATORS = {
+    "pacman": pacman_vercmp,
+    "dnf": evr_compare,
+    "apt": dpkg_compare,
+}
+
+def parse_package_filename(pkg_mgr, filename):
+    """Return (name, version, arch) for a cached package file, or None."""
+    if pkg_mgr == "pacman":
+        match = _PACMAN_RE.match(filename)
+    elif pkg_mgr == "apt":
+        # apt escapes the epoch colon as %3a
+        match = _DEB_RE.match(filename)
+        if match:
+            return match.group("name"), unquote(match.group("version")), match.group("arch")
+    elif pkg_mgr == "dnf":
+        match = _RPM_RE.match(filename)
+    else:
+        return None
+    if not match:
+        return None
+    return match.group("name"), match.group("version"), match.group("arch")
+
+def cache_dirs(pkg_mgr):
+    dirs = []
+    for pattern in CACHE_DIRS.get(pkg_mgr, []):
+        dirs.extend(d for d in glob.glob(pattern) if os.path.isdir(d))
+    return dirs
+
+def scan_cache(pkg_mgr, directories):
+    """Group cached packages by (name, arch) -> [(version, path, size)].
+
+    Also returns the set of detached signature paths seen along the way.
+    """
+    groups = {}
+    signatures = set()
+    for directory in directories:
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".sig"):
+                        signatures.add(entry.path)
+                        continue
+                    parsed = parse_package_filename(pkg_mgr, entry.name)
+                    if not parsed or not entry.is_file(follow_symlinks=False):
+                        continue
+                    name, version, arch = parsed
+                    size = entry.stat(follow_symlinks=False).st_size
+                    groups.setdefault((name, arch), []).append((version, entry.path, size))
+        except OSError as e:
+            logger.warning(f"Failed to scan package cache {directory}: {e}")
+    return groups, signatures
+
+def plan_prune(pkg_mgr, directories=None, keep=3):
+    """Pick every cached file older than the newest `keep` versions of its package.
+
+    Returns (paths, bytes) where paths include detached .sig files.
+    """
+    compare = COMPARATORS.get(pkg_mgr)
+    if compare is None:
+        return [], 0
+    if directories is None:
+        directories = cache_dirs(pkg_mgr)
+    groups, signatures = scan_cache(pkg_mgr, directories)
+
+    doomed = []
+    freed = 0
+    for files in groups.values():
+        if len(files) <= keep:
+            continue
+        # most groups are a handful of files, only those above the limit get sorted
+        files.sort(key=cmp_to_key(lambda x, y: compare(y[0], x[0])))
+        for version, path, size in files[keep:]:
+            doomed.append(path)
+            freed += size
+            if path + ".sig" in signatures:
+                doomed.append(path + ".sig")
+    logger.info(f"Cache prune plan for {pkg_mgr}: {len(doomed)} files, {freed} bytes across {len(groups)} packages")
+    return doomed, freed
+
+def prune_cache(pkg_mgr, directories=None, keep=3):
+    """Plan and delete in one go, as root. Returns (files removed, bytes planned).
+
+    Files are unlinked one by one, so a huge cache never has to fit into one argv.
+    """
+    paths, freed = plan_prune(pkg_mgr, directories, keep)
+    removed = 0
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # cleaned by something else since it was planned
+            continue
+        removed += 1
+    logger.info(f"Pruned {removed} cached files for {pkg_mgr}")
+    return removed, freed
@@ -0,0 +1,255 @@
+import os
+import bz2
+import glob
+import gzip
+import lzma
+import bisect
+import logging
+import tarfile
+import xml.etree.ElementTree as ET
+from array import array
+
+logger = logging.getLogger("PackageIndex")
+
+PACMAN_SYNC_GLOB = "var/lib/pacman/sync/*.db"
+APT_LISTS_GLOB = "var/lib/apt/lists/*_Packages"
+DNF_PRIMARY_GLOBS = [
+    "var/cache/dnf/*/repodata/*primary.xml*",
+    "var/cache/libdnf5/*/repodata/*primary.xml*",
+]
+_RPM_NS = "{http://linux.duke.edu/metadata/common}"
+_RPM_FORMAT_NS = "{http://linux.duke.edu/metadata/rpm}"
+
+def _open_compressed(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+def _strip_version(dep):
+    # "p7zip=17.05", "libfoo (>= 1.2)" and "libbar.so=1-64" all name the part before the constraint
+    dep = dep.strip()
+    for sep in ("=", "<", ">", " ", "("):
+        dep = dep.split(sep, 1)[0]
+    return dep.strip()
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class PackageIndex:
+    """Names and descriptions from the local repo metadata, searchable by prefix and trigram."""
+
+    def __init__(self):
+        self.names = []
+        self.descriptions = []
+        self.repos = []
+        # virtual or replaced name -> real packages that provide it
+        self.provides = {}
+        self._by_name = {}
+        self._trigrams = {}
+        # (lowercased name, id) for prefix lookups
+        self._sorted = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def add(self, name, description="", repo=""):
+        if name in self._by_name:
+            return
+        pkg_id = len(self.names)
+        self.names.append(name)
+        self.descriptions.append(description)
+        self.repos.append(repo)
+        self._by_name[name] = pkg_id
+        for gram in _trigrams(f"{name} {description}".lower()):
+            # compact posting lists, a full repo has millions of entries
+            postings = self._trigrams.get(gram)
+            if postings is None:
+                postings = self._trigrams[gram] = array("I")
+            postings.append(pkg_id)
+
+    def add_provides(self, name, virtuals):
+        for virtual in virtuals:
+            virtual = _strip_version(virtual)
+            if virtual and virtual != name:
+                providers = self.provides.setdefault(virtual, [])
+                if name not in providers:
+                    providers.append(name)
+
+    def finish(self):
+        self._sorted = sorted((name.lower(), i) for i, name in enumerate(self.names))
+        return self
+
+    def get(self, name):
+        pkg_id = self._by_name.get(name)
+        if pkg_id is None:
+            return None
+        return {"name": name, "description": self.descriptions[pkg_id], "repo": self.repos[pkg_id]}
+
+    def prefix(self, query, limit=50):
+        query = query.lower()
+        start = bisect.bisect_left(self._sorted, (query, -1))
+        results = []
+        for name, pkg_id in self._sorted[start:]:
+            if not name.startswith(query) or len(results) >= limit:
+                break
+            results.append(pkg_id)
+        return results
+
+    def search(self, query, limit=50):
+        """Prefix hits on the name first, then trigram hits on name and description."""
+        query = query.strip().lower()
+        if not query:
+            return []
+        ids = self.prefix(query, limit)
+        if len(query) >= 3 and len(ids) < limit:
+            # rarest trigram first keeps the intersection small
+            posting = sorted((self._trigrams.get(g, ()) for g in _trigrams(query)), key=len)
+            if posting and posting[0]:
+                candidates = set(posting[0])
+                for other in posting[1:]:
+                    candidates.intersection_update(other)
+                    if not candidates:
+                        break
+                seen = set(ids)
+                hits = []
+                for pkg_id in candidates:
+                    if pkg_id in seen:
+                        continue
+                    # trigrams can match out of order, confirm the substring
+                    text = f"{self.names[pkg_id]} {self.descriptions[pkg_id]}".lower()
+                    if query in text:
+                        in_name = query in self.names[pkg_id].lower()
+                        hits.append((not in_name, len(self.names[pkg_id]), pkg_id))
+                ids += [pkg_id for _, _, pkg_id in sorted(hits)[:limit - len(ids)]]
+        return [self.get(self.names[pkg_id]) for pkg_id in ids]
+
+    # loaders, each one reads metadata the package manager already downloaded
+
+    def load_pacman(self, root="/"):
+        for db_path in sorted(glob.glob(os.path.join(root, PACMAN_SYNC_GLOB))):
+            repo = os.path.basename(db_path)[:-3]
+            try:
+                with tarfile.open(db_path, "r:*") as tar:
+                    for member in tar:
+                        if not member.name.endswith("/desc"):
+                            continue
+                        fields = _parse_pacman_desc(tar.extractfile(member).read().decode("utf-8", "replace"))
+                        if "NAME" in fields:
+                            self.add(fields["NAME"][0], " ".join(fields.get("DESC", [])), repo)
+                            self.add_provides(fields["NAME"][0], fields.get("PROVIDES", []) + fields.get("REPLACES", []))
+            except (tarfile.TarError, OSError) as e:
+                # zstd compressed dbs can't be read by tarfile here
+                logger.warning(f"Skipping pacman db {db_path}: {e}")
+        return self
+
+    def load_apt(self, root="/"):
+        for list_path in sorted(glob.glob(os.path.join(root, APT_LISTS_GLOB))):
+            repo = os.path.basename(list_path).split("_dists_")[0]
+            try:
+                with open(list_path, "r", encoding="utf-8", errors="replace") as f:
+                    for fields in _iter_deb_stanzas(f):
+                        if "Package" in fields:
+                            self.add(fields["Package"], fields.get("Description", ""), repo)
+                            if "Provides" in fields:
+                                self.add_provides(fields["Package"], fields["Provides"].split(","))
+            except OSError as e:
+                logger.warning(f"Skipping apt list {list_path}: {e}")
+        return self
+
+    def load_simulated(self):
+        from .simulated import SimConfig, Universe
+
+        universe = Universe(SimConfig.from_env())
+        for name in universe.names:
+            self.add(name, f"Simulated package, {universe.sizes[name]} bytes", "simulated")
+        return self
+
+    def load_dnf(self, root="/"):
+        for pattern in DNF_PRIMARY_GLOBS:
+            for primary in sorted(glob.glob(os.path.join(root, pattern))):
+                if primary.endswith((".sqlite", ".zck", ".zst")):
+                    continue
+                repo = primary.split("/repodata/")[0].rsplit("/", 1)[-1]
+                try:
+                    with _open_compressed(primary) as f:
+                        for _, elem in ET.iterparse(f):
+                            if elem.tag != f"{_RPM_NS}package":
+                                continue
+                            name = elem.findtext(f"{_RPM_NS}name")
+                            if name:
+                                self.add(name, elem.findtext(f"{_RPM_NS}summary") or "", repo)
+                                # file and soname provides are noise for name resolution
+                                self.add_provides(name, [e.get("name", "") for e in elem.iterfind(
+                                    f"{_RPM_NS}format/{_RPM_FORMAT_NS}provides/{_RPM_FORMAT_NS}entry")
+                                    if not e.get("name", "/").startswith("/") and "(" not in e.get("name", "")])
+                            elem.clear()
+                except (ET.ParseError, OSError, EOFError, lzma.LZMAError) as e:
+                    logger.warning(f"Skipping dnf metadata {primary}: {e}")
+        return self
+
+def _parse_pacman_desc(text):
+    fields = {}
+    key = None
+    for line in text.splitlines():
+        if line.startswith("%") and line.endswith("%"):
+            key = line[1:-1]
+            fields[key] = []
+        elif line and key:
+            fields[key].append(line)
+    return fields
+
+def _iter_deb_stanzas(lines):
+    fields = {}
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line:
+            if fields:
+                yield fields
+            fields = {}
+        elif line[0] in " \t":
+            # continuation, only the short description is worth keeping
+            continue
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            fields[key] = value.strip()
+    if fields:
+        yield fields
+
+METADATA_GLOBS = {
+    "pacman": [PACMAN_SYNC_GLOB],
+    "apt": [APT_LISTS_GLOB],
+    "dnf": DNF_PRIMARY_GLOBS,
+}
+
+def metadata_files(pkg_mgr, root="/"):
+    """(path, mtime, size) of every file build_index reads, enough to tell when a cache is stale."""
+    files = []
+    for pattern in METADATA_GLOBS.get(pkg_mgr, []):
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append([path, st.st_mtime_ns, st.st_size])
+    return files
+
+def build_index(pkg_mgr, root="/"):
+    index = PackageIndex()
+    if pkg_mgr == "pacman":
+        index.load_pacman(root)
+    elif pkg_mgr == "apt":
+        index.load_apt(root)
+    elif pkg_mgr == "dnf":
+        index.load_dnf(root)
+    elif pkg_mgr == "simulated":
+        index.load_simulated()
+    index.finish()
+    logger.info(f"Indexed {len(index)} packages for {pkg_mgr}")
+    return index
@@ -0,0 +1,119 @@
+import os
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger("Priority")
+
+# jobs nobody is waiting on, installs and removals keep full priority
+BACKGROUND_OPS = ("refresh", "firmware_refresh", "flatpak_refresh", "cleanup")
+MODES = ("off", "auto", "nice", "systemd")
+NICE_LEVEL = 19
+# lowest best-effort io priority. Not the idle class: a refresh holds the package database
+# lock, and starving it on a busy disk would make an interactive install wait behind it
+IONICE_CLASS = 2
+IONICE_LEVEL = 7
+# cgroup v2 weights, 100 is what everything else gets
+CPU_WEIGHT = 20
+IO_WEIGHT = 20
+SAMPLE_INTERVAL = 0.25
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+def resolve_mode(mode, privileged=None):
+    """auto picks a transient systemd scope when it runs as root, plain nice/ionice otherwise."""
+    if mode not in MODES:
+        raise ValueError(f"unknown priority mode: {mode!r}")
+    if mode != "auto":
+        return mode
+    privileged = os.getuid() == 0 if privileged is None else privileged
+    if privileged and shutil.which("systemd-run") and os.path.isdir("/run/systemd/system"):
+        return "systemd"
+    return "nice" if shutil.which("nice") else "off"
+
+def _nice_prefix():
+    prefix = ["nice", "-n", str(NICE_LEVEL)]
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", str(IONICE_CLASS), "-n", str(IONICE_LEVEL)]
+    return prefix
+
+def background_command(cmd, mode="auto"):
+    """cmd wrapped to run at background priority.
+
+    A leading pkexec stays in front so the wrapper runs as root, polkit then authorizes
+    systemd-run or nice rather than the package manager itself.
+    """
+    if cmd and cmd[0] == "pkexec":
+        return ["pkexec"] + background_command(cmd[1:], resolve_mode(mode, privileged=True))
+    mode = resolve_mode(mode)
+    if mode == "off" or not cmd:
+        return cmd
+    if mode == "systemd":
+        # a scope keeps the process attached to us for output and cancel, but in its own limited cgroup
+        return ["systemd-run", "--scope", "--quiet", "--collect", "-p", f"CPUWeight={CPU_WEIGHT}",
+                "-p", f"IOWeight={IO_WEIGHT}", "--"] + _nice_prefix() + cmd
+    return _nice_prefix() + cmd
+
+def _group_members(pgid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # fields[0] is the state, pgrp is the third field after the command name
+            pgrp = int(fields[2])
+        except (OSError, IndexError, ValueError):
+            continue
+        if pgrp == pgid:
+            pids.append((int(entry), fields))
+    return pids
+
+class ThrottleMonitor:
+    """Samples how long a process group waited for a CPU or on block io, while it runs.
+
+    Run-queue wait comes from /proc/<pid>/schedstat, io delay from delayacct_blkio_ticks
+    (zero unless the kernel has delay accounting on). Both are cumulative per process, so
+    the last sample of every pid is its total; whatever a process does after the last
+    sample before exiting is lost.
+    """
+
+    def __init__(self, pgid, interval=SAMPLE_INTERVAL):
+        self.pgid = pgid
+        self.interval = interval
+        self._cpu_wait = {}
+        self._io_delay = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        for pid, fields in _group_members(self.pgid):
+            try:
+                with open(f"/proc/{pid}/schedstat", "r") as f:
+                    self._cpu_wait[pid] = max(self._cpu_wait.get(pid, 0), int(f.read().split()[1]))
+            except (OSError, IndexError, ValueError):
+                pass
+            try:
+                # delayacct_blkio_ticks, field 42 of stat
+                self._io_delay[pid] = max(self._io_delay.get(pid, 0), int(fields[39]))
+            except (IndexError, ValueError):
+                pass
+
+    def start(self):
+        def loop():
+            while not self._stop.wait(self.interval):
+                self.sample()
+        self.sample()
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.throttled
+
+    @property
+    def throttled(self):
+        return sum(self._cpu_wait.values()) / 1e9 + sum(self._io_delay.values()) / _CLK_TCK
@@ -1,21 +1,69 @@
-import subprocess
 import json
 import os
 import platform
 import re
 import logging
+from .devices import DriverMatch, parse_devices
+from .sysinfo import SystemInfo
+from .sysfs import SysfsReader
+from .hwids import HardwareNames
+from .runner import run
+from .distro import PKG_MGR_ENV, SIMULATOR
 
 logger = logging.getLogger("SysProbe")
 
+PROBE_TIMEOUT = 15
+FIRMWARE_TIMEOUT = 120
+
+PCI_COMMAND = ["lspci", "-nnmm"]
+USB_COMMAND = ["lsusb"]
+
+def firmware_command():
+    if os.environ.get(PKG_MGR_ENV) == "simulated":
+        # the simulation never asks the real fwupd
+        return SIMULATOR + ["firmware-check"]
+    cmd = ["fwupdmgr", "get-updates", "--json"]
+    return cmd if os.getuid() == 0 else ["pkexec"] + cmd
+
+def parse_firmware_result(result):
+    """The fwupdmgr JSON when it lists updatable devices, None otherwise."""
+    if result.timed_out:
+        logger.warning(f"fwupdmgr did not answer within {FIRMWARE_TIMEOUT}s")
+        return None
+    if result.returncode == 0:
+        try:
+            data = json.loads(result.stdout)
+            if data and isinstance(data, dict) and data.get("Devices"):
+                return data
+            logger.info("fwupdmgr returned 0 but no devices were found in JSON.")
+        except Exception as e:
+            logger.error(f"Failed to parse fwupdmgr JSON: {e}")
+    elif result.returncode == 2:
+        logger.info("No firmware updates available (fwupdmgr returned 2).")
+    else:
+        logger.warning(f"fwupdmgr failed with code {result.returncode}: {result.stderr}")
+    return None
+
 class SysProbe:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, sysfs_root="/"):
         if db_path is None:
-            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            self.db_path = os.path.join(base_dir, "data", "drivers.json")
+            self.db_path = self.default_db_path()
         else:
             self.db_path = db_path
         logger.info(f"Initializing SysProbe with DB: {self.db_path}")
         self.drivers_db = self._load_db()
+        # parsed once per scan and shared by the gpu info and the driver matching
+        self.devices = None
+        self.sysfs = SysfsReader(sysfs_root)
+        # only opened when lspci/lsusb are missing and sysfs has to be read instead
+        self.names = HardwareNames(sysfs_root)
+        self.info = SystemInfo(self, root=sysfs_root)
+
+    @staticmethod
+    def default_db_path():
+        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return os.path.join(base_dir, "data", "drivers.json")
+
     def _load_db(self):
         try:
             if os.path.exists(self.db_path):
@@ -26,71 +74,48 @@ class SysProbe:
             logger.error(f"Error loading database: {e}")
         return {}
 
-    def get_pci_devices(self):
-        if not os.path.exists("/usr/bin/lspci") and not os.path.exists("/bin/lspci"):
-            logger.error("lspci not found! Please install pciutils.")
+    def _list(self, cmd):
+        """Output lines of lspci/lsusb, FileNotFoundError when the tool isn't installed."""
+        logger.debug(f"Running {' '.join(cmd)}")
+        result = run(cmd, timeout=PROBE_TIMEOUT)
+        if not result.ok:
+            logger.error(f"{cmd[0]} failed with code {result.returncode}: {result.stderr.strip()}")
             return []
+        return result.stdout.strip().split("\n")
+
+    def get_pci_devices(self):
         try:
-            logger.debug("Running lspci -nnmm")
             # -nn adds numeric IDs like [0300]
-            output = subprocess.check_output(["lspci", "-nnmm"], text=True)
-            return output.strip().split("\n")
+            return self._list(PCI_COMMAND)
+        except FileNotFoundError:
+            logger.error("lspci not found! Please install pciutils.")
         except Exception as e:
             logger.error(f"Failed to get PCI devices: {e}")
-            return []
+        return []
+
     def get_usb_devices(self):
-        if not os.path.exists("/usr/bin/lsusb") and not os.path.exists("/bin/lsusb"):
-            logger.error("lsusb not found! Please install usbutils.")
-            return []
         try:
-            logger.debug("Running lsusb")
-            output = subprocess.check_output(["lsusb"], text=True)
-            return output.strip().split("\n")
+            return self._list(USB_COMMAND)
+        except FileNotFoundError:
+            logger.error("lsusb not found! Please install usbutils.")
         except Exception as e:
             logger.error(f"Failed to get USB devices: {e}")
-            return []
+        return []
+
     def get_firmware_updates(self):
         """Check for firmware updates using fwupdmgr."""
         try:
             logger.info("Checking for firmware updates...")
-            cmd = ["pkexec", "fwupdmgr", "get-updates", "--json"]
-            if os.getuid() == 0:
-                cmd = ["fwupdmgr", "get-updates", "--json"]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                try:
-                    data = json.loads(result.stdout)
-                    if data and isinstance(data, dict) and data.get("Devices"):
-                        return data
-                    logger.info("fwupdmgr returned 0 but no devices were found in JSON.")
-                    return None
-                except Exception as e:
-                    logger.error(f"Failed to parse fwupdmgr JSON: {e}")
-                    return None
-            elif result.returncode == 2:
-                logger.info("No firmware updates available (fwupdmgr returned 2).")
-                return None
-            else:
-                logger.warning(f"fwupdmgr failed with code {result.returncode}: {result.stderr}")
+            return parse_firmware_result(run(firmware_command(), timeout=FIRMWARE_TIMEOUT))
         except FileNotFoundError:
             logger.info("fwupdmgr not found, skipping firmware check.")
         except Exception as e:
             logger.error(f"Error checking firmware updates: {e}")
         return None
 
-    def get_system_info(self):
+    def get_system_info(self, on_result=None):
         logger.info("Collecting system info...")
-        info = {
-            "os": platform.freedesktop_os_release().get("PRETTY_NAME", platform.system()),
-            "kernel": platform.release(),
-            "cpu": self._get_cpu_info(),
-            "gpu": self._get_gpu_info(),
-            "ram": self._get_ram_info(),
-            "desktop": os.environ.get("XDG_CURRENT_DESKTOP", "Unknown"),
-            "session": os.environ.get("XDG_SESSION_TYPE", "Unknown")
-        }
-        return info
+        return self.info.collect(on_result)
 
     def _get_cpu_info(self):
         try:
@@ -105,21 +130,11 @@ class SysProbe:
 
     def _get_gpu_info(self):
         try:
-            pci = self.get_pci_devices()
+            devices = self.devices if self.devices is not None else self.scan_devices()
             gpus = []
-            for dev in pci:
-                if "[0300]" in dev or "[0302]" in dev: # VGA/3D controller
-                    parts = re.findall(r'\"(.*?)\"', dev)
-                    if len(parts) >= 3:
-                        vendor_str = parts[1]
-                        device_str = parts[2]
-                        # get content of first set of brackets in vendor_str (e.g. [AMD/ATI])
-                        vendor_match = re.search(r'\[(.*?)\]', vendor_str)
-                        vendor = vendor_match.group(1) if vendor_match else vendor_str
-                        # get content of first set of brackets in device_str (e.g. [model_name])
-                        device_match = re.search(r'\[(.*?)\]', device_str)
-                        device = device_match.group(1) if device_match else device_str
-                        gpus.append(f"{vendor} {device}")
+            for dev in devices:
+                if dev.class_id in ("0300", "0302"): # VGA/3D controller
+                    gpus.append(f"{dev.short_vendor} {dev.short_device}")
             return ", ".join(gpus) if gpus else "Unknown GPU"
         except:
             return "Unknown GPU"
@@ -136,10 +151,28 @@ class SysProbe:
         except:
             return "Unknown RAM"
 
-    def find_needed_packages(self, distro_id):
-        pci_devices = self.get_pci_devices()
-        usb_devices = self.get_usb_devices()
-        all_devices = pci_devices + usb_devices
+    def scan_devices(self):
+        """Run lspci/lsusb and parse their output into Device records, read sysfs for whichever is missing."""
+        try:
+            pci = parse_devices(self._list(PCI_COMMAND))
+        except Exception as e:
+            logger.info(f"lspci unavailable ({e}), reading PCI devices from sysfs")
+            pci = self.sysfs.pci_devices(self.names)
+        try:
+            usb = parse_devices([], self._list(USB_COMMAND))
+        except Exception as e:
+            logger.info(f"lsusb unavailable ({e}), reading USB devices from sysfs")
+            usb = self.sysfs.usb_devices(self.names)
+        self.devices = pci + usb
+        return self.devices
+
+    def find_needed_packages(self, distro_id, devices=None):
+        # devices can come from a stored snapshot instead of this host
+        if devices is None:
+            devices = self.scan_devices()
+        return self.match_devices(distro_id, devices)
+
+    def match_devices(self, distro_id, all_devices):
         results = []
         logger.info(f"Scanning for missing packages across {len(self.drivers_db)} categories")
         for cat, drivers in self.drivers_db.items():
@@ -150,20 +183,25 @@ class SysProbe:
                 if not isinstance(driver, dict) or "search_patterns" not in driver:
                     continue
                 class_id = driver.get("class_id")
+                # patterns have to start a word, so "ATI" no longer hits "Corporation"
+                patterns = re.compile("|".join(r"(?<![a-z0-9])" + re.escape(p.lower()) for p in driver["search_patterns"]))
                 for device in all_devices:
-                    # the device string should contain it in brackets if class_id is available (from -nn)
-                    if class_id and f"[{class_id}]" not in device:
+                    if class_id and device.class_id != class_id:
                         continue
-                    if any(pattern.lower() in device.lower() for pattern in driver["search_patterns"]):
+                    if patterns.search(device.search_text):
                         pkgs = driver["packages"].get(distro_id) or driver["packages"].get("arch")
                         if pkgs:
-                            logger.info(f"Matched device '{device}' to driver '{driver['name']}' ({cat})")
-                            results.append({
-                                "driver_name": driver["name"],
-                                "device_raw": device,
-                                "packages": pkgs,
-                                "category": cat
-                            })
+                            logger.info(f"Matched device {device} to driver '{driver['name']}' ({cat})")
+                            results.append(DriverMatch(driver["name"], cat, pkgs, device, driver.get("modules", [])))
                         break # move to next driver entry
 
         return results
+
+    def check_bindings(self, matches):
+        """Record whether the kernel actually runs each installed driver, no subprocesses involved."""
+        loaded = self.sysfs.loaded_modules()
+        for match in matches:
+            match.bound_driver = self.sysfs.bound_driver(match.device)
+            match.state = self.sysfs.driver_state(match, match.modules, loaded)
+            logger.debug(f"{match.driver_name}: {match.state} (bound: {match.bound_driver})")
+        return matches
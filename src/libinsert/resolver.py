@@ -0,0 +1,117 @@
+import os
+import json
+import logging
+import tempfile
+from .pkgindex import build_index, metadata_files
+
+logger = logging.getLogger("Resolver")
+
+ALIASES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "aliases.json")
+CACHE_DIR = os.path.expanduser("~/.cache/insert-source")
+CACHE_VERSION = 1
+
+def load_aliases(path=ALIASES_FILE):
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not load aliases from {path}: {e}")
+        return {}, {}
+    return data.get("aliases", {}), data.get("groups", {})
+
+def load_provides(pkg_mgr, root="/", cache_dir=CACHE_DIR, index=None):
+    """Package names and the provides map of the repo metadata, from a disk cache while the metadata is unchanged."""
+    files = metadata_files(pkg_mgr, root)
+    cache_path = os.path.join(cache_dir, f"provides-{pkg_mgr}.json") if cache_dir and files else None
+    if cache_path:
+        try:
+            with open(cache_path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION and data.get("files") == files:
+                return set(data["names"]), data["provides"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if index is None:
+        index = build_index(pkg_mgr, root)
+    names, provides = set(index.names), index.provides
+    if cache_path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".provides-")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": CACHE_VERSION, "files": files, "names": sorted(names), "provides": provides}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write provides cache {cache_path}: {e}")
+    return names, provides
+
+class Resolver:
+    """Maps a logical package name to the one this host actually has or can install."""
+
+    def __init__(self, family, pkg_mgr, names, provides, installed, aliases=None, groups=None):
+        self.family = family
+        self.pkg_mgr = pkg_mgr
+        self.names = names
+        self.provides = provides
+        self.aliases = aliases or {}
+        self.groups = groups or {}
+        self.update_installed(installed)
+
+    def update_installed(self, installed):
+        self.installed = set(installed)
+        self._cache = {}
+
+    def candidates(self, logical):
+        # this family's names first, then the name itself, then whatever other families call it
+        per_family = self.aliases.get(logical, {})
+        order = list(per_family.get(self.family, [])) + [logical]
+        for family, names in per_family.items():
+            if family != self.family:
+                order += names
+        return list(dict.fromkeys(order))
+
+    def _installed(self, name):
+        if name.startswith("@"):
+            members = self.groups.get(name)
+            return bool(members) and all(m in self.installed for m in members)
+        return name in self.installed
+
+    def _available(self, name):
+        if name.startswith("@"):
+            return self.pkg_mgr == "dnf"
+        return name in self.names
+
+    def resolve(self, logical):
+        """Concrete name for logical, None when neither the system nor the repos have it."""
+        if logical in self._cache:
+            return self._cache[logical]
+        candidates = self.candidates(logical)
+        found = next((c for c in candidates if self._installed(c)), None)
+        if found is None:
+            # something installed may provide it under another name
+            found = next((p for c in candidates for p in self.provides.get(c, ()) if p in self.installed), None)
+        if found is None:
+            found = next((c for c in candidates if self._available(c)), None)
+        if found is None:
+            found = next((p for c in candidates for p in self.provides.get(c, ())), None)
+        if found is None and not self.names:
+            # no repo metadata to go by, keep the name and let the package manager decide
+            found = logical
+        self._cache[logical] = found
+        return found
+
+    def is_installed(self, logical):
+        name = self.resolve(logical)
+        return name is not None and self._installed(name)
+
+    def resolve_many(self, logicals):
+        return {logical: self.resolve(logical) for logical in logicals}
+
+def build_resolver(distro_mgr, installed=None, index=None, root="/", cache_dir=CACHE_DIR, aliases_path=ALIASES_FILE):
+    """Resolver for this host, installed defaults to one package manager listing call."""
+    names, provides = load_provides(distro_mgr.pkg_mgr, root, cache_dir, index)
+    if installed is None:
+        installed = distro_mgr.get_installed_packages()
+    aliases, groups = load_aliases(aliases_path)
+    return Resolver(distro_mgr.family, distro_mgr.pkg_mgr, names, provides, installed, aliases, groups)
@@ -0,0 +1,181 @@
+import os
+import glob
+import struct
+import logging
+import sqlite3
+from urllib.parse import quote
+from .pkgindex import _parse_pacman_desc, _iter_deb_stanzas, _strip_version
+
+logger = logging.getLogger("RootFS")
+
+OS_RELEASE_PATHS = ("etc/os-release", "usr/lib/os-release")
+PACMAN_LOCAL = "var/lib/pacman/local"
+DPKG_STATUS = "var/lib/dpkg/status"
+# newer Fedora and openSUSE keep it under sysimage, /var/lib/rpm is a symlink there
+RPMDB_PATHS = ("usr/lib/sysimage/rpm/rpmdb.sqlite", "var/lib/rpm/rpmdb.sqlite")
+APK_INSTALLED = "lib/apk/db/installed"
+
+RPMTAG_NAME = 1000
+RPMTAG_PROVIDENAME = 1047
+_RPM_STRING = 6
+_RPM_STRING_ARRAY = 8
+_MAX_LINKS = 40
+
+def resolve(root, path):
+    """path inside root with every symlink followed as if root were /, so absolute links can't escape to the host."""
+    root = os.path.abspath(root)
+    parts = [p for p in path.split("/") if p and p != "."]
+    resolved = []
+    links = 0
+    while parts:
+        part = parts.pop(0)
+        if part == "..":
+            if resolved:
+                resolved.pop()
+            continue
+        current = os.path.join(root, *resolved, part)
+        if os.path.islink(current):
+            links += 1
+            if links > _MAX_LINKS:
+                raise OSError(f"too many levels of symbolic links in {path}")
+            target = os.readlink(current)
+            if target.startswith("/"):
+                resolved = []
+            parts = [p for p in target.split("/") if p and p != "."] + parts
+            continue
+        resolved.append(part)
+    return os.path.join(root, *resolved)
+
+def read_os_release(root="/"):
+    """os-release text of the system at root, empty if it has none."""
+    for path in OS_RELEASE_PATHS:
+        try:
+            with open(resolve(root, path), "r") as f:
+                return f.read()
+        except OSError:
+            continue
+    return ""
+
+def _add_provides(provides, name, virtuals):
+    for virtual in virtuals:
+        virtual = _strip_version(virtual)
+        # file and soname provides are noise for name resolution
+        if virtual and virtual != name and not virtual.startswith("/") and "(" not in virtual:
+            provides.setdefault(virtual, []).append(name)
+
+def _pacman_local(root):
+    local = resolve(root, PACMAN_LOCAL)
+    if not os.path.isdir(local):
+        return None
+    names, provides = set(), {}
+    for entry in os.scandir(local):
+        try:
+            with open(os.path.join(entry.path, "desc"), "r", encoding="utf-8", errors="replace") as f:
+                fields = _parse_pacman_desc(f.read())
+        except OSError:
+            # ALPM_DB_VERSION and friends
+            continue
+        if "NAME" in fields:
+            names.add(fields["NAME"][0])
+            _add_provides(provides, fields["NAME"][0], fields.get("PROVIDES", []))
+    return names, provides
+
+def _dpkg_status(root):
+    names, provides = set(), {}
+    try:
+        with open(resolve(root, DPKG_STATUS), "r", encoding="utf-8", errors="replace") as f:
+            for fields in _iter_deb_stanzas(f):
+                # removed packages keep a stanza until they are purged
+                if "Package" not in fields or not fields.get("Status", "").endswith(" installed"):
+                    continue
+                names.add(fields["Package"])
+                if "Provides" in fields:
+                    _add_provides(provides, fields["Package"], fields["Provides"].split(","))
+    except OSError:
+        return None
+    return names, provides
+
+def parse_rpm_header(blob, tags=(RPMTAG_NAME, RPMTAG_PROVIDENAME)):
+    """tag -> value for the string tags asked for, from a header blob as rpmdb.sqlite stores it."""
+    count, data_len = struct.unpack_from(">ii", blob, 0)
+    data_start = 8 + count * 16
+    values = {}
+    for i in range(count):
+        tag, kind, offset, n = struct.unpack_from(">iiii", blob, 8 + i * 16)
+        if tag not in tags or kind not in (_RPM_STRING, _RPM_STRING_ARRAY):
+            continue
+        strings = []
+        pos = data_start + offset
+        for _ in range(n if kind == _RPM_STRING_ARRAY else 1):
+            end = blob.index(b"\0", pos)
+            strings.append(blob[pos:end].decode("utf-8", "replace"))
+            pos = end + 1
+        values[tag] = strings if kind == _RPM_STRING_ARRAY else strings[0]
+    return values
+
+def _rpmdb(root):
+    for path in RPMDB_PATHS:
+        path = resolve(root, path)
+        if os.path.exists(path):
+            break
+    else:
+        if glob.glob(resolve(root, "var/lib/rpm") + "/Packages*"):
+            logger.warning(f"{root} has a BerkeleyDB or ndb rpm database, only rpmdb.sqlite can be read directly")
+        return None
+    names, provides = set(), {}
+    # immutable: a read-only image mount can't take the locks or create a -wal file
+    db = sqlite3.connect(f"file:{quote(path)}?mode=ro&immutable=1", uri=True)
+    try:
+        for (blob,) in db.execute("SELECT blob FROM Packages"):
+            try:
+                header = parse_rpm_header(bytes(blob))
+            except (struct.error, ValueError):
+                continue
+            name = header.get(RPMTAG_NAME)
+            if name:
+                names.add(name)
+                _add_provides(provides, name, header.get(RPMTAG_PROVIDENAME, []))
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read {path}: {e}")
+        return None
+    finally:
+        db.close()
+    return names, provides
+
+def _apk_installed(root):
+    names, provides = set(), {}
+    name = None
+    try:
+        with open(resolve(root, APK_INSTALLED), "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                key, _, value = line.rstrip("\n").partition(":")
+                if key == "P":
+                    name = value
+                    names.add(name)
+                elif key == "p" and name:
+                    _add_provides(provides, name, value.split())
+    except OSError:
+        return None
+    return names, provides
+
+INSTALLED_READERS = {
+    "pacman": _pacman_local,
+    "apt": _dpkg_status,
+    "dnf": _rpmdb,
+    "zypper": _rpmdb,
+    "apk": _apk_installed,
+}
+
+def read_installed(pkg_mgr, root="/"):
+    """(names, provides) straight from the package database files under root, None if there is none to read."""
+    reader = INSTALLED_READERS.get(pkg_mgr)
+    if reader is None:
+        return None
+    try:
+        result = reader(root)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Could not read the {pkg_mgr} database under {root}: {e}")
+        return None
+    if result is not None:
+        logger.info(f"Read {len(result[0])} installed packages from {root}")
+    return result
@@ -0,0 +1,86 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from .distro import DistroManager
+from .probe import SysProbe
+from .devices import Device
+from .resolver import Resolver, load_aliases, ALIASES_FILE
+from .rootfs import read_installed
+
+logger = logging.getLogger("RootScan")
+
+# per-process state, set up once by the pool initializer
+_worker = {}
+
+def scan_root(root, probe, devices, aliases=None, groups=None):
+    """Driver and essentials check of the system mounted at root, against the given hardware."""
+    distro_mgr = DistroManager(root)
+    result = {
+        "root": distro_mgr.root,
+        "distro": distro_mgr.id,
+        "family": distro_mgr.family,
+        "pkg_mgr": distro_mgr.pkg_mgr,
+        "installed_count": 0,
+        "matches": [],
+        "missing_essentials": [],
+        "error": None,
+    }
+    if distro_mgr.id == "unknown":
+        result["error"] = "no os-release found"
+        return result
+    installed = read_installed(distro_mgr.pkg_mgr, distro_mgr.root)
+    if installed is None:
+        result["error"] = f"no readable {distro_mgr.pkg_mgr} database"
+        return result
+    names, provides = installed
+    result["installed_count"] = len(names)
+
+    # no repo metadata needed, an essential counts as present if any of its names is installed or provided
+    resolver = Resolver(distro_mgr.family, distro_mgr.pkg_mgr, set(), provides, names, aliases, groups)
+    for match in probe.match_devices(distro_mgr.family, devices):
+        match.set_installed(resolver.is_installed)
+        result["matches"].append(match.to_dict())
+    result["missing_essentials"] = [name for name in probe.drivers_db.get("essentials", {}).get(distro_mgr.family, [])
+                                    if not resolver.is_installed(name)]
+    return result
+
+def _init_worker(db_path, device_dicts, aliases_path):
+    # keep the children quiet, the parent does the reporting
+    logging.getLogger("SysProbe").setLevel(logging.WARNING)
+    logging.getLogger("DistroManager").setLevel(logging.WARNING)
+    _worker["probe"] = SysProbe(db_path=db_path)
+    _worker["devices"] = [Device.from_dict(d) for d in device_dicts]
+    _worker["aliases"], _worker["groups"] = load_aliases(aliases_path)
+
+def _scan_path(root):
+    try:
+        return scan_root(root, _worker["probe"], _worker["devices"], _worker["aliases"], _worker["groups"])
+    except Exception as e:
+        return {"root": os.path.abspath(root), "error": str(e), "matches": [], "missing_essentials": []}
+
+def scan_roots(roots, devices, db_path=None, jobs=None, aliases_path=ALIASES_FILE):
+    """scan_root over every root with a process pool, results in the order the roots were given."""
+    if not roots:
+        return []
+    if db_path is None:
+        db_path = SysProbe.default_db_path()
+    workers = min(jobs or os.cpu_count() or 1, len(roots))
+    logger.info(f"Scanning {len(roots)} roots with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(db_path, [d.to_dict() for d in devices], aliases_path)) as pool:
+        return list(pool.map(_scan_path, roots))
+
+def format_results(results):
+    lines = []
+    for result in results:
+        if result["error"]:
+            lines.append(f"{result['root']}: {result['error']}")
+            continue
+        missing = [m for m in result["matches"] if not m["is_installed"]]
+        lines.append(f"{result['root']}: {result['distro']} ({result['family']}, {result['pkg_mgr']}), "
+                     f"{result['installed_count']} packages, {len(missing)}/{len(result['matches'])} drivers missing")
+        for match in missing:
+            lines.append(f"  {match['driver_name']:<40} missing {' '.join(match['missing_packages'])}")
+        if result["missing_essentials"]:
+            lines.append(f"  essentials missing: {' '.join(result['missing_essentials'])}")
+    return "\n".join(lines)
@@ -0,0 +1,193 @@
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+from .priority import ThrottleMonitor
+
+logger = logging.getLogger("Runner")
+
+# how long a process group gets between SIGTERM and SIGKILL
+KILL_GRACE = 3.0
+WRAPPERS = ("pkexec", "sudo", "env", "nice", "ionice", "systemd-run")
+
+class CommandResult:
+    def __init__(self, cmd, returncode=None, stdout="", stderr="", wall_time=0.0, user_time=0.0,
+                 system_time=0.0, max_rss_kb=0, timed_out=False, cancelled=False, throttled_time=0.0):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss_kb = max_rss_kb
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+        # seconds the process group spent runnable but not running, or blocked on disk io
+        self.throttled_time = throttled_time
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+    def __repr__(self):
+        return f"CommandResult({self.cmd[0] if self.cmd else '?'} rc={self.returncode} wall={self.wall_time:.2f}s)"
+
+class CommandStats:
+    """Per-command totals of every child process started through run()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @staticmethod
+    def key(cmd):
+        # "pkexec pacman -S ..." is accounted as pacman, wrapper options are skipped too
+        i = 0
+        while i < len(cmd) - 1 and os.path.basename(cmd[i]) in WRAPPERS:
+            i += 1
+            while i < len(cmd) - 1 and (cmd[i].startswith("-") or "=" in cmd[i] or cmd[i].isdigit()):
+                i += 1
+        return os.path.basename(cmd[i]) if cmd else "?"
+
+    def record(self, result):
+        with self._lock:
+            entry = self._stats.setdefault(self.key(result.cmd), {
+                "calls": 0, "failures": 0, "timeouts": 0, "cancelled": 0,
+                "wall_total": 0.0, "wall_max": 0.0, "user_total": 0.0, "system_total": 0.0, "max_rss_kb": 0,
+            })
+            entry["calls"] += 1
+            entry["failures"] += 0 if result.returncode == 0 else 1
+            entry["timeouts"] += 1 if result.timed_out else 0
+            entry["cancelled"] += 1 if result.cancelled else 0
+            entry["wall_total"] += result.wall_time
+            entry["wall_max"] = max(entry["wall_max"], result.wall_time)
+            entry["user_total"] += result.user_time
+            entry["system_total"] += result.system_time
+            entry["max_rss_kb"] = max(entry["max_rss_kb"], result.max_rss_kb)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._stats.items()}
+
+    def format(self):
+        lines = [f"{'command':<20} {'calls':>5} {'fail':>4} {'wall s':>8} {'max s':>7} {'cpu s':>7} {'rss MB':>7}"]
+        for name, e in sorted(self.snapshot().items(), key=lambda kv: -kv[1]["wall_total"]):
+            lines.append(f"{name:<20} {e['calls']:>5} {e['failures']:>4} {e['wall_total']:>8.2f} {e['wall_max']:>7.2f} "
+                         f"{e['user_total'] + e['system_total']:>7.2f} {e['max_rss_kb'] / 1024:>7.1f}")
+        return "\n".join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+STATS = CommandStats()
+
+def kill_group(process, grace=KILL_GRACE):
+    """SIGTERM the whole process group, SIGKILL it if it is still around after the grace period."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        except PermissionError:
+            # setuid children (pkexec) can't be signalled by us
+            logger.warning(f"Not allowed to signal process group {process.pid}")
+            return
+        deadline = time.monotonic() + grace
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                return
+            time.sleep(0.05)
+
+def run(cmd, timeout=None, cancel_event=None, on_line=None, capture=True, merge_stderr=False, env=None,
+        measure_throttle=False):
+    """Run cmd in its own process group and return a CommandResult.
+
+    on_line gets every stdout line as it arrives. timeout (seconds) and cancel_event
+    both kill the whole group. measure_throttle samples the group's scheduler and io
+    wait into throttled_time. Raises OSError if the program can't be started.
+    """
+    start = time.monotonic()
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+        text=True,
+        errors="replace",
+        bufsize=1,
+        env=env,
+        start_new_session=True,
+    )
+    result = CommandResult(cmd)
+    finished = threading.Event()
+    # the group id is the child's pid, start_new_session made it a group leader
+    monitor = ThrottleMonitor(process.pid).start() if measure_throttle else None
+
+    def watchdog():
+        deadline = start + timeout if timeout else None
+        while not finished.wait(0.1):
+            if cancel_event is not None and cancel_event.is_set():
+                result.cancelled = True
+            elif deadline is not None and time.monotonic() > deadline:
+                result.timed_out = True
+            else:
+                continue
+            logger.warning(f"{'Cancelling' if result.cancelled else 'Timed out'}: {' '.join(cmd)}")
+            kill_group(process)
+            return
+
+    if timeout or cancel_event is not None:
+        threading.Thread(target=watchdog, daemon=True).start()
+
+    stderr_chunks = []
+    stderr_thread = None
+    if not merge_stderr:
+        stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        stderr_thread.start()
+
+    stdout_lines = []
+    completed = False
+    try:
+        for line in process.stdout:
+            if on_line is not None:
+                on_line(line.rstrip("\n"))
+            if capture:
+                stdout_lines.append(line)
+        completed = True
+    finally:
+        if not completed:
+            # on_line raised, the child must not outlive us
+            kill_group(process)
+        process.stdout.close()
+        if stderr_thread is not None:
+            stderr_thread.join()
+            process.stderr.close()
+
+        if monitor is not None:
+            # one last look while the leader is still a zombie we haven't reaped
+            monitor.sample()
+            result.throttled_time = monitor.stop()
+
+        # wait4 instead of Popen.wait so we get this child's own rusage
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            result.user_time = usage.ru_utime
+            result.system_time = usage.ru_stime
+            result.max_rss_kb = usage.ru_maxrss
+        except ChildProcessError:
+            process.wait()
+        finished.set()
+
+    result.returncode = process.returncode
+    result.stdout = "".join(stdout_lines)
+    result.stderr = "".join(c for c in stderr_chunks if c)
+    result.wall_time = time.monotonic() - start
+    STATS.record(result)
+    logger.debug(f"{' '.join(cmd)} -> {result.returncode} in {result.wall_time:.2f}s "
+                 f"(cpu {result.user_time + result.system_time:.2f}s, rss {result.max_rss_kb} KB)")
+    return result
@@ -0,0 +1,256 @@
+import json
+import logging
+import threading
+from gi.repository import Gio, GLib
+
+logger = logging.getLogger("InsertService")
+
+BUS_NAME = "io.github.hnpf.InsertSource.Service"
+OBJECT_PATH = "/io/github/hnpf/InsertSource/Service"
+INTERFACE = "io.github.hnpf.InsertSource.Service1"
+CALL_TIMEOUT_MS = 2000
+RESCAN_INTERVAL = 600
+# package managers touch their db many times per transaction, wait for it to settle
+PACKAGE_DEBOUNCE = 5
+PACKAGE_DB_PATHS = {
+    "pacman": "/var/lib/pacman/local",
+    "apt": "/var/lib/dpkg/status",
+    "dnf": "/var/lib/rpm",
+    "zypper": "/var/lib/rpm",
+}
+
+INTROSPECTION = f"""
+<node>
+  <interface name="{INTERFACE}">
+    <method name="GetState">
+      <arg type="s" name="state" direction="out"/>
+    </method>
+    <method name="GetInstalled">
+      <arg type="as" name="packages" direction="out"/>
+    </method>
+    <method name="Search">
+      <arg type="s" name="query" direction="in"/>
+      <arg type="u" name="limit" direction="in"/>
+      <arg type="s" name="results" direction="out"/>
+    </method>
+    <method name="Refresh">
+      <arg type="b" name="packages_only" direction="in"/>
+    </method>
+    <signal name="Changed">
+      <arg type="t" name="generation"/>
+    </signal>
+    <property name="Generation" type="t" access="read"/>
+  </interface>
+</node>
+"""
+
+class InsertService:
+    """Exports a ScanState on the session bus and keeps it fresh."""
+
+    def __init__(self, state, idle_timeout=0, rescan_interval=RESCAN_INTERVAL):
+        self.state = state
+        self.idle_timeout = idle_timeout
+        self.rescan_interval = rescan_interval
+        self.connections = []
+        self.loop = None
+        self._node = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION)
+        self._registrations = []
+        self._monitor = None
+        self._debounce_id = 0
+        self._idle_id = 0
+        self._pending = threading.Lock()
+        self._running = False
+        # None, "packages" or "full"
+        self._rerun = None
+
+    def register(self, connection):
+        """Export the object on a connection, used directly by tests with a private bus."""
+        registration = connection.register_object(OBJECT_PATH, self._node.interfaces[0],
+                                                  self._on_method_call, self._on_get_property, None)
+        self.connections.append(connection)
+        self._registrations.append((connection, registration))
+        return registration
+
+    def unregister(self):
+        for connection, registration in self._registrations:
+            connection.unregister_object(registration)
+        self._registrations.clear()
+        self.connections.clear()
+
+    def _on_method_call(self, connection, sender, path, interface, method, params, invocation):
+        self._touch()
+        if method == "GetState":
+            invocation.return_value(GLib.Variant("(s)", (json.dumps(self.state.to_dict()),)))
+        elif method == "GetInstalled":
+            invocation.return_value(GLib.Variant("(as)", (sorted(self.state.installed),)))
+        elif method == "Search":
+            query, limit = params.unpack()
+            invocation.return_value(GLib.Variant("(s)", (json.dumps(self.state.search(query, limit)),)))
+        elif method == "Refresh":
+            (packages_only,) = params.unpack()
+            self.refresh_async(packages_only)
+            invocation.return_value(None)
+        else:
+            invocation.return_dbus_error("org.freedesktop.DBus.Error.UnknownMethod", f"No such method: {method}")
+
+    def _on_get_property(self, connection, sender, path, interface, prop):
+        if prop == "Generation":
+            return GLib.Variant("t", self.state.generation)
+        return None
+
+    def _emit_changed(self, generation):
+        for connection in list(self.connections):
+            try:
+                # GDBus connections are thread safe, no need to hop to the main loop
+                connection.emit_signal(None, OBJECT_PATH, INTERFACE, "Changed", GLib.Variant("(t)", (generation,)))
+            except GLib.Error as e:
+                logger.warning(f"Could not emit Changed: {e.message}")
+
+    def refresh_async(self, packages_only=False):
+        # one refresh at a time, requests arriving meanwhile are folded into a single rerun
+        with self._pending:
+            if self._running:
+                self._rerun = "packages" if packages_only and self._rerun in (None, "packages") else "full"
+                return
+            self._running = True
+
+        def refresh(packages_only):
+            while True:
+                try:
+                    self._emit_changed(self.state.refresh(packages_only))
+                except Exception as e:
+                    logger.error(f"Refresh failed: {e}")
+                with self._pending:
+                    if self._rerun is None:
+                        self._running = False
+                        return
+                    packages_only = self._rerun == "packages"
+                    self._rerun = None
+
+        threading.Thread(target=refresh, args=(packages_only,), daemon=True).start()
+
+    def watch_packages(self):
+        path = PACKAGE_DB_PATHS.get(self.state.distro_mgr.pkg_mgr)
+        if path is None:
+            return
+        gfile = Gio.File.new_for_path(path)
+        try:
+            if gfile.query_file_type(Gio.FileQueryInfoFlags.NONE, None) == Gio.FileType.DIRECTORY:
+                self._monitor = gfile.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+            else:
+                self._monitor = gfile.monitor_file(Gio.FileMonitorFlags.NONE, None)
+        except GLib.Error as e:
+            logger.warning(f"Cannot watch {path}: {e.message}")
+            return
+        self._monitor.connect("changed", self._on_package_db_changed)
+        logger.info(f"Watching {path} for package changes")
+
+    def _on_package_db_changed(self, monitor, gfile, other, event):
+        if self._debounce_id:
+            GLib.source_remove(self._debounce_id)
+        self._debounce_id = GLib.timeout_add_seconds(PACKAGE_DEBOUNCE, self._on_packages_settled)
+
+    def _on_packages_settled(self):
+        self._debounce_id = 0
+        self.refresh_async(packages_only=True)
+        return False
+
+    def _on_rescan_timer(self):
+        self.refresh_async()
+        return True
+
+    def _touch(self):
+        # only D-Bus activated instances exit when nobody has asked for a while
+        if not self.idle_timeout or self.loop is None:
+            return
+        if self._idle_id:
+            GLib.source_remove(self._idle_id)
+        self._idle_id = GLib.timeout_add_seconds(self.idle_timeout, self._on_idle)
+
+    def _on_idle(self):
+        logger.info(f"No calls for {self.idle_timeout}s, exiting")
+        self._idle_id = 0
+        self.loop.quit()
+        return False
+
+    def run(self):
+        """Own the bus name on the session bus and serve until the name is lost."""
+        self.loop = GLib.MainLoop()
+
+        def on_bus_acquired(connection, name):
+            self.register(connection)
+
+        def on_name_lost(connection, name):
+            logger.warning(f"Lost or could not get {name}, another instance is probably running")
+            self.loop.quit()
+
+        owner_id = Gio.bus_own_name(Gio.BusType.SESSION, BUS_NAME, Gio.BusNameOwnerFlags.NONE,
+                                    on_bus_acquired, None, on_name_lost)
+        self.refresh_async()
+        self.watch_packages()
+        if self.rescan_interval:
+            GLib.timeout_add_seconds(self.rescan_interval, self._on_rescan_timer)
+        self._touch()
+        try:
+            self.loop.run()
+        finally:
+            Gio.bus_unown_name(owner_id)
+            self.unregister()
+
+class ServiceClient:
+    """Thin client, every call returns None when the service is not there so callers can scan locally."""
+
+    def __init__(self, connection=None, timeout_ms=CALL_TIMEOUT_MS, autostart=True):
+        self.connection = connection
+        self.timeout_ms = timeout_ms
+        self.autostart = autostart
+        self._proxy = None
+
+    def _get_proxy(self):
+        if self._proxy is None:
+            connection = self.connection or Gio.bus_get_sync(Gio.BusType.SESSION, None)
+            flags = Gio.DBusProxyFlags.DO_NOT_LOAD_PROPERTIES
+            if not self.autostart:
+                flags |= Gio.DBusProxyFlags.DO_NOT_AUTO_START
+            self._proxy = Gio.DBusProxy.new_sync(connection, flags, None, BUS_NAME, OBJECT_PATH, INTERFACE, None)
+        return self._proxy
+
+    def _call(self, method, params=None):
+        try:
+            reply = self._get_proxy().call_sync(method, params, Gio.DBusCallFlags.NONE, self.timeout_ms, None)
+        except GLib.Error as e:
+            logger.debug(f"Service call {method} failed: {e.message}")
+            return None
+        return reply.unpack() if reply is not None else ()
+
+    def get_state(self):
+        """The service state dict, None if unreachable or still on its first scan."""
+        reply = self._call("GetState")
+        if reply is None:
+            return None
+        state = json.loads(reply[0])
+        return state if state["generation"] else None
+
+    def get_matches(self):
+        from .devices import DriverMatch
+
+        state = self.get_state()
+        if state is None:
+            return None
+        return [DriverMatch.from_dict(m) for m in state["matches"]]
+
+    def installed(self):
+        reply = self._call("GetInstalled")
+        return set(reply[0]) if reply and reply[0] else None
+
+    def search(self, query, limit=50):
+        reply = self._call("Search", GLib.Variant("(su)", (query, limit)))
+        return json.loads(reply[0]) if reply is not None else None
+
+    def refresh(self, packages_only=False):
+        """Ask for a rescan without waiting for it, a Changed signal follows when it is done."""
+        try:
+            self._get_proxy().call("Refresh", GLib.Variant("(b)", (packages_only,)), Gio.DBusCallFlags.NONE,
+                                   self.timeout_ms, None, None)
+        except GLib.Error as e:
+            logger.debug(f"Service refresh failed: {e.message}")
@@ -0,0 +1,303 @@
+"""Fake package manager for load and latency testing, never touches the real system.
+
+Selected with INSERT_PKG_MGR=simulated. DistroManager runs `python -m libinsert.simulated`
+for every query and transaction, so the runner, TaskWorker and the UI see real child
+processes. Tuned through the environment:
+
+    INSERT_SIM_PACKAGES    size of the generated universe (default 2000)
+    INSERT_SIM_SEED        universe seed (default 1)
+    INSERT_SIM_LATENCY     seconds every query or transaction waits first (default 0.05)
+    INSERT_SIM_SPEED       download speed in bytes/s (default 20 MB/s)
+    INSERT_SIM_VERBOSITY   output lines per package in a transaction (default 3)
+    INSERT_SIM_FAIL_RATE   chance a package in a transaction fails (default 0)
+    INSERT_SIM_FAIL_MATCH  fnmatch pattern of packages that always fail
+    INSERT_SIM_STALL       seconds of silence before a transaction starts, for timeouts and cancel
+    INSERT_SIM_STATE       where the installed set is kept between calls
+
+firmware-refresh, firmware-update and firmware-check stand in for fwupdmgr. A fail
+pattern matching "firmware" makes the update fail.
+"""
+import os
+import sys
+import json
+import time
+import random
+import fnmatch
+import logging
+import tempfile
+
+logger = logging.getLogger("SimulatedPM")
+
+STATE_FILE = os.path.expanduser("~/.cache/insert-source/simulated.json")
+DRIVERS_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "drivers.json")
+_WORDS = ["lib", "gtk", "qt", "font", "python", "perl", "mesa", "vulkan", "codec", "theme", "x11", "wayland",
+          "audio", "net", "tool", "util", "firmware", "kernel", "doc", "devel"]
+
+class SimConfig:
+    def __init__(self, packages=2000, seed=1, latency=0.05, speed=20e6, verbosity=3, fail_rate=0.0,
+                 fail_match=None, stall=0.0, state_path=STATE_FILE):
+        self.packages = packages
+        self.seed = seed
+        self.latency = latency
+        self.speed = speed
+        self.verbosity = verbosity
+        self.fail_rate = fail_rate
+        self.fail_match = fail_match
+        self.stall = stall
+        self.state_path = state_path
+
+    @classmethod
+    def from_env(cls, environ=None):
+        env = os.environ if environ is None else environ
+        return cls(
+            packages=int(env.get("INSERT_SIM_PACKAGES", 2000)),
+            seed=int(env.get("INSERT_SIM_SEED", 1)),
+            latency=float(env.get("INSERT_SIM_LATENCY", 0.05)),
+            speed=float(env.get("INSERT_SIM_SPEED", 20e6)),
+            verbosity=int(env.get("INSERT_SIM_VERBOSITY", 3)),
+            fail_rate=float(env.get("INSERT_SIM_FAIL_RATE", 0.0)),
+            fail_match=env.get("INSERT_SIM_FAIL_MATCH") or None,
+            stall=float(env.get("INSERT_SIM_STALL", 0.0)),
+            state_path=env.get("INSERT_SIM_STATE", STATE_FILE),
+        )
+
+def _driver_packages(path=DRIVERS_DB):
+    # real driver package names are part of the universe so the Drivers page has something to install
+    try:
+        with open(path, "r") as f:
+            db = json.load(f)
+    except (OSError, ValueError):
+        return []
+    names = set()
+    for packages in db.get("essentials", {}).values():
+        names.update(p for p in packages if isinstance(p, str))
+    for drivers in db.values():
+        for driver in drivers if isinstance(drivers, list) else []:
+            for packages in driver.get("packages", {}).values() if isinstance(driver, dict) else []:
+                names.update(p for p in packages if isinstance(p, str))
+    return sorted(names)
+
+class Universe:
+    """Generated packages with sizes and dependencies, plus the installed set kept in a state file."""
+
+    def __init__(self, config):
+        self.config = config
+        rng = random.Random(config.seed)
+        self.names = [f"{rng.choice(_WORDS)}-{rng.choice(_WORDS)}-{i}" for i in range(config.packages)]
+        generated = set(self.names)
+        self.names += [n for n in _driver_packages() if n not in generated]
+        self.sizes = {}
+        self.depends = {}
+        self.versions = {}
+        for i, name in enumerate(self.names):
+            # mostly small, a few huge ones
+            self.sizes[name] = int(min(rng.lognormvariate(13, 1.5), 2e9))
+            self.versions[name] = f"{rng.randint(0, 9)}.{rng.randint(0, 30)}.{rng.randint(0, 9)}-{rng.randint(1, 5)}"
+            # only depend on earlier packages so there are no cycles
+            self.depends[name] = [self.names[j] for j in rng.sample(range(i), min(i, rng.choice((0, 0, 1, 2, 3))))]
+        self._index = set(self.names)
+        self.installed, self.explicit = self._load(rng)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def _load(self, rng):
+        try:
+            with open(self.config.state_path, "r") as f:
+                data = json.load(f)
+            if data.get("seed") == self.config.seed and data.get("packages") == self.config.packages:
+                return set(data["installed"]), set(data["explicit"])
+        except (OSError, ValueError, KeyError):
+            pass
+        # first run: a quarter installed, some of them only as dependencies
+        installed = {n for n in self.names[:self.config.packages] if rng.random() < 0.25}
+        explicit = {n for n in sorted(installed) if rng.random() < 0.6}
+        return installed, explicit
+
+    def save(self):
+        path = self.config.state_path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {"seed": self.config.seed, "packages": self.config.packages,
+                "installed": sorted(self.installed), "explicit": sorted(self.explicit)}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".simulated-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def closure(self, names, skip_installed=True):
+        """names plus everything they pull in that is not installed yet, dependencies first."""
+        order = []
+        seen = set()
+        def visit(name):
+            if name in seen or (skip_installed and name in self.installed):
+                return
+            seen.add(name)
+            for dep in self.depends.get(name, []):
+                visit(dep)
+            order.append(name)
+        for name in names:
+            visit(name)
+        return order
+
+    def orphans(self):
+        required = set()
+        for name in self.installed:
+            required.update(self.depends.get(name, []))
+        return sorted(n for n in self.installed if n not in self.explicit and n not in required)
+
+def _out(line):
+    print(line, flush=True)
+
+def _fails(config, rng, name):
+    if config.fail_match and fnmatch.fnmatch(name, config.fail_match):
+        return True
+    return config.fail_rate > 0 and rng.random() < config.fail_rate
+
+def _transfer(config, name, size):
+    # verbosity lines spread over the simulated download time
+    steps = max(1, config.verbosity)
+    delay = size / config.speed / steps if config.speed > 0 else 0
+    for step in range(1, steps + 1):
+        if delay:
+            time.sleep(delay)
+        if config.verbosity:
+            _out(f":: downloading {name} {size * step // steps}/{size} bytes ({100 * step // steps}%)")
+
+def _package_file(universe, name):
+    return f"{name}-{universe.versions[name]}.sim"
+
+def download(universe, directory, names):
+    """Fetch names and their whole closure into directory, installed or not, like pacman -Sw with an empty db."""
+    unknown = [n for n in names if n not in universe]
+    if unknown:
+        _out(f"error: target not found: {', '.join(unknown)}")
+        return 1
+    os.makedirs(directory, exist_ok=True)
+    for name in universe.closure(names, skip_installed=False):
+        _transfer(universe.config, name, universe.sizes[name])
+        with open(os.path.join(directory, _package_file(universe, name)), "w") as f:
+            f.write(f"{name} {universe.versions[name]} {universe.sizes[name]}\n")
+    return 0
+
+def install(universe, names, rng, source=None):
+    """Install names, from the package files in source instead of the network when given."""
+    config = universe.config
+    unknown = [n for n in names if n not in universe]
+    if unknown:
+        _out(f"error: target not found: {', '.join(unknown)}")
+        return 1
+    targets = universe.closure(names)
+    if source is not None:
+        missing = [t for t in targets if not os.path.exists(os.path.join(source, _package_file(universe, t)))]
+        if missing:
+            _out(f"error: failed retrieving file '{_package_file(universe, missing[0])}' from {source}")
+            return 1
+    if not targets:
+        _out(" there is nothing to do")
+        # explicitly asking for an installed dependency makes it explicit, like pacman -S --needed
+        universe.explicit.update(names)
+        universe.save()
+        return 0
+    _out(f"resolving dependencies... {len(targets)} packages ({sum(universe.sizes[t] for t in targets)} bytes)")
+    for name in targets:
+        if source is None:
+            _transfer(config, name, universe.sizes[name])
+        if _fails(config, rng, name):
+            _out(f"error: failed to commit transaction (simulated failure in {name})")
+            universe.save()
+            return 1
+        universe.installed.add(name)
+        _out(f"installing {name} {universe.versions[name]}")
+    universe.explicit.update(names)
+    universe.save()
+    return 0
+
+def remove(universe, names, rng):
+    missing = [n for n in names if n not in universe.installed]
+    if missing:
+        _out(f"error: target not found: {', '.join(missing)}")
+        return 1
+    for name in names:
+        if _fails(universe.config, rng, name):
+            _out(f"error: failed to remove {name} (simulated failure)")
+            return 1
+        universe.installed.discard(name)
+        universe.explicit.discard(name)
+        _out(f"removing {name} {universe.versions[name]}")
+    # like pacman -Rs, take along dependencies nothing else needs
+    candidates = [dep for name in names for dep in universe.depends.get(name, [])]
+    while candidates:
+        required = {dep for name in universe.installed for dep in universe.depends.get(name, [])}
+        dep = candidates.pop()
+        if dep in universe.installed and dep not in universe.explicit and dep not in required:
+            universe.installed.discard(dep)
+            _out(f"removing {dep} {universe.versions[dep]} (no longer required)")
+            candidates.extend(universe.depends.get(dep, []))
+    universe.save()
+    return 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        _out("usage: simulated refresh|query PKG|list-installed|orphans|sizes PKG...|install [--from DIR] PKG...|remove PKG...|download DIR PKG...|clean|firmware-refresh|firmware-update|firmware-check")
+        return 2
+    config = SimConfig.from_env()
+    rng = random.Random()
+    universe = Universe(config)
+    action, args = argv[0], argv[1:]
+    time.sleep(config.latency)
+    if action in ("install", "remove", "refresh", "clean", "download", "firmware-refresh", "firmware-update") and config.stall:
+        time.sleep(config.stall)
+
+    if action == "query":
+        return 0 if args and args[0] in universe.installed else 1
+    if action == "list-installed":
+        for name in sorted(universe.installed):
+            _out(name)
+        return 0
+    if action == "orphans":
+        for name in universe.orphans():
+            _out(name)
+        return 0
+    if action == "sizes":
+        for name in args:
+            if name in universe.installed:
+                _out(f"{name}\t{universe.sizes[name]}")
+        return 0
+    if action == "refresh":
+        for repo in ("core", "extra", "community"):
+            _transfer(config, f"{repo}.db", 128 * 1024)
+            _out(f" {repo} is up to date")
+        return 0
+    if action == "install":
+        if args[:1] == ["--from"]:
+            return install(universe, args[2:], rng, source=args[1])
+        return install(universe, args, rng)
+    if action == "download":
+        return download(universe, args[0], args[1:])
+    if action == "remove":
+        return remove(universe, args, rng)
+    if action == "firmware-refresh":
+        _transfer(config, "lvfs metadata", 512 * 1024)
+        _out("Successfully downloaded new metadata: 1 local device supported")
+        return 0
+    if action == "firmware-check":
+        # fwupdmgr get-updates --json, one device with a pending update
+        _out(json.dumps({"Devices": [{"Name": "Simulated System Firmware", "Version": "1.0.0",
+                                      "Releases": [{"Version": "1.0.1"}]}]}))
+        return 0
+    if action == "firmware-update":
+        _transfer(config, "firmware.cab", 4 * 1024 * 1024)
+        if _fails(config, rng, "firmware"):
+            _out("error: failed to write firmware (simulated failure)")
+            return 1
+        _out("Successfully installed firmware")
+        return 0
+    if action == "clean":
+        _out("removing all cached packages")
+        return 0
+    _out(f"error: unknown action {action}")
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
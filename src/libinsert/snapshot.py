@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import socket
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from .distro import parse_os_release, family_for
+from .probe import SysProbe
+from .devices import parse_devices
+
+logger = logging.getLogger("Snapshot")
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = ".insert.json"
+
+# per-process probe, set up once by the pool initializer
+_worker_probe = None
+
+def capture_snapshot(distro_mgr, probe):
+    """Collect everything the matching engine needs from this host."""
+    os_release = ""
+    if os.path.exists("/etc/os-release"):
+        with open("/etc/os-release") as f:
+            os_release = f.read()
+    return {
+        "version": SNAPSHOT_VERSION,
+        "hostname": socket.gethostname(),
+        "captured_at": int(time.time()),
+        "os_release": os_release,
+        "pci": probe.get_pci_devices(),
+        "usb": probe.get_usb_devices(),
+        "installed": distro_mgr.get_installed_packages(),
+    }
+
+def save_snapshot(snapshot, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def load_snapshot(path):
+    with open(path, "r") as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported snapshot format in {path}")
+    return snapshot
+
+def analyze_snapshot(snapshot, probe):
+    os_info = parse_os_release(snapshot.get("os_release", ""))
+    distro_id = os_info.get("ID", "unknown")
+    family = family_for(distro_id)
+    installed = set(snapshot.get("installed", []))
+    devices = parse_devices(snapshot.get("pci", []), snapshot.get("usb", []))
+
+    matches = []
+    for match in probe.match_devices(family, devices):
+        match.set_installed(installed.__contains__)
+        matches.append({
+            "driver_name": match.driver_name,
+            "category": match.category,
+            "hardware_id": match.device.hardware_id,
+            "missing_packages": match.missing_packages,
+        })
+    return {
+        "hostname": snapshot.get("hostname", "unknown"),
+        "distro": distro_id,
+        "family": family,
+        "matches": matches,
+    }
+
+def find_snapshots(directory):
+    paths = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(SNAPSHOT_SUFFIX):
+            paths.append(entry.path)
+    return sorted(paths)
+
+def _init_worker(db_path):
+    global _worker_probe
+    # keep the children quiet, the parent does the reporting
+    logging.getLogger("SysProbe").setLevel(logging.WARNING)
+    _worker_probe = SysProbe(db_path=db_path)
+
+def _analyze_path(path):
+    try:
+        return path, analyze_snapshot(load_snapshot(path), _worker_probe), None
+    except Exception as e:
+        return path, None, str(e)
+
+def new_report():
+    return {"machines": 0, "failed": {}, "families": {}, "hardware": {}}
+
+def add_to_report(report, result):
+    report["machines"] += 1
+    family = report["families"].setdefault(result["family"], {"machines": 0, "machines_missing": 0, "missing": {}})
+    family["machines"] += 1
+    # one device can match several drivers, count each machine once per hardware id
+    seen_hw = {}
+    for match in result["matches"]:
+        hw_key = match["hardware_id"] or "unknown"
+        hw = report["hardware"].setdefault(hw_key, {"drivers": [], "machines": 0, "missing": 0})
+        if match["driver_name"] not in hw["drivers"]:
+            hw["drivers"].append(match["driver_name"])
+        seen_hw[hw_key] = seen_hw.get(hw_key, False) or bool(match["missing_packages"])
+        if match["missing_packages"]:
+            family["missing"][match["driver_name"]] = family["missing"].get(match["driver_name"], 0) + 1
+    for hw_key, missing in seen_hw.items():
+        report["hardware"][hw_key]["machines"] += 1
+        if missing:
+            report["hardware"][hw_key]["missing"] += 1
+    if any(seen_hw.values()):
+        family["machines_missing"] += 1
+    return report
+
+def analyze_fleet(directory, db_path=None, jobs=None):
+    """Run the matching engine over every snapshot in a directory using a process pool."""
+    paths = find_snapshots(directory)
+    logger.info(f"Analyzing {len(paths)} snapshots from {directory}")
+    report = new_report()
+    if not paths:
+        return report
+    if db_path is None:
+        db_path = SysProbe.default_db_path()
+
+    workers = jobs or os.cpu_count() or 1
+    # big chunks keep the pickling overhead per snapshot low
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,)) as pool:
+        for path, result, error in pool.map(_analyze_path, paths, chunksize=chunksize):
+            if error:
+                logger.warning(f"Skipping snapshot {path}: {error}")
+                report["failed"][os.path.basename(path)] = error
+                continue
+            add_to_report(report, result)
+    return report
+
+def format_report(report):
+    lines = [f"Machines analyzed: {report['machines']} ({len(report['failed'])} unreadable)"]
+    lines.append("")
+    lines.append("Missing drivers per distro family:")
+    for family, data in sorted(report["families"].items()):
+        lines.append(f"  {family}: {data['machines_missing']}/{data['machines']} machines missing drivers")
+        for driver, count in sorted(data["missing"].items(), key=lambda kv: -kv[1]):
+            lines.append(f"    {driver}: {count}")
+    lines.append("")
+    lines.append("Per hardware ID:")
+    for hw_id, data in sorted(report["hardware"].items(), key=lambda kv: -kv[1]["missing"]):
+        lines.append(f"  {hw_id} ({', '.join(data['drivers'])}): {data['missing']}/{data['machines']} missing")
+    return "\n".join(lines)
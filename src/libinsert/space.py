@@ -0,0 +1,92 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("SpaceEstimator")
+
+class SpaceEstimator:
+    """Sums up directory sizes on a thread pool, remembering per-directory listings by mtime."""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        # path -> (mtime_ns, [files directly inside], [subdirectories])
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _scan_dir(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return 0, []
+        with self._lock:
+            cached = self._cache.get(path)
+        # a directory's mtime only moves when entries are added or removed, files growing
+        # in place (the active journal, partial downloads) still need their own stat
+        if cached and cached[0] == mtime:
+            return sum(self._file_bytes(f) for f in cached[1]), cached[2]
+
+        own_bytes = 0
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            # st_blocks counts what actually gets freed, sparse journals included
+                            st = entry.stat(follow_symlinks=False)
+                            own_bytes += st.st_blocks * 512
+                            files.append(entry.path)
+                    except OSError:
+                        continue
+        except PermissionError:
+            logger.debug(f"No permission to read {path}, estimate will be low")
+        except OSError as e:
+            logger.debug(f"Failed to scan {path}: {e}")
+
+        with self._lock:
+            self._cache[path] = (mtime, files, subdirs)
+        return own_bytes, subdirs
+
+    @staticmethod
+    def _file_bytes(path):
+        try:
+            return os.lstat(path).st_blocks * 512
+        except OSError:
+            return 0
+
+    def directory_size(self, path):
+        """Total bytes under path, reusing cached listings for unchanged directories."""
+        total = 0
+        stack = [path]
+        while stack:
+            own_bytes, subdirs = self._scan_dir(stack.pop())
+            total += own_bytes
+            stack.extend(subdirs)
+        return total
+
+    def estimate(self, paths):
+        """Return {path: bytes} for every path, walking them concurrently."""
+        paths = [p for p in paths if os.path.isdir(p)]
+        if not paths:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(paths))) as pool:
+            sizes = dict(zip(paths, pool.map(self.directory_size, paths)))
+        logger.debug(f"Reclaimable space: {sizes}")
+        return sizes
+
+    def estimate_tasks(self, tasks):
+        """Fill in a "reclaimable" byte count on every cleanup task that lists paths."""
+        all_paths = {p for task in tasks for p in task.get("paths", [])}
+        sizes = self.estimate(sorted(all_paths))
+        for task in tasks:
+            if task.get("paths"):
+                task["reclaimable"] = sum(sizes.get(p, 0) for p in task["paths"])
+        return tasks
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
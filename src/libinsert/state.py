@@ -0,0 +1,74 @@
+import time
+import logging
+import threading
+from .distro import DistroManager
+from .probe import SysProbe
+from .pkgindex import build_index
+from .history import make_record
+
+logger = logging.getLogger("ScanState")
+
+class ScanState:
+    """Hardware, driver matches, installed packages and the repo index, swapped in whole after each refresh."""
+
+    def __init__(self, distro_mgr=None, probe=None, index_builder=None, history=None):
+        self.distro_mgr = distro_mgr or DistroManager()
+        self.probe = probe or SysProbe()
+        self.index_builder = index_builder or build_index
+        # optional HistoryStore, every refresh is recorded in it
+        self.history = history
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.generation = 0
+        self.scanned_at = None
+        self.devices = []
+        self.matches = []
+        self.installed = frozenset()
+        self.pkg_index = None
+
+    def refresh(self, packages_only=False):
+        """Rescan, packages_only keeps the hardware list and just re-checks what is installed."""
+        with self._refresh_lock:
+            start = time.monotonic()
+            devices = self.devices if packages_only and self.devices else self.probe.scan_devices()
+            installed = frozenset(self.distro_mgr.get_installed_packages())
+            matches = self.probe.match_devices(self.distro_mgr.family, devices)
+            for match in matches:
+                match.set_installed(installed.__contains__ if installed else self.distro_mgr.is_package_installed)
+            self.probe.check_bindings(matches)
+            pkg_index = self.pkg_index
+            if pkg_index is None or not packages_only:
+                pkg_index = self.index_builder(self.distro_mgr.pkg_mgr)
+
+            with self._lock:
+                self.devices = devices
+                self.matches = matches
+                self.installed = installed
+                self.pkg_index = pkg_index
+                self.scanned_at = time.time()
+                self.generation += 1
+                generation = self.generation
+            if self.history is not None:
+                try:
+                    self.history.record(make_record(self.distro_mgr, devices, matches, len(installed)))
+                except Exception as e:
+                    logger.warning(f"Could not record scan history: {e}")
+            logger.info(f"State generation {generation} ready in {time.monotonic() - start:.2f}s "
+                        f"({len(devices)} devices, {len(matches)} matches, {len(installed)} installed)")
+            return generation
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "generation": self.generation,
+                "scanned_at": self.scanned_at,
+                "distro": {"id": self.distro_mgr.id, "family": self.distro_mgr.family, "pkg_mgr": self.distro_mgr.pkg_mgr},
+                "devices": [d.to_dict() for d in self.devices],
+                "matches": [m.to_dict() for m in self.matches],
+                "installed_count": len(self.installed),
+                "indexed_packages": len(self.pkg_index) if self.pkg_index is not None else 0,
+            }
+
+    def search(self, query, limit):
+        index = self.pkg_index
+        return index.search(query, limit) if index is not None else []
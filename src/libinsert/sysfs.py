@@ -0,0 +1,122 @@
+import os
+import logging
+from .devices import Device
+
+logger = logging.getLogger("Sysfs")
+
+ACTIVE = "active"
+INACTIVE = "inactive"
+MISSING = "missing"
+
+class SysfsReader:
+    """Reads kernel driver bindings straight from sysfs, root can point at a fake tree."""
+
+    def __init__(self, root="/"):
+        self.root = root
+
+    def path(self, *parts):
+        return os.path.join(self.root, "sys", *parts)
+
+    def pci_device_path(self, slot):
+        # lspci drops the domain when it is 0000
+        if slot.count(":") == 1:
+            slot = "0000:" + slot
+        return self.path("bus", "pci", "devices", slot)
+
+    def bound_driver(self, device):
+        """Name of the kernel driver bound to a PCI device, or None."""
+        if device.bus != "pci":
+            return None
+        link = os.path.join(self.pci_device_path(device.slot), "driver")
+        try:
+            return os.path.basename(os.readlink(link))
+        except OSError:
+            return None
+
+    def _read(self, *parts):
+        try:
+            with open(os.path.join(*parts), "r") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _hex_id(self, *parts):
+        value = self._read(*parts)
+        if not value:
+            return None
+        # "0x10de" for pci ids, bare "046d" for usb
+        return value[2:] if value.startswith("0x") else value
+
+    def pci_devices(self, names):
+        """Devices from /sys/bus/pci the way lspci -nnmm would list them, names from a HardwareNames."""
+        base = self.path("bus", "pci", "devices")
+        try:
+            slots = sorted(os.listdir(base))
+        except OSError:
+            logger.debug("Cannot list /sys/bus/pci/devices")
+            return []
+        devices = []
+        for slot in slots:
+            path = os.path.join(base, slot)
+            vendor_id = self._hex_id(path, "vendor")
+            device_id = self._hex_id(path, "device")
+            pci_class = self._hex_id(path, "class")
+            if not vendor_id or not device_id:
+                continue
+            # class is class/subclass/prog-if, lspci shows the first two
+            class_id = pci_class[:4] if pci_class and len(pci_class) == 6 else None
+            subsys_vendor_id = self._hex_id(path, "subsystem_vendor")
+            subsys_device_id = self._hex_id(path, "subsystem_device")
+            devices.append(Device(
+                "pci", slot[5:] if slot.startswith("0000:") else slot,
+                class_id, names.pci_class(class_id) or "", vendor_id, names.vendor("pci", vendor_id) or "",
+                device_id, names.device("pci", vendor_id, device_id) or "",
+                subsys_vendor_id, names.vendor("pci", subsys_vendor_id) or "", subsys_device_id, ""))
+        return devices
+
+    def usb_devices(self, names):
+        """Devices from /sys/bus/usb like plain lsusb lists them, interfaces are left out."""
+        base = self.path("bus", "usb", "devices")
+        try:
+            entries = sorted(os.listdir(base))
+        except OSError:
+            logger.debug("Cannot list /sys/bus/usb/devices")
+            return []
+        devices = []
+        for entry in entries:
+            if ":" in entry:
+                continue
+            path = os.path.join(base, entry)
+            vendor_id = self._hex_id(path, "idVendor")
+            device_id = self._hex_id(path, "idProduct")
+            if not vendor_id or not device_id:
+                continue
+            busnum, devnum = self._read(path, "busnum"), self._read(path, "devnum")
+            slot = f"{int(busnum):03d}:{int(devnum):03d}" if busnum and devnum and busnum.isdigit() and devnum.isdigit() else entry
+            # the ids database first, what the device reports about itself otherwise
+            vendor = names.vendor("usb", vendor_id) or self._read(path, "manufacturer") or ""
+            product = names.device("usb", vendor_id, device_id) or self._read(path, "product") or ""
+            devices.append(Device("usb", slot, vendor_id=vendor_id.lower(), device_id=device_id.lower(),
+                                  device_name=f"{vendor} {product}".strip()))
+        return devices
+
+    def loaded_modules(self):
+        try:
+            return set(os.listdir(self.path("module")))
+        except OSError:
+            logger.debug("Cannot list /sys/module")
+            return set()
+
+    def driver_state(self, match, modules, loaded=None):
+        """active/inactive/missing for a DriverMatch whose installed state is already known."""
+        if not match.is_installed:
+            return MISSING
+        bound = self.bound_driver(match.device)
+        if modules:
+            if bound is not None:
+                return ACTIVE if bound in modules else INACTIVE
+            # usb devices and unbound pci devices: settle for the module being loaded
+            if loaded is None:
+                loaded = self.loaded_modules()
+            return ACTIVE if any(m in loaded for m in modules) else INACTIVE
+        return ACTIVE if bound is not None else INACTIVE
@@ -0,0 +1,171 @@
+import os
+import glob
+import time
+import platform
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger("SysInfo")
+
+SECURE_BOOT_VAR = "sys/firmware/efi/efivars/SecureBoot-8be4df61-93ca-11d2-aa0d-00e098032b8c"
+FOREVER = None
+
+class Collector:
+    """One System Info field. ttl=None caches the value forever, ttl=0 never caches."""
+
+    def __init__(self, key, title, icon, func, timeout=2.0, ttl=FOREVER):
+        self.key = key
+        self.title = title
+        self.icon = icon
+        self.func = func
+        self.timeout = timeout
+        self.ttl = ttl
+
+class SystemInfo:
+    def __init__(self, probe, root="/", max_workers=8):
+        self.probe = probe
+        self.root = root
+        self.collectors = []
+        # key -> (monotonic time collected, value)
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sysinfo")
+        self._register_defaults()
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def register(self, collector):
+        self.collectors.append(collector)
+
+    def _register_defaults(self):
+        self.register(Collector("os", "OS", "software-update-available-symbolic", self._os))
+        self.register(Collector("kernel", "Kernel", "utilities-terminal-symbolic", lambda: platform.release()))
+        self.register(Collector("desktop", "Desktop", "preferences-desktop-wallpaper-symbolic", lambda: os.environ.get("XDG_CURRENT_DESKTOP", "Unknown")))
+        self.register(Collector("session", "Session", "window-new-symbolic", lambda: os.environ.get("XDG_SESSION_TYPE", "Unknown")))
+        self.register(Collector("cpu", "CPU", "computer-symbolic", self.probe._get_cpu_info))
+        self.register(Collector("gpu", "GPU", "video-display-symbolic", self.probe._get_gpu_info, timeout=5.0))
+        self.register(Collector("ram", "RAM", "drive-multidisk-symbolic", self.probe._get_ram_info))
+        self.register(Collector("displays", "Display Adapters", "video-display-symbolic", self._display_adapters, ttl=30))
+        self.register(Collector("disks", "Disks", "drive-harddisk-symbolic", self._disks, ttl=30))
+        self.register(Collector("modules", "Kernel Modules", "application-x-addon-symbolic", self._modules, ttl=10))
+        self.register(Collector("secure_boot", "Secure Boot", "security-high-symbolic", self._secure_boot))
+
+    def _cached(self, collector):
+        with self._lock:
+            entry = self._cache.get(collector.key)
+        if entry is None or collector.ttl == 0:
+            return None
+        if collector.ttl is not FOREVER and time.monotonic() - entry[0] > collector.ttl:
+            return None
+        return entry
+
+    def _run(self, collector):
+        try:
+            value = collector.func()
+        except Exception as e:
+            logger.error(f"Collector {collector.key} failed: {e}")
+            return "Unknown"
+        with self._lock:
+            self._cache[collector.key] = (time.monotonic(), value)
+        return value
+
+    def collect(self, on_result=None):
+        """Run every collector concurrently.
+
+        on_result(collector, value) is called from a pool thread as each one finishes,
+        cached fields are reported straight away. Returns {key: value}.
+        """
+        results = {}
+        futures = {}
+        start = time.monotonic()
+        for collector in self.collectors:
+            entry = self._cached(collector)
+            if entry is not None:
+                results[collector.key] = entry[1]
+                if on_result:
+                    on_result(collector, entry[1])
+                continue
+            futures[self._pool.submit(self._run, collector)] = collector
+
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            deadline = min(start + futures[f].timeout for f in pending)
+            done, pending = wait(pending, timeout=max(0, deadline - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                collector = futures[future]
+                results[collector.key] = future.result()
+                if on_result:
+                    on_result(collector, results[collector.key])
+            now = time.monotonic()
+            for future in [f for f in pending if start + futures[f].timeout <= now]:
+                # leave the thread to finish on its own, its result still lands in the cache
+                collector = futures[future]
+                logger.warning(f"Collector {collector.key} timed out after {collector.timeout}s")
+                pending.discard(future)
+                results[collector.key] = "Timed out"
+                if on_result:
+                    on_result(collector, results[collector.key])
+        return results
+
+    def _os(self):
+        return platform.freedesktop_os_release().get("PRETTY_NAME", platform.system())
+
+    def _read(self, path):
+        with open(path, "r") as f:
+            return f.read().strip()
+
+    def _display_adapters(self):
+        adapters = []
+        for card in sorted(glob.glob(self.path("sys/class/drm/card[0-9]*"))):
+            name = os.path.basename(card)
+            if "-" in name:
+                # connectors like card0-DP-1
+                continue
+            device = os.path.join(card, "device")
+            try:
+                vendor = self._read(os.path.join(device, "vendor")).replace("0x", "")
+                product = self._read(os.path.join(device, "device")).replace("0x", "")
+            except OSError:
+                continue
+            driver_link = os.path.join(device, "driver")
+            driver = os.path.basename(os.readlink(driver_link)) if os.path.islink(driver_link) else "no driver"
+            adapters.append(f"{name}: {driver} ({vendor}:{product})")
+        return ", ".join(adapters) if adapters else "None found"
+
+    def _disks(self):
+        disks = []
+        for block in sorted(glob.glob(self.path("sys/block/*"))):
+            name = os.path.basename(block)
+            if name.startswith(("loop", "ram", "zram", "dm-", "sr")):
+                continue
+            try:
+                # size is always in 512 byte sectors
+                size = int(self._read(os.path.join(block, "size"))) * 512
+                rotational = self._read(os.path.join(block, "queue", "rotational")) == "1"
+            except (OSError, ValueError):
+                continue
+            if size == 0:
+                continue
+            kind = "HDD" if rotational else "SSD"
+            disks.append(f"{name} {round(size / 1000 ** 3)} GB {kind}")
+        return ", ".join(disks) if disks else "None found"
+
+    def _modules(self):
+        with open(self.path("proc/modules"), "r") as f:
+            count = sum(1 for _ in f)
+        return f"{count} loaded"
+
+    def _secure_boot(self):
+        var = self.path(SECURE_BOOT_VAR)
+        if not os.path.isdir(self.path("sys/firmware/efi")):
+            return "Legacy BIOS"
+        try:
+            with open(var, "rb") as f:
+                data = f.read()
+        except OSError:
+            return "Unknown"
+        # 4 bytes of efivar attributes, then the value
+        return "Enabled" if len(data) >= 5 and data[4] == 1 else "Disabled"
@@ -1,49 +1,186 @@
-import subprocess
 import threading
 import os
+import time
 import logging
 from gi.repository import GLib
+from .helper import HelperClient, build_operation
+from .runner import run, STATS
+from .downloads import ThroughputLog
+from .metrics import MetricsFile, record_transaction, record_throttled
+from .priority import BACKGROUND_OPS
+from .flatpak import batch_operations
+
+DOWNLOADING_OPS = ("install", "refresh")
 
 logger = logging.getLogger("TaskWorker")
 
 class TaskWorker:
-    def __init__(self, callback):
+    def __init__(self, callback, distro_mgr=None):
         self.callback = callback # to call with progress/status
+        self.distro_mgr = distro_mgr
         self.thread = None
+        self.cancel_event = threading.Event()
+        # per-transaction parallel download overrides, measured against the cache growth
+        self.accelerate_downloads = False
+        # refreshes, firmware metadata and cleanups run niced (or in a limited scope) unless this is "off"
+        self.background_priority = "off"
+        self.throughput = ThroughputLog()
+        # textfile collector metrics, nothing is written when no collector directory is set up
+        self.metrics = MetricsFile()
+        # one pkexec prompt per session, everything elevated after that goes over its socket
+        self.helper = HelperClient() if os.getuid() != 0 and not self._simulated() else None
         # path to our askpass helper
         self.askpass_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "ui", "askpass.py"))
+
+    def _simulated(self):
+        # the simulated package manager needs no privileges, so no helper either
+        return self.distro_mgr is not None and self.distro_mgr.pkg_mgr == "simulated"
+
+    def run_operation(self, op, **args):
+        self.run_operations([(op, args)])
+
+    def run_operations(self, operations):
+        """Run typed privileged operations in order, reporting "finished" once after the last one."""
+        operations = batch_operations(operations)
+        logger.info(f"queueing operations: {[op for op, _ in operations]}")
+        if self.accelerate_downloads:
+            operations = [(op, dict(args, accelerate=True) if op in DOWNLOADING_OPS else args) for op, args in operations]
+        if self.background_priority != "off":
+            operations = [(op, dict(args, background=True, priority=self.background_priority) if op in BACKGROUND_OPS else args)
+                          for op, args in operations]
+        threading.Thread(target=self._execute_operations, args=(operations,), daemon=True).start()
+
+    def _measure_start(self, operations):
+        # only installs download enough to be worth measuring
+        if self.distro_mgr is None or not any(op == "install" for op, _ in operations):
+            return None
+        try:
+            return self.throughput.start(self.distro_mgr.pkg_mgr)
+        except Exception as e:
+            logger.debug(f"Could not measure package cache: {e}")
+            return None
+
+    def _measure_finish(self, mark):
+        if mark is None:
+            return
+        try:
+            rate = self.throughput.finish(mark, self.accelerate_downloads)
+        except Exception as e:
+            logger.debug(f"Could not record throughput: {e}")
+            return
+        if rate:
+            GLib.idle_add(self.callback, "progress", f"Package cache grew {rate / 1e6:.2f} MB/s over the transaction")
+
+    def _record(self, op, ok, seconds):
+        record_transaction(self.metrics, op, ok, seconds)
+        self.metrics.write()
+
+    def _report_throttled(self, op, seconds, wall):
+        logger.info(f"{op} was throttled for {seconds:.1f}s of {wall:.1f}s")
+        record_throttled(self.metrics, op, seconds)
+        GLib.idle_add(self.callback, "progress", f"{op} ran in the background, throttled for {seconds:.1f}s of {wall:.1f}s")
+
+    def _execute_operations(self, operations):
+        self.cancel_event.clear()
+        mark = self._measure_start(operations)
+        if self.helper is None:
+            # already root, no helper needed
+            for op, args in operations:
+                try:
+                    command = build_operation(self.distro_mgr, op, args)
+                except ValueError as e:
+                    GLib.idle_add(self.callback, "error", str(e))
+                    return
+                start = time.monotonic()
+                background = op if args.get("background") is True else None
+                ok = self._execute(command, report_success=False, background=background)
+                self._record(op, ok, time.monotonic() - start)
+                if not ok:
+                    return
+            self._measure_finish(mark)
+            GLib.idle_add(self.callback, "finished", True)
+            return
+
+        try:
+            self.helper.start()
+        except Exception as e:
+            logger.error(f"Could not start privileged helper: {e}")
+            GLib.idle_add(self.callback, "error", str(e))
+            return
+
+        remaining = [len(operations)]
+        failed = [False]
+        # the helper runs them back to back, so each one took from the previous end to its own
+        last_end = [time.monotonic()]
+        def on_event(op, event_type, data):
+            if event_type == "progress":
+                logger.debug(f"Helper out: {data}")
+                GLib.idle_add(self.callback, "progress", data)
+                return
+            if event_type == "throttled":
+                self._report_throttled(op, *data)
+                return
+            remaining[0] -= 1
+            now = time.monotonic()
+            self._record(op, event_type == "finished", now - last_end[0])
+            last_end[0] = now
+            if event_type == "error" and not failed[0]:
+                failed[0] = True
+                GLib.idle_add(self.callback, "error", data)
+            elif remaining[0] == 0 and not failed[0]:
+                self._measure_finish(mark)
+                GLib.idle_add(self.callback, "finished", True)
+
+        # pipelined: all requests go out now, the helper works through them in order and skips
+        # the rest once one fails or is cancelled
+        self.helper.submit_batch([(op, args, lambda event_type, data, op=op: on_event(op, event_type, data))
+                                  for op, args in operations])
+
+    def cancel(self):
+        """Kill whatever is running now, locally or inside the helper."""
+        logger.info("Cancelling running task")
+        self.cancel_event.set()
+        if self.helper is not None and self.helper.is_running():
+            self.helper.cancel()
+
+    def stop(self):
+        if self.helper is not None:
+            self.helper.stop()
+        logger.info(f"Command statistics for this session:\n{STATS.format()}")
+
     def run_command(self, command):
+        self.cancel_event.clear()
         logger.info(f"starting bg command: {' '.join(command)}")
         self.thread = threading.Thread(target=self._execute, args=(command,))
         self.thread.start()
 
-    def _execute(self, command):
+    def _execute(self, command, report_success=True, background=None):
         try:
             # setup env for sudo askpass if needed (though we use pkexec mostly..)
             env = os.environ.copy()
             env["SUDO_ASKPASS"] = self.askpass_path
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                env=env
-            )
-
-            for line in process.stdout:
+
+            def on_line(line):
                 msg = line.strip()
                 if msg:
                     logger.debug(f"Worker out: {msg}")
                     GLib.idle_add(self.callback, "progress", msg)
 
-            process.wait()
-            logger.info(f"finished with return code: {process.returncode}")
+            result = run(command, cancel_event=self.cancel_event, on_line=on_line, capture=False, merge_stderr=True, env=env,
+                         measure_throttle=background is not None)
+            logger.info(f"finished with return code: {result.returncode} in {result.wall_time:.1f}s")
+            if background is not None:
+                self._report_throttled(background, result.throttled_time, result.wall_time)
             
-            if process.returncode == 0:
-                GLib.idle_add(self.callback, "finished", True)
+            if result.cancelled:
+                GLib.idle_add(self.callback, "error", "Cancelled")
+            elif result.returncode == 0:
+                if report_success:
+                    GLib.idle_add(self.callback, "finished", True)
+                return True
             else:
-                GLib.idle_add(self.callback, "error", f"Command failed with code {process.returncode}!")
+                GLib.idle_add(self.callback, "error", f"Command failed with code {result.returncode}!")
         except Exception as e:
             logger.error(f"Worker exception: {e}")
             GLib.idle_add(self.callback, "error", str(e))
+        return False
@@ -1,33 +1,49 @@
 import sys
 import os
 import logging
-import re
 import threading
+import time
 
-# logging config
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(os.path.expanduser("~/.cache/insert-source.log"))
-    ]
-)
-logger = logging.getLogger("InsertApp")
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+# logging config, file writes and rotation happen on the listener thread
+from libinsert.logconfig import setup_logging
+setup_logging()
+logger = logging.getLogger("InsertApp")
+
 import json
 import gi
+from urllib.parse import urlsplit
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, Gio, GLib
 from libinsert.distro import DistroManager
 from libinsert.probe import SysProbe
 from libinsert.worker import TaskWorker
+from libinsert.space import SpaceEstimator
+from libinsert.pkgindex import build_index
+from libinsert.resolver import build_resolver
+from libinsert import flatpak
+from libinsert.history import HistoryStore, make_record, diff_scans, count_changes
+from libinsert.devices import DriverMatch
+from libinsert.mirrors import load_candidates, rank_mirrors, mirror_source, proposal
+from libinsert.service import ServiceClient
+from libinsert.metrics import record_phase, record_matches, record_orphans, record_reclaimable, record_firmware
 from ui.settings import SettingsWindow
 
 CONFIG_DIR = os.path.join(GLib.get_user_config_dir(), "insert-source")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
+# flatpak installs clicked within this window go out as one transaction
+FLATPAK_QUEUE_DELAY_MS = 2000
+
+# cool tools!
+OPTIONAL_TOOLS = [
+    "ani-cli", "pokemon-colorscripts", "fastfetch",
+    "cava", "btop", "htop", "ranger", "fish", "zsh", "starship",
+    "vlc", "mpv", "telegram-desktop", "discord", "obs-studio",
+    "steam", "lutris", "bottles", "kitty", "alacritty", "yt-dlp",
+    "qbittorrent", "stremio", "prism-launcher", "heroic-games-launcher-bin"
+]
 
 class InsertApp(Adw.Application):
     def __init__(self, **kwargs):
@@ -36,26 +52,45 @@ class InsertApp(Adw.Application):
                          **kwargs)
         self.distro_mgr = DistroManager()
         self.probe = SysProbe()
-        self.setup_done = self._load_config()
+        self.space = SpaceEstimator()
+        # repo search index, built in the background the first time the Optional page opens
+        self.pkg_index = None
+        self.installed = set()
+        # logical -> concrete package names, ready together with pkg_index
+        self.resolver = None
+        # the same for flatpak apps, from the appstream data of the configured remotes
+        self.flatpak_index = None
+        self.flatpak_resolver = None
+        # warm scan results from the background service, every call falls back to None when it isn't running
+        self.service = ServiceClient()
+        # previous scans, shown at startup until the fresh one is done
+        try:
+            self.history = HistoryStore()
+        except Exception as e:
+            logger.warning(f"Scan history unavailable: {e}")
+            self.history = None
+        self.config = self._load_config()
+        self.setup_done = self.config.get("setup_done", False)
         self.force_setup = "--reset-setup" in sys.argv
         
         self.create_actions()
 
     def _load_config(self):
         if not os.path.exists(CONFIG_FILE):
-            return False
+            return {}
         try:
             with open(CONFIG_FILE, "r") as f:
-                data = json.load(f)
-                return data.get("setup_done", False)
+                return json.load(f)
         except:
-            return False
+            return {}
 
-    def save_config(self):
+    def save_config(self, **values):
         if not os.path.exists(CONFIG_DIR):
             os.makedirs(CONFIG_DIR)
+        self.config["setup_done"] = True
+        self.config.update(values)
         with open(CONFIG_FILE, "w") as f:
-            json.dump({"setup_done": True}, f)
+            json.dump(self.config, f)
 
     def create_actions(self):
         settings_action = Gio.SimpleAction.new("settings", None)
@@ -191,6 +226,18 @@ class InsertWindow(Adw.ApplicationWindow):
         super().__init__(**kwargs)
         self.set_title("Insert-source")
         self.set_default_size(950, 650)
+        self._indexing = False
+        self._drivers_shown = False
+        # bumped on every cleanup page rebuild, a late prune plan for an older one is dropped
+        self._cleanup_generation = 0
+        # (remote, app id) clicked but not sent yet, and whether a flush is scheduled
+        self._flatpak_queue = []
+        self._flatpak_flush_id = 0
+        # set while a refresh that includes flatpak_refresh runs, the appstream index is rebuilt after it
+        self._flatpak_refreshing = False
+        # one hardware scan at a time, a rescan asked for meanwhile runs once it is done
+        self._scanning = False
+        self._rescan_pending = None
 
         # overlay at the very top
         self.toast_overlay = Adw.ToastOverlay()
@@ -246,7 +293,10 @@ class InsertWindow(Adw.ApplicationWindow):
         content_page.set_child(self.content_toolbar)
         self.split_view.set_content(content_page)
 
-        self.worker = TaskWorker(self.on_worker_event)
+        self.worker = TaskWorker(self.on_worker_event, self.get_application().distro_mgr)
+        self.worker.accelerate_downloads = self.get_application().config.get("accelerate_downloads", False)
+        self.worker.background_priority = self.get_application().config.get("background_priority", "off")
+        self.connect("close-request", lambda x: self.worker.stop() or False)
 
     def add_sidebar_row(self, title, name, icon):
         row = Adw.ActionRow(title=title)
@@ -271,6 +321,12 @@ class InsertWindow(Adw.ApplicationWindow):
         refresh_btn.connect("clicked", self.on_refresh_clicked)
         status_box.append(refresh_btn)
 
+        self.mirrors_btn = Gtk.Button(label="Rank Mirrors", halign=Gtk.Align.CENTER)
+        self.mirrors_btn.add_css_class("pill")
+        self.mirrors_btn.connect("clicked", self.on_rank_mirrors_clicked)
+        self.mirrors_btn.set_visible(mirror_source(self.get_application().distro_mgr.pkg_mgr) is not None)
+        status_box.append(self.mirrors_btn)
+
         self.fw_update_btn = Gtk.Button(label="Update Firmware", halign=Gtk.Align.CENTER)
         self.fw_update_btn.add_css_class("pill")
         self.fw_update_btn.add_css_class("suggested-action")
@@ -312,14 +368,28 @@ class InsertWindow(Adw.ApplicationWindow):
 
         # Page 4: Optional
         self.optional_scroll = Gtk.ScrolledWindow()
+        optional_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+
+        self.optional_search = Gtk.SearchEntry(placeholder_text="Search all repository packages...")
+        self.optional_search.set_margin_top(12)
+        self.optional_search.connect("search-changed", self.on_optional_search_changed)
+        optional_box.append(self.optional_search)
+
+        self.search_results_list = Gtk.ListBox()
+        self.search_results_list.add_css_class("boxed-list")
+        self.search_results_list.set_margin_top(12)
+        self.search_results_list.set_visible(False)
+        optional_box.append(self.search_results_list)
+
         self.optional_list = Gtk.ListBox()
         self.optional_list.add_css_class("boxed-list")
         self.optional_list.set_margin_top(12)
         self.optional_list.set_margin_bottom(12)
+        optional_box.append(self.optional_list)
         
         optional_clamp = Adw.Clamp()
         optional_clamp.set_maximum_size(600)
-        optional_clamp.set_child(self.optional_list)
+        optional_clamp.set_child(optional_box)
         self.optional_scroll.set_child(optional_clamp)
 
         # Page 5: Cleanup
@@ -404,63 +474,210 @@ class InsertWindow(Adw.ApplicationWindow):
         while child:
             self.cleanup_list.remove(child)
             child = self.cleanup_list.get_first_child()
-            
-        tasks = self.get_application().distro_mgr.get_cleanup_tasks()
-        for task in tasks:
-            row = Adw.ActionRow(title=task["name"], subtitle=task["description"])
-            btn = Gtk.Button(label="Clean", valign=Gtk.Align.CENTER)
-            btn.add_css_class("flat")
-            btn.connect("clicked", lambda x, t=task: self.run_cleanup_task(t))
-            row.add_suffix(btn)
-            self.cleanup_list.append(row)
+
+        distro_mgr = self.get_application().distro_mgr
+        # the old versions task lists and sorts the whole package cache, it is planned below
+        tasks = distro_mgr.get_cleanup_tasks(prune=False)
+        rows = [self.add_cleanup_row(task) for task in tasks]
+        self._cleanup_generation += 1
+        generation = self._cleanup_generation
+
+        # size the cleanup targets off the main thread, rescans reuse cached directory totals
+        def estimate():
+            prune = distro_mgr.get_prune_task() if distro_mgr.can_prune() else None
+            if prune is not None:
+                GLib.idle_add(self.add_prune_row, prune, generation)
+            self.get_application().space.estimate_tasks(tasks)
+            record_reclaimable(self.worker.metrics, tasks + ([prune] if prune else []))
+            self.worker.metrics.write()
+            GLib.idle_add(self.apply_cleanup_sizes, rows, tasks)
+
+        threading.Thread(target=estimate, daemon=True).start()
 
         # trigger orphan scan
         self.on_cleanup_scan_clicked(None)
 
+    def add_cleanup_row(self, task, position=-1):
+        row = Adw.ActionRow(title=task["name"], subtitle=task["description"])
+        btn = Gtk.Button(label="Clean", valign=Gtk.Align.CENTER)
+        btn.add_css_class("flat")
+        btn.connect("clicked", lambda x, t=task: self.run_cleanup_task(t))
+        row.add_suffix(btn)
+        self.cleanup_list.insert(row, position)
+        return row
+
+    def add_prune_row(self, task, generation):
+        # the page may have been rebuilt while the cache was being planned, and with
+        # nothing old in the cache there is no command for the helper to run
+        if generation == self._cleanup_generation and task["cmd"]:
+            row = self.add_cleanup_row(task, position=0)
+            self.apply_cleanup_sizes([row], [task])
+        return False
+
+    def apply_cleanup_sizes(self, rows, tasks):
+        for row, task in zip(rows, tasks):
+            if "reclaimable" in task:
+                row.set_subtitle(f"{task['description']} · up to {GLib.format_size(task['reclaimable'])}")
+        return False
+
     def run_cleanup_task(self, task):
-        self.toast_overlay.add_toast(Adw.Toast.new(f"Running {task['name']}..."))
-        self.worker.run_command(task["cmd"])
+        if not task["cmd"]:
+            self.toast_overlay.add_toast(Adw.Toast.new(f"Nothing to clean for {task['name']}."))
+            return
+        self.show_task_toast(f"Running {task['name']}...")
+        self.worker.run_operation("cleanup", name=task["name"])
 
     def update_info_page(self):
-        info = self.get_application().probe.get_system_info()
-        
         # clear list
         child = self.info_list.get_first_child()
         while child:
             self.info_list.remove(child)
             child = self.info_list.get_first_child()
 
-        items = [
-            ("OS", info["os"], "software-update-available-symbolic"),
-            ("Kernel", info["kernel"], "utilities-terminal-symbolic"),
-            ("Desktop", info["desktop"], "preferences-desktop-wallpaper-symbolic"),
-            ("Session", info["session"], "window-new-symbolic"),
-            ("CPU", info["cpu"], "computer-symbolic"),
-            ("GPU", info["gpu"], "video-display-symbolic"),
-            ("RAM", info["ram"], "drive-multidisk-symbolic")
-        ]
-
-        for title, value, icon in items:
-            row = Adw.ActionRow(title=title, subtitle=str(value))
-            row.add_prefix(Gtk.Image.new_from_icon_name(icon))
+        # one row per collector up front, each fills in as soon as its collector is done
+        probe = self.get_application().probe
+        rows = {}
+        for collector in probe.info.collectors:
+            row = Adw.ActionRow(title=collector.title, subtitle="Loading...")
+            row.add_prefix(Gtk.Image.new_from_icon_name(collector.icon))
             self.info_list.append(row)
+            rows[collector.key] = row
+
+        def on_result(collector, value):
+            GLib.idle_add(rows[collector.key].set_subtitle, str(value))
+
+        threading.Thread(target=probe.get_system_info, args=(on_result,), daemon=True).start()
 
     def update_essentials_list(self):
         family = self.get_application().distro_mgr.family
         essentials = self.get_application().probe.drivers_db.get("essentials", {}).get(family, [])
         self._update_package_list(self.essentials_list, essentials)
+        self.ensure_pkg_index()
 
     def update_optional_list(self):
-        # cool tools!
-        optional_tools = [
-            "ani-cli", "pokemon-colorscripts", "fastfetch",
-            "cava", "btop", "htop", "ranger", "fish", "zsh", "starship",
-            "vlc", "mpv", "telegram-desktop", "discord", "obs-studio",
-            "steam", "lutris", "bottles", "kitty", "alacritty", "yt-dlp",
-            "qbittorrent", "stremio", "prism-launcher", "heroic-games-launcher-bin"
-        ]
-        logger.info(f"Updating optional tools list: {len(optional_tools)} tools found")
-        self._update_package_list(self.optional_list, optional_tools)
+        app = self.get_application()
+        if app.resolver is None:
+            self._update_package_list(self.optional_list, OPTIONAL_TOOLS)
+            self.ensure_pkg_index()
+            return
+
+        flatpak_resolver = app.flatpak_resolver
+        available = [t for t in OPTIONAL_TOOLS if app.resolver.resolve(t) is not None
+                     or (flatpak_resolver is not None and flatpak_resolver.resolve(t) is not None)]
+        logger.info(f"Updating optional tools list: {len(available)}/{len(OPTIONAL_TOOLS)} tools available")
+        self._update_package_list(self.optional_list, available)
+
+    def ensure_pkg_index(self):
+        # index the local sync databases once, then redraw with the resolved names
+        app = self.get_application()
+        if app.pkg_index is not None or self._indexing:
+            return
+        self._indexing = True
+
+        def build():
+            try:
+                index = build_index(app.distro_mgr.pkg_mgr)
+                installed = app.service.installed() or set(app.distro_mgr.get_installed_packages())
+                resolver = build_resolver(app.distro_mgr, installed, index)
+                flatpak_index = flatpak_resolver = None
+                if flatpak.enabled(app.distro_mgr):
+                    flatpak_index = flatpak.build_index()
+                    flatpak_resolver = flatpak.build_resolver(flatpak_index, flatpak.installed_apps())
+            except Exception as e:
+                logger.error(f"Failed to build the package index: {e}", exc_info=True)
+                # let the next page visit try again
+                GLib.idle_add(self.pkg_index_failed)
+                return
+            GLib.idle_add(self.apply_pkg_index, index, installed, resolver, flatpak_index, flatpak_resolver)
+
+        threading.Thread(target=build, daemon=True).start()
+
+    def pkg_index_failed(self):
+        self._indexing = False
+        return False
+
+    def apply_pkg_index(self, index, installed, resolver, flatpak_index=None, flatpak_resolver=None):
+        app = self.get_application()
+        app.pkg_index = index
+        app.installed = installed
+        app.resolver = resolver
+        app.flatpak_index = flatpak_index
+        app.flatpak_resolver = flatpak_resolver
+        self._indexing = False
+        self.update_optional_list()
+        self.update_essentials_list()
+        if self.optional_search.get_text():
+            self.on_optional_search_changed(self.optional_search)
+        return False
+
+    def refresh_installed(self):
+        app = self.get_application()
+        def reload():
+            installed = set(app.distro_mgr.get_installed_packages())
+            # a directory listing, no flatpak process
+            flatpak_installed = flatpak.installed_apps() if app.flatpak_resolver is not None else None
+            GLib.idle_add(self.apply_installed, installed, flatpak_installed)
+        threading.Thread(target=reload, daemon=True).start()
+
+    def apply_installed(self, installed, flatpak_installed=None):
+        app = self.get_application()
+        app.installed = installed
+        if app.resolver is not None:
+            app.resolver.update_installed(installed)
+        if app.flatpak_resolver is not None and flatpak_installed is not None:
+            app.flatpak_resolver.update_installed(flatpak_installed)
+        self.update_optional_list()
+        self.update_essentials_list()
+        return False
+
+    def on_optional_search_changed(self, entry):
+        listbox = self.search_results_list
+        child = listbox.get_first_child()
+        while child:
+            listbox.remove(child)
+            child = listbox.get_first_child()
+
+        index = self.get_application().pkg_index
+        query = entry.get_text().strip()
+        listbox.set_visible(bool(query))
+        if not query:
+            return
+        if index is None:
+            listbox.append(Adw.ActionRow(title="Indexing repositories...", subtitle="Results will show up in a moment."))
+            return
+
+        results = index.search(query, limit=30)
+        flatpak_index = self.get_application().flatpak_index
+        flatpak_results = flatpak_index.search(query, limit=10) if flatpak_index is not None else []
+        if not results and not flatpak_results:
+            listbox.append(Adw.ActionRow(title="No packages found", subtitle=f"Nothing in the local repository metadata matches \"{query}\"."))
+            return
+        for pkg in results:
+            installed = pkg["name"] in self.get_application().installed
+            row = Adw.ActionRow(title=pkg["name"], subtitle=GLib.markup_escape_text(pkg["description"] or pkg["repo"]))
+            if installed:
+                label = Gtk.Label(label="Installed")
+                label.add_css_class("dim-label")
+                row.add_suffix(label)
+            else:
+                btn = Gtk.Button(label="Install", valign=Gtk.Align.CENTER)
+                btn.add_css_class("flat")
+                btn.connect("clicked", lambda x, p=pkg["name"]: self.install_package(p))
+                row.add_suffix(btn)
+            listbox.append(row)
+        flatpak_resolver = self.get_application().flatpak_resolver
+        for entry in flatpak_results:
+            row = Adw.ActionRow(title=entry["name"], subtitle=GLib.markup_escape_text(f"Flatpak from {entry['repo']} · {entry['description']}"))
+            if flatpak_resolver is not None and entry["name"] in flatpak_resolver.installed:
+                label = Gtk.Label(label="Installed")
+                label.add_css_class("dim-label")
+                row.add_suffix(label)
+            else:
+                btn = Gtk.Button(label="Install", valign=Gtk.Align.CENTER)
+                btn.add_css_class("flat")
+                btn.connect("clicked", lambda x, a=entry["name"]: self.install_flatpak(a))
+                row.add_suffix(btn)
+            listbox.append(row)
 
     def _update_package_list(self, listbox, packages):
         child = listbox.get_first_child()
@@ -473,61 +690,149 @@ class InsertWindow(Adw.ApplicationWindow):
             listbox.append(row)
             return
 
+        resolver = self.get_application().resolver
+        flatpak_resolver = self.get_application().flatpak_resolver
         for pkg in packages:
-            installed = self.get_application().distro_mgr.is_package_installed(pkg)
+            if resolver is None:
+                name, installed = pkg, self.get_application().distro_mgr.is_package_installed(pkg)
+            else:
+                # one listing call for the whole page instead of a query per row
+                name, installed = resolver.resolve(pkg), resolver.is_installed(pkg)
+            flatpak_id = None
+            if not installed and flatpak_resolver is not None and (name is None or flatpak_resolver.is_installed(pkg)):
+                # not in the repos (or already there as a flatpak), the same kind of lookup without a process
+                flatpak_id = flatpak_resolver.resolve(pkg)
+                installed = flatpak_id is not None and flatpak_resolver.is_installed(pkg)
             row = Adw.ActionRow(title=pkg)
-            row.set_subtitle("Installed" if installed else "Available for installation")
+            if flatpak_id is not None:
+                row.set_subtitle(f"Installed from Flatpak ({flatpak_id})" if installed else f"Available on Flatpak as {flatpak_id}")
+            elif name is None:
+                row.set_subtitle("Not available in your repositories")
+            elif name != pkg:
+                row.set_subtitle(f"Installed as {name}" if installed else f"Available as {name}")
+            else:
+                row.set_subtitle("Installed" if installed else "Available for installation")
             
             icon_name = "object-select-symbolic" if installed else "system-software-install-symbolic"
             row.add_prefix(Gtk.Image.new_from_icon_name(icon_name))
             
-            if not installed:
+            if not installed and flatpak_id is not None:
+                btn = Gtk.Button(label="Install", valign=Gtk.Align.CENTER)
+                btn.add_css_class("flat")
+                btn.connect("clicked", lambda x, a=flatpak_id: self.install_flatpak(a))
+                row.add_suffix(btn)
+            elif not installed and name is not None:
                 btn = Gtk.Button(label="Install", valign=Gtk.Align.CENTER)
                 btn.add_css_class("flat")
-                btn.connect("clicked", lambda x, p=pkg: self.install_package(p))
+                btn.connect("clicked", lambda x, p=name: self.install_package(p))
                 row.add_suffix(btn)
             
             listbox.append(row)
 
     def on_fw_update_clicked(self, button):
         logger.info("Firmware update requested")
-        cmd = self.get_application().distro_mgr._sudo_wrap(["fwupdmgr", "update", "-y"])
-        logger.info(f"Running firmware update command: {cmd}")
-        self.toast_overlay.add_toast(Adw.Toast.new("Updating firmware... This might take a while."))
-        self.worker.run_command(cmd)
+        self.show_task_toast("Updating firmware... This might take a while.")
+        self.worker.run_operation("firmware_update")
 
     def on_refresh_clicked(self, button):
-        # refresh package database and firmware metadata in worker
-        pkg_cmd = self.get_application().distro_mgr.refresh_database()
-        
-        fw_cmd_str = "pkexec fwupdmgr refresh"
-        if os.getuid() == 0:
-            fw_cmd_str = "fwupdmgr refresh"
-            
-        if pkg_cmd:
-            # combine commands if possible or just run them as a shell script string
-            # taskWorker takes a list for subprocess.Popen, so we will use a wrapper
-            cmd_list = ["bash", "-c", f"{' '.join(pkg_cmd)} && {fw_cmd_str}"]
-            logger.info(f"Refreshing all databases: {cmd_list}")
-            self.toast_overlay.add_toast(Adw.Toast.new("Refreshing databases..."))
-            self.worker.run_command(cmd_list)
-        else:
-            # just firmware
-            cmd_list = ["bash", "-c", fw_cmd_str]
-            self.worker.run_command(cmd_list)
-
-    def on_rescan_clicked(self, button):
+        # refresh package database and firmware metadata in worker, both go through the helper
+        operations = [("firmware_refresh", {})]
+        self._flatpak_refreshing = flatpak.enabled(self.get_application().distro_mgr)
+        if self._flatpak_refreshing:
+            # keeps the local appstream index current. Ahead of the firmware refresh: the batch stops
+            # at the first failure, and fwupdmgr refresh exits non-zero offline or when already current
+            operations.insert(0, ("flatpak_refresh", {}))
+        if self.get_application().distro_mgr.refresh_database():
+            operations.insert(0, ("refresh", {}))
+            self.show_task_toast("Refreshing databases...")
+        logger.info(f"Refreshing all databases: {operations}")
+        self.worker.run_operations(operations)
+
+    def on_rank_mirrors_clicked(self, button):
+        button.set_sensitive(False)
+        self.show_task_toast("Probing mirrors...")
+        pkg_mgr = self.get_application().distro_mgr.pkg_mgr
+        def rank():
+            ranked = rank_mirrors(load_candidates(pkg_mgr))
+            GLib.idle_add(self.show_mirror_proposal, ranked)
+        threading.Thread(target=rank, daemon=True).start()
+
+    def show_mirror_proposal(self, ranked):
+        self.mirrors_btn.set_sensitive(True)
+        fastest = proposal(ranked)
+        if not fastest:
+            self.toast_overlay.add_toast(Adw.Toast.new("No mirror could be reached"))
+            return
+        body = "\n".join(f"{r.latency * 1000:.0f} ms, {r.throughput / 1e6:.1f} MB/s  {urlsplit(r.url).hostname}" for r in fastest)
+        body += "\nThe other mirrors stay where they are."
+        dialog = Adw.MessageDialog(transient_for=self, heading="Use the fastest mirrors first?", body=body)
+        dialog.add_response("cancel", "Cancel")
+        dialog.add_response("apply", "Apply")
+        dialog.set_response_appearance("apply", Adw.ResponseAppearance.SUGGESTED)
+        def on_response(dialog, response):
+            if response == "apply":
+                self.show_task_toast("Writing mirror list...")
+                self.worker.run_operation("mirrors", urls=[r.url for r in fastest])
+        dialog.connect("response", on_response)
+        dialog.present()
+
+    def on_rescan_clicked(self, button, use_service=True):
         logger.info("Hardware rescan requested")
-        family = self.get_application().distro_mgr.family
-        logger.debug(f"Scanning for distro family: {family}")
-        matches = self.get_application().probe.find_needed_packages(family)
-        logger.info(f"Scan complete. Found {len(matches)} driver matches in database.")
-        
-        # enrich matches with installation status
-        for match in matches:
-            match["missing_packages"] = [p for p in match["packages"] if not self.get_application().distro_mgr.is_package_installed(p)]
-            match["is_installed"] = len(match["missing_packages"]) == 0
-        
+        if self._scanning:
+            # the running scan may predate whatever prompted this one, so run it again afterwards
+            self._rescan_pending = (button, use_service)
+            return
+        self._scanning = True
+        app = self.get_application()
+        if not self._drivers_shown and app.history is not None:
+            # last recorded state right away, the fresh scan replaces it when it is done
+            previous = app.history.load()
+            if previous and previous["matches"]:
+                logger.info(f"Showing scan {previous['id']} from history while rescanning")
+                self.update_driver_list([DriverMatch.from_dict(m) for m in previous["matches"]])
+                self.drivers_stack.set_visible_child_name("list")
+
+        def scan():
+            try:
+                # the background service usually has a fresh scan already, only an explicit rescan skips it
+                matches = app.service.get_matches() if button is None and use_service else None
+                changes = 0
+                if matches is None:
+                    matches = self.scan_locally()
+                    changes = self.record_scan(matches)
+                else:
+                    logger.info(f"Using {len(matches)} driver matches from the background service")
+            except Exception as e:
+                logger.error(f"Hardware scan failed: {e}")
+                GLib.idle_add(self.end_scan)
+                return
+            GLib.idle_add(self.apply_scan, matches, button, changes)
+
+        threading.Thread(target=scan, daemon=True).start()
+
+    def record_scan(self, matches):
+        # the service records its own scans, this is only for the local ones
+        history = self.get_application().history
+        if history is None:
+            return 0
+        app = self.get_application()
+        try:
+            previous = history.load()
+            scan_id = history.record(make_record(app.distro_mgr, app.probe.devices or [], matches, None))
+            return count_changes(diff_scans(previous, history.load(scan_id))) if previous else 0
+        except Exception as e:
+            logger.warning(f"Could not record scan: {e}")
+            return 0
+
+    def end_scan(self):
+        self._scanning = False
+        if self._rescan_pending is not None:
+            pending, self._rescan_pending = self._rescan_pending, None
+            self.on_rescan_clicked(*pending)
+        return False
+
+    def apply_scan(self, matches, button, changes):
+        self.end_scan()
         if matches:
             self.update_driver_list(matches)
             self.drivers_stack.set_visible_child_name("list")
@@ -535,13 +840,47 @@ class InsertWindow(Adw.ApplicationWindow):
             self.drivers_stack.set_visible_child_name("empty")
             if button:
                 self.toast_overlay.add_toast(Adw.Toast.new("No matching hardware found in database."))
+        if changes:
+            self.toast_overlay.add_toast(Adw.Toast.new(f"{changes} changes since the last scan"))
                 
         # also check for firmware updates in background to avoid freezing the UI
+        metrics = self.worker.metrics
         def check_fw():
+            start = time.monotonic()
             fw_updates = self.get_application().probe.get_firmware_updates()
+            record_phase(metrics, "firmware", time.monotonic() - start)
+            record_firmware(metrics, fw_updates)
+            metrics.write()
             GLib.idle_add(self.apply_fw_status, fw_updates, matches)
             
         threading.Thread(target=check_fw, daemon=True).start()
+        return False
+
+    def scan_locally(self):
+        family = self.get_application().distro_mgr.family
+        logger.debug(f"Scanning for distro family: {family}")
+        metrics = self.worker.metrics
+        start = time.monotonic()
+        devices = self.get_application().probe.scan_devices()
+        record_phase(metrics, "devices", time.monotonic() - start)
+
+        start = time.monotonic()
+        matches = self.get_application().probe.match_devices(family, devices)
+        record_phase(metrics, "match", time.monotonic() - start)
+        logger.info(f"Scan complete. Found {len(matches)} driver matches in database.")
+        
+        # enrich matches with installation status
+        start = time.monotonic()
+        for match in matches:
+            match.set_installed(self.get_application().distro_mgr.is_package_installed)
+        record_phase(metrics, "installed", time.monotonic() - start)
+
+        start = time.monotonic()
+        self.get_application().probe.check_bindings(matches)
+        record_phase(metrics, "bindings", time.monotonic() - start)
+        record_matches(metrics, matches)
+        metrics.write()
+        return matches
 
     def apply_fw_status(self, fw_updates, matches):
         if fw_updates:
@@ -553,7 +892,7 @@ class InsertWindow(Adw.ApplicationWindow):
             self.toast_overlay.add_toast(Adw.Toast.new("Firmware updates available!"))
         else:
             self.fw_update_btn.set_visible(False)
-            any_missing = any(not m["is_installed"] for m in matches)
+            any_missing = any(not m.is_installed for m in matches)
             if not any_missing:
                 self.status_page.set_title("All Clear")
                 self.status_page.set_description("System is up to date.")
@@ -561,6 +900,7 @@ class InsertWindow(Adw.ApplicationWindow):
         return False # stop GLib timeout
 
     def update_driver_list(self, matches):
+        self._drivers_shown = True
         child = self.driver_list.get_first_child()
         while child:
             self.driver_list.remove(child)
@@ -568,16 +908,23 @@ class InsertWindow(Adw.ApplicationWindow):
             
         for match in matches:
             # get a cleaner device name
-            device_name = match["driver_name"]
-            raw = match["device_raw"]
-            sub = f"Category: {match['category'].upper()}"
-            parts = re.findall(r'\"(.*?)\"', raw)
-            if len(parts) >= 3:
-                sub = f"{parts[1]} | {parts[2]}"
-
-            row = Adw.ActionRow(title=match["driver_name"], subtitle=sub)
+            device = match.device
+            sub = f"Category: {match.category.upper()}"
+            if device.vendor_name and device.device_name:
+                sub = f"{device.vendor_name} | {device.device_name}"
+
+            row = Adw.ActionRow(title=match.driver_name, subtitle=sub)
             
-            if match["is_installed"]:
+            if match.is_installed and match.state == "inactive":
+                icon = Gtk.Image.new_from_icon_name("dialog-warning-symbolic")
+                icon.add_css_class("warning")
+                row.add_prefix(icon)
+
+                loaded = f"device uses {match.bound_driver}" if match.bound_driver else "not loaded"
+                label = Gtk.Label(label=f"Installed, {loaded}")
+                label.add_css_class("dim-label")
+                row.add_suffix(label)
+            elif match.is_installed:
                 icon = Gtk.Image.new_from_icon_name("emblem-ok-symbolic")
                 icon.add_css_class("success")
                 row.add_prefix(icon)
@@ -589,7 +936,7 @@ class InsertWindow(Adw.ApplicationWindow):
                 row.add_prefix(Gtk.Image.new_from_icon_name("system-software-install-symbolic"))
                 
                 vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=4, valign=Gtk.Align.CENTER)
-                for pkg in match["missing_packages"]:
+                for pkg in match.missing_packages:
                     btn = Gtk.Button(label=f"Install {pkg}")
                     btn.add_css_class("flat")
                     btn.connect("clicked", lambda x, p=pkg: self.install_package(p))
@@ -600,6 +947,8 @@ class InsertWindow(Adw.ApplicationWindow):
 
     def on_cleanup_scan_clicked(self, button):
         orphans = self.get_application().distro_mgr.get_orphans()
+        record_orphans(self.worker.metrics, orphans)
+        self.worker.metrics.write()
         if orphans:
             self.cleanup_status.set_visible(False)
             self.orphans_list.set_visible(True)
@@ -622,24 +971,82 @@ class InsertWindow(Adw.ApplicationWindow):
             self.orphans_list.append(row)
 
     def install_package(self, pkg):
-        cmd = self.get_application().distro_mgr.get_install_command([pkg])
-        logger.info(f"Installing package: {pkg} with command: {cmd}")
-        self.toast_overlay.add_toast(Adw.Toast.new(f"Installing {pkg}..."))
-        self.worker.run_command(cmd)
+        logger.info(f"Installing package: {pkg}")
+        self.show_task_toast(f"Installing {pkg}...")
+        self.worker.run_operation("install", packages=[pkg])
+
+    def install_flatpak(self, app_id):
+        app = self.get_application()
+        entry = app.flatpak_index.get(app_id) if app.flatpak_index is not None else None
+        if entry is None:
+            self.toast_overlay.add_toast(Adw.Toast.new(f"{app_id} is not in any configured Flatpak remote."))
+            return
+        if (entry["repo"], app_id) in self._flatpak_queue:
+            return
+        logger.info(f"Queueing flatpak: {app_id} from {entry['repo']}")
+        self._flatpak_queue.append((entry["repo"], app_id))
+        self.toast_overlay.add_toast(Adw.Toast.new(f"Queued {app_id}..."))
+        # every click restarts the wait, a quick run of clicks becomes one flatpak transaction
+        if self._flatpak_flush_id:
+            GLib.source_remove(self._flatpak_flush_id)
+        self._flatpak_flush_id = GLib.timeout_add(FLATPAK_QUEUE_DELAY_MS, self.flush_flatpak_queue)
+
+    def flush_flatpak_queue(self):
+        self._flatpak_flush_id = 0
+        # grouped by remote so batch_operations can merge each remote's apps
+        queued = sorted(self._flatpak_queue)
+        self._flatpak_queue = []
+        if queued:
+            names = ", ".join(app_id for _, app_id in queued)
+            logger.info(f"Installing flatpaks: {names}")
+            self.show_task_toast(f"Installing {names}...")
+            self.worker.run_operations([("flatpak_install", {"remote": remote, "apps": [app_id]}) for remote, app_id in queued])
+        return False
+
+    def rebuild_flatpak_index(self):
+        # the appstream data just changed on disk
+        def build():
+            index = flatpak.build_index()
+            resolver = flatpak.build_resolver(index, flatpak.installed_apps())
+            GLib.idle_add(self.apply_flatpak_index, index, resolver)
+        threading.Thread(target=build, daemon=True).start()
+
+    def apply_flatpak_index(self, index, resolver):
+        app = self.get_application()
+        app.flatpak_index = index
+        app.flatpak_resolver = resolver
+        self.update_optional_list()
+        if self.optional_search.get_text():
+            self.on_optional_search_changed(self.optional_search)
+        return False
 
     def remove_package(self, pkg):
-        cmd = self.get_application().distro_mgr.get_remove_command([pkg])
-        logger.info(f"Removing package: {pkg} with command: {cmd}")
-        self.toast_overlay.add_toast(Adw.Toast.new(f"Removing {pkg}..."))
-        self.worker.run_command(cmd)
+        logger.info(f"Removing package: {pkg}")
+        self.show_task_toast(f"Removing {pkg}...")
+        self.worker.run_operation("remove", packages=[pkg])
+
+    def show_task_toast(self, message):
+        toast = Adw.Toast.new(message)
+        toast.set_button_label("Cancel")
+        toast.connect("button-clicked", lambda t: self.worker.cancel())
+        self.toast_overlay.add_toast(toast)
 
     def on_worker_event(self, event_type, data):
         if event_type == "finished":
             logger.info("Task worker finished successfully")
             self.toast_overlay.add_toast(Adw.Toast.new("Task finished!"))
-            self.on_rescan_clicked(None)
-            self.update_essentials_list()
+            # the service's copy is stale now, rescan here and let it catch up in the background
+            self.get_application().service.refresh(packages_only=True)
+            self.on_rescan_clicked(None, use_service=False)
+            self.refresh_installed()
+            if self._flatpak_refreshing:
+                self._flatpak_refreshing = False
+                self.rebuild_flatpak_index()
         elif event_type == "error":
+            # a partly done refresh may still have new appstream data
+            if self._flatpak_refreshing:
+                self._flatpak_refreshing = False
+                self.rebuild_flatpak_index()
             logger.error(f"Task worker error: {data}")
             self.toast_overlay.add_toast(Adw.Toast.new(f"Error: {data}"))
 
@@ -1,7 +1,9 @@
+import threading
 import gi
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, GLib
+from libinsert.downloads import detect_parallelism, TUNABLE
 
 class SettingsWindow(Adw.PreferencesWindow):
     def __init__(self, **kwargs):
@@ -35,6 +37,31 @@ class SettingsWindow(Adw.PreferencesWindow):
         theme_row.connect("notify::selected", self.on_theme_changed)
         group.add(theme_row)
 
+        # Parallel downloads, only for package managers we know how to tune
+        app = self.get_transient_for().get_application()
+        if app.distro_mgr.pkg_mgr in TUNABLE:
+            downloads_row = Adw.SwitchRow()
+            downloads_row.set_title("Parallel Downloads")
+            downloads_row.set_subtitle("Raise download parallelism for installs and refreshes.")
+            downloads_row.set_active(app.config.get("accelerate_downloads", False))
+            downloads_row.connect("notify::active", self.on_downloads_toggled)
+            group.add(downloads_row)
+
+            # apt-config dump is a subprocess, keep it off the main thread
+            throughput = self.get_transient_for().worker.throughput
+            def detect():
+                detected = detect_parallelism(app.distro_mgr.pkg_mgr)
+                GLib.idle_add(self.apply_detected_parallelism, downloads_row, detected, throughput.summary())
+            threading.Thread(target=detect, daemon=True).start()
+
+        # Background jobs yield CPU and disk to whatever the user is doing
+        priority_row = Adw.SwitchRow()
+        priority_row.set_title("Background Priority")
+        priority_row.set_subtitle("Run refreshes, firmware checks and cleanups at low CPU and disk priority.")
+        priority_row.set_active(app.config.get("background_priority", "off") != "off")
+        priority_row.connect("notify::active", self.on_priority_toggled)
+        group.add(priority_row)
+
         # Notification Tester
         notif_test_row = Adw.ActionRow()
         notif_test_row.set_title("Test Notifications")
@@ -72,6 +99,24 @@ class SettingsWindow(Adw.PreferencesWindow):
         else:
             style_manager.set_color_scheme(Adw.ColorScheme.PREFER_LIGHT) # Default/Follow system
 
+    def apply_detected_parallelism(self, row, detected, measured):
+        subtitle = f"Raise download parallelism for installs and refreshes. System: {detected['setting']} = {detected['value']}"
+        if measured:
+            subtitle += f"\nMeasured: {measured}"
+        row.set_subtitle(subtitle)
+        return False
+
+    def on_downloads_toggled(self, row, pspec):
+        win = self.get_transient_for()
+        win.worker.accelerate_downloads = row.get_active()
+        win.get_application().save_config(accelerate_downloads=row.get_active())
+
+    def on_priority_toggled(self, row, pspec):
+        win = self.get_transient_for()
+        mode = "auto" if row.get_active() else "off"
+        win.worker.background_priority = mode
+        win.get_application().save_config(background_priority=mode)
+
     def on_test_notif_clicked(self, button):
         win = self.get_transient_for()
         if hasattr(win, "toast_overlay"):
@@ -0,0 +1,99 @@
+import os
+import time
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.libinsert.aio import AsyncDistroManager, AsyncSysProbe, run_async
+from src.libinsert.devices import Device
+from src.libinsert.distro import DistroManager
+from src.libinsert.probe import SysProbe
+
+class testaio(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = patch.dict(os.environ, {
+            "INSERT_PKG_MGR": "simulated",
+            "INSERT_SIM_STATE": os.path.join(self.tmp.name, "state.json"),
+            "INSERT_SIM_PACKAGES": "300",
+            "INSERT_SIM_LATENCY": "0.2",
+            "INSERT_SIM_SPEED": "1e12",
+            "INSERT_SIM_VERBOSITY": "2",
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testrunasync(self):
+        async def main():
+            lines = []
+            result = await run_async(["sh", "-c", "echo one; echo two >&2; echo three; exit 3"], on_line=lines.append)
+            timed = await run_async(["sleep", "30"], timeout=0.2)
+            return lines, result, timed
+        lines, result, timed = asyncio.run(main())
+        self.assertEqual(lines, ["one", "three"])
+        self.assertEqual((result.returncode, result.stderr), (3, "two\n"))
+        self.assertTrue(timed.timed_out)
+        self.assertLess(timed.wall_time, 5)
+
+    def testcancelkillsgroup(self):
+        async def main():
+            task = asyncio.ensure_future(run_async(["sh", "-c", "sleep 30 & wait"]))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            start = time.monotonic()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return time.monotonic() - start
+        self.assertLess(asyncio.run(main()), 5)
+
+    def testconcurrentqueries(self):
+        async def main():
+            distro = AsyncDistroManager(DistroManager(), concurrency=20)
+            # no listing call, so each of these is its own 0.2s query
+            with patch.object(distro.distro_mgr, "get_installed_packages_command", return_value=[]):
+                start = time.monotonic()
+                states = await distro.installed([f"pkg-{i}" for i in range(20)] + ["vulkan-radeon"])
+                return states, time.monotonic() - start
+        states, elapsed = asyncio.run(main())
+        self.assertEqual(len(states), 21)
+        self.assertFalse(states["vulkan-radeon"])
+        # overlapping, not 21 x 0.2s
+        self.assertLess(elapsed, 2.5)
+
+    def testtransactionandmatches(self):
+        async def main():
+            distro = AsyncDistroManager(DistroManager())
+            events = [event async for event in distro.run_transaction([("install", {"packages": ["vulkan-radeon"]})])]
+            probe = AsyncSysProbe(SysProbe(db_path="data/drivers.json"), distro)
+            devices = [Device("pci", "03:00.0", "0300", "VGA compatible controller", "1002",
+                              "Advanced Micro Devices, Inc. [AMD/ATI]", "73bf", "Navi 21")]
+            with patch.object(probe.sysprobe, "check_bindings", side_effect=lambda m: m):
+                matches = await probe.find_needed_packages(devices, family="arch")
+            bad = [event async for event in distro.run_transaction([("install", {"packages": ["--force"]})])]
+            return events, matches, bad
+        events, matches, bad = asyncio.run(main())
+        self.assertEqual(events[-1], ("finished", True))
+        self.assertTrue(any(kind == "progress" and data.startswith("installing") for kind, data in events))
+        amd = [m for m in matches if "vulkan-radeon" in m.packages]
+        self.assertTrue(amd)
+        self.assertNotIn("vulkan-radeon", amd[0].missing_packages)
+        self.assertEqual(bad[0][0], "error")
+
+    def testprobesharesthelimit(self):
+        async def main():
+            probe = AsyncSysProbe(SysProbe(db_path="data/drivers.json"), concurrency=1)
+            with patch.object(probe.distro.distro_mgr, "get_installed_packages_command", return_value=["sleep", "0.5"]), \
+                 patch("src.libinsert.aio.PCI_COMMAND", ["sleep", "0.5"]), patch("src.libinsert.aio.USB_COMMAND", ["true"]), \
+                 patch.object(probe.sysprobe, "match_devices", return_value=[]), \
+                 patch.object(probe.sysprobe, "check_bindings", side_effect=lambda m: m):
+                start = time.monotonic()
+                await probe.find_needed_packages(family="arch")
+                return probe, time.monotonic() - start
+        probe, elapsed = asyncio.run(main())
+        self.assertIs(probe._limit, probe.distro._limit)
+        # the listing and lspci took turns instead of overlapping
+        self.assertGreaterEqual(elapsed, 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
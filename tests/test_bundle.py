@@ -0,0 +1,144 @@
+import os
+import io
+import base64
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.libinsert.bundle import (BundleError, bundle_packages, export_bundle, install_bundle, install_commands,
+                                  load_manifest, needed_from_bundle, verify_bundle, build_repo_index,
+                                  carry_signatures, transaction_lock)
+from src.libinsert.devices import Device, DriverMatch
+from src.libinsert.distro import DistroManager
+from src.libinsert.probe import SysProbe
+from src.libinsert.runner import CommandResult
+from tests.test_snapshot import make_snapshot, AMD_GPU, NVIDIA_GPU
+
+class fakedistro:
+    family = "arch"
+    pkg_mgr = "pacman"
+
+    def get_installed_packages(self):
+        return ["mesa", "git"]
+
+class fakeprobe:
+    drivers_db = {"essentials": {"arch": ["git", "htop"]}}
+
+    def find_needed_packages(self, family):
+        device = Device("pci", "03:00.0", "0300", "VGA", "1002", "AMD", "73bf", "Navi 21")
+        return [DriverMatch("AMD Mesa", "gpus", ["mesa", "vulkan-radeon", "lib32-vulkan-radeon"], device)]
+
+class testbundle(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def testpackages(self):
+        probe = SysProbe(db_path="data/drivers.json")
+        snapshots = [make_snapshot("a", "arch", [NVIDIA_GPU], []), make_snapshot("c", "ubuntu", [AMD_GPU], [])]
+        packages = bundle_packages(probe, "arch", snapshots, extra=["linux-firmware"])
+        self.assertIn("nvidia-utils", packages)
+        self.assertIn("base-devel", packages)
+        self.assertIn("linux-firmware", packages)
+        # the ubuntu machine isn't covered by an arch bundle
+        self.assertNotIn("libglx-mesa0", packages)
+        self.assertNotIn("base-devel", bundle_packages(probe, "arch", snapshots, essentials=False))
+
+    def testneeded(self):
+        manifest = {"packages": ["vulkan-radeon", "htop", "git"]}
+        available, unavailable = needed_from_bundle(manifest, fakedistro(), fakeprobe())
+        self.assertEqual(available, ["htop", "vulkan-radeon"])
+        self.assertEqual(unavailable, ["lib32-vulkan-radeon"])
+
+    def testinstallcommands(self):
+        apt = install_commands("apt", "/srv/bundle", ["mesa"], self.tmp.name)
+        self.assertEqual(apt[0][:2], ["apt-get", "update"])
+        self.assertIn("Dir::Etc::SourceParts=/dev/null", apt[1])
+        with open(os.path.join(self.tmp.name, "sources.list")) as f:
+            self.assertEqual(f.read(), "deb [trusted=yes] file:/srv/bundle ./\n")
+
+        pacman = install_commands("pacman", "/srv/bundle", ["mesa"], self.tmp.name)
+        self.assertIn("--needed", pacman[1])
+        # never the system sync dir
+        self.assertEqual(pacman[0][pacman[0].index("--dbpath") + 1], os.path.join(self.tmp.name, "db"))
+
+        dnf = install_commands("dnf", "/srv/bundle", ["mesa"], self.tmp.name)
+        self.assertIn("--disablerepo=*", dnf[0])
+        self.assertRaises(BundleError, install_commands, "zypper", "/srv/bundle", ["mesa"], self.tmp.name)
+
+    def testdebindex(self):
+        for name in ("a_1_amd64.deb", "b_2_all.deb"):
+            with open(os.path.join(self.tmp.name, name), "wb") as f:
+                f.write(b"debdata")
+        def fake_run(cmd, **kwargs):
+            package = os.path.basename(cmd[-1]).split("_")[0]
+            return CommandResult(cmd, 0, f"Package: {package}\nVersion: 1\nArchitecture: amd64\n")
+        with patch("src.libinsert.bundle.run", side_effect=fake_run):
+            build_repo_index("apt", self.tmp.name, ["a_1_amd64.deb", "b_2_all.deb"])
+        with open(os.path.join(self.tmp.name, "Packages")) as f:
+            stanzas = f.read().strip().split("\n\n")
+        self.assertEqual(len(stanzas), 2)
+        self.assertIn("Filename: ./b_2_all.deb\nSize: 7\nSHA256: ", stanzas[1])
+
+    def testcarrysignatures(self):
+        sync = os.path.join(self.tmp.name, "sync")
+        os.makedirs(sync)
+        signature = b"\x89\x02\x33signature"
+        with tarfile.open(os.path.join(sync, "extra.db"), "w:gz") as tar:
+            for name, sig in (("mesa-1-1", signature), ("htop-2-1", None)):
+                desc = f"%FILENAME%\n{name}-x86_64.pkg.tar.zst\n\n%NAME%\n{name}\n"
+                if sig:
+                    desc += f"\n%PGPSIG%\n{base64.b64encode(sig).decode()}\n"
+                info = tarfile.TarInfo(f"{name}/desc")
+                info.size = len(desc.encode())
+                tar.addfile(info, io.BytesIO(desc.encode()))
+        directory = os.path.join(self.tmp.name, "bundle")
+        os.makedirs(directory)
+        for name in ("mesa-1-1-x86_64.pkg.tar.zst", "htop-2-1-x86_64.pkg.tar.zst"):
+            open(os.path.join(directory, name), "wb").close()
+
+        self.assertEqual(carry_signatures(directory, sync), ["htop-2-1-x86_64.pkg.tar.zst"])
+        with open(os.path.join(directory, "mesa-1-1-x86_64.pkg.tar.zst.sig"), "rb") as f:
+            self.assertEqual(f.read(), signature)
+
+    def testtransactionlock(self):
+        lock = os.path.join(self.tmp.name, "db.lck")
+        with transaction_lock("pacman", lock):
+            self.assertTrue(os.path.exists(lock))
+            # a second transaction, or a system pacman, has to wait
+            with self.assertRaises(BundleError):
+                with transaction_lock("pacman", lock):
+                    pass
+        self.assertFalse(os.path.exists(lock))
+        with transaction_lock("apt", lock):
+            self.assertFalse(os.path.exists(lock))
+
+    def testsimulatedroundtrip(self):
+        env = {
+            "INSERT_PKG_MGR": "simulated",
+            "INSERT_SIM_STATE": os.path.join(self.tmp.name, "state.json"),
+            "INSERT_SIM_PACKAGES": "300",
+            "INSERT_SIM_LATENCY": "0",
+            "INSERT_SIM_SPEED": "1e12",
+            "INSERT_SIM_VERBOSITY": "0",
+        }
+        directory = os.path.join(self.tmp.name, "bundle")
+        with patch.dict(os.environ, env):
+            dm = DistroManager()
+            manifest = export_bundle(dm, ["vulkan-radeon", "htop"], directory)
+            self.assertEqual(load_manifest(directory)["packages"], ["vulkan-radeon", "htop"])
+            self.assertTrue(any(f.startswith("vulkan-radeon-") for f in manifest["files"]))
+            self.assertEqual(verify_bundle(directory, manifest), [])
+
+            install_bundle(dm, directory, ["vulkan-radeon"])
+            self.assertTrue(dm.is_package_installed("vulkan-radeon"))
+
+            name = sorted(manifest["files"])[0]
+            with open(os.path.join(directory, name), "a") as f:
+                f.write("tampered")
+            self.assertEqual(verify_bundle(directory, manifest), [name])
+            self.assertRaises(BundleError, install_bundle, dm, directory, ["htop"])
+            self.assertFalse(dm.is_package_installed("htop"))
+
+if __name__ == "__main__":
+    unittest.main()
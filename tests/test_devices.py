@@ -0,0 +1,44 @@
+import json
+import unittest
+from src.libinsert.devices import Device, DriverMatch, parse_devices, parse_lspci_line, parse_lsusb_line
+
+AMD_GPU = '03:00.0 "VGA compatible controller [0300]" "Advanced Micro Devices, Inc. [AMD/ATI] [1002]" "Navi 21 [Radeon RX 6800/6800 XT / 6900 XT] [73bf]" -rc1 -p00 "Sapphire Technology Limited [1da2]" "Device [439e]"'
+
+class testdevices(unittest.TestCase):
+    def testlspci(self):
+        dev = parse_lspci_line(AMD_GPU)
+        self.assertEqual((dev.bus, dev.slot, dev.class_id), ("pci", "03:00.0", "0300"))
+        self.assertEqual(dev.hardware_id, "1002:73bf")
+        self.assertEqual(dev.vendor_name, "Advanced Micro Devices, Inc. [AMD/ATI]")
+        self.assertEqual(dev.short_device, "Radeon RX 6800/6800 XT / 6900 XT")
+        self.assertEqual((dev.subsys_vendor_id, dev.subsys_device_id), ("1da2", "439e"))
+        # "compatible" in the class name must not count as an ATI match
+        self.assertNotIn("compatible", dev.search_text)
+
+    def testlsusb(self):
+        dev = parse_lsusb_line("Bus 001 Device 002: ID 8087:0024 Intel Corp. Integrated Rate Matching Hub")
+        self.assertEqual((dev.bus, dev.slot, dev.hardware_id), ("usb", "001:002", "8087:0024"))
+        self.assertIsNone(dev.class_id)
+
+    def testparsedevicesskipsjunk(self):
+        self.assertEqual(len(parse_devices([AMD_GPU, "", "garbage"], ["Bus 002 Device 001: ID 1d6b:0003 Linux Foundation 3.0 root hub", AMD_GPU])), 2)
+
+    def testslots(self):
+        dev = parse_lspci_line(AMD_GPU)
+        with self.assertRaises(AttributeError):
+            dev.extra = 1
+        match = DriverMatch("Mesa", "gpus", ["mesa", "vulkan-radeon"], dev)
+        match.set_installed({"mesa"}.__contains__)
+        self.assertEqual(match.missing_packages, ["vulkan-radeon"])
+        self.assertFalse(match.is_installed)
+
+    def testdictroundtrip(self):
+        match = DriverMatch("Mesa", "gpus", ["mesa"], parse_lspci_line(AMD_GPU), ["amdgpu"])
+        match.set_installed(set().__contains__)
+        match.state = "missing"
+        copy = DriverMatch.from_dict(json.loads(json.dumps(match.to_dict())))
+        self.assertEqual(copy.to_dict(), match.to_dict())
+        self.assertEqual(copy.device.hardware_id, "1002:73bf")
+
+if __name__ == "__main__":
+    unittest.main()
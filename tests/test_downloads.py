@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.libinsert import downloads
+from src.libinsert.downloads import detect_parallelism, tuned_overrides, apply_overrides, ThroughputLog
+from src.libinsert.runner import CommandResult
+
+PACMAN_CONF = """[options]
+HoldPkg     = pacman glibc
+#ParallelDownloads = 5
+
+[core]
+Include = /etc/pacman.d/mirrorlist
+"""
+
+class testdownloads(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pacman_conf = os.path.join(self.tmp.name, "pacman.conf")
+        with open(self.pacman_conf, "w") as f:
+            f.write(PACMAN_CONF)
+        self.dnf_conf = os.path.join(self.tmp.name, "dnf.conf")
+        with open(self.dnf_conf, "w") as f:
+            f.write("[main]\nmax_parallel_downloads=7\n")
+        patcher = patch.multiple(downloads, PACMAN_CONF=self.pacman_conf, DNF_CONF=self.dnf_conf)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testdetect(self):
+        # commented out means pacman downloads one at a time
+        self.assertEqual(detect_parallelism("pacman")["value"], 1)
+        self.assertEqual(detect_parallelism("dnf")["value"], 7)
+        dump = CommandResult(["apt-config"], 0, 'Acquire::Queue-Mode "access";\n')
+        with patch.object(downloads, "run", return_value=dump):
+            self.assertEqual(detect_parallelism("apt")["value"], "access")
+        self.assertIsNone(detect_parallelism("xbps"))
+
+    def testpacmanconfcopy(self):
+        overrides = tuned_overrides("pacman", 8)
+        self.assertEqual(overrides[0], "--config")
+        self.addCleanup(os.remove, overrides[1])
+        # every accelerated transaction of the session shares one copy
+        self.assertEqual(tuned_overrides("pacman", 8), overrides)
+        with open(overrides[1]) as f:
+            text = f.read()
+        self.assertIn("ParallelDownloads = 8", text)
+        self.assertIn("[core]", text)
+        # the system file is never touched
+        with open(self.pacman_conf) as f:
+            self.assertEqual(f.read(), PACMAN_CONF)
+
+    def testapplyoverrides(self):
+        cmd = ["pkexec", "dnf", "install", "-y", "mesa"]
+        self.assertEqual(apply_overrides(cmd, "dnf", 6),
+                         ["pkexec", "dnf", "--setopt=max_parallel_downloads=6", "install", "-y", "mesa"])
+        apt = apply_overrides(["apt", "update"], "apt", 4)
+        self.assertEqual(apt[0], "apt")
+        self.assertEqual(apt[-1], "update")
+        self.assertIn("Acquire::http::Pipeline-Depth=4", apt)
+        self.assertEqual(apply_overrides(["xbps-install", "-S"], "xbps"), ["xbps-install", "-S"])
+
+    def testthroughputlog(self):
+        log = ThroughputLog(os.path.join(self.tmp.name, "throughput.json"))
+        self.assertIsNone(log.summary())
+        # dnf deletes packages after installing unless keepcache is on, nothing to measure
+        self.assertIsNone(log.start("dnf"))
+        with patch.object(log, "cache_bytes", side_effect=[0, 4_000_000]):
+            mark = log.start("pacman")
+            mark["time"] -= 2
+            self.assertGreater(log.finish(mark, tuned=True), 0)
+        self.assertTrue(log.summary().startswith("tuned"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import gzip
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.libinsert.flatpak import (read_installed, installed_apps, build_index, build_resolver, install_command,
+                                   remove_command, batch_operations, enabled)
+from src.libinsert.helper import build_operation
+
+APPSTREAM = """<?xml version="1.0" encoding="UTF-8"?>
+<components version="0.8" origin="flathub">
+  <component type="desktop-application">
+    <id>com.discordapp.Discord.desktop</id>
+    <name>Discord</name>
+    <name xml:lang="de">Discord (de)</name>
+    <summary>Messaging, voice and video client</summary>
+    <bundle type="flatpak">app/com.discordapp.Discord/x86_64/stable</bundle>
+  </component>
+  <component type="desktop-application">
+    <id>com.obsproject.Studio</id>
+    <name>OBS Studio</name>
+    <summary>Live streaming and video recording software</summary>
+    <bundle type="flatpak">app/com.obsproject.Studio/x86_64/stable</bundle>
+  </component>
+  <component type="runtime">
+    <id>org.freedesktop.Platform</id>
+    <name>Freedesktop Platform</name>
+  </component>
+</components>
+"""
+
+class fakedistro:
+    pkg_mgr = "pacman"
+
+    def _sudo_wrap(self, cmd):
+        return ["pkexec"] + cmd
+
+class testflatpak(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.system = os.path.join(self.tmp.name, "system")
+        self.user = os.path.join(self.tmp.name, "user")
+        for app_id, deployed in (("com.obsproject.Studio", True), ("org.example.Leftover", False)):
+            os.makedirs(os.path.join(self.system, "app", app_id, "x86_64", "stable"))
+            if deployed:
+                os.symlink("x86_64/stable", os.path.join(self.system, "app", app_id, "current"))
+        active = os.path.join(self.system, "appstream", "flathub", "x86_64", "active")
+        os.makedirs(active)
+        with gzip.open(os.path.join(active, "appstream.xml.gz"), "wt") as f:
+            f.write(APPSTREAM)
+        self.dirs = [self.system, self.user]
+
+    def testinstalled(self):
+        self.assertEqual(read_installed(self.dirs), {"com.obsproject.Studio"})
+        self.assertIsNone(read_installed([self.user]))
+        self.assertEqual(installed_apps(self.dirs), {"com.obsproject.Studio"})
+
+    def testindexandresolver(self):
+        index = build_index(self.dirs, arch="x86_64")
+        self.assertEqual(sorted(index.names), ["com.discordapp.Discord", "com.obsproject.Studio"])
+        self.assertEqual(index.get("com.discordapp.Discord")["repo"], "flathub")
+        self.assertEqual(index.search("streaming")[0]["name"], "com.obsproject.Studio")
+
+        resolver = build_resolver(index, read_installed(self.dirs))
+        self.assertEqual(resolver.resolve("discord"), "com.discordapp.Discord")
+        self.assertFalse(resolver.is_installed("discord"))
+        # no alias needed, the appstream name is enough
+        self.assertEqual(resolver.resolve("obs-studio"), "com.obsproject.Studio")
+        self.assertTrue(resolver.is_installed("obs-studio"))
+        self.assertIsNone(resolver.resolve("htop"))
+        self.assertIsNone(build_resolver(build_index([self.user]), set()))
+
+    def testbatchedtransactions(self):
+        operations = batch_operations([
+            ("flatpak_install", {"remote": "flathub", "apps": ["com.discordapp.Discord"]}),
+            ("flatpak_install", {"remote": "flathub", "apps": ["com.obsproject.Studio", "com.discordapp.Discord"]}),
+            ("flatpak_install", {"remote": "fedora", "apps": ["org.gnome.Maps"]}),
+            ("install", {"packages": ["htop"]}),
+        ])
+        self.assertEqual([op for op, _ in operations], ["flatpak_install", "flatpak_install", "install"])
+        self.assertEqual(operations[0][1]["apps"], ["com.discordapp.Discord", "com.obsproject.Studio"])
+        self.assertEqual(install_command("flathub", operations[0][1]["apps"])[-3:],
+                         ["flathub", "com.discordapp.Discord", "com.obsproject.Studio"])
+        self.assertEqual(build_operation(fakedistro(), "flatpak_remove", {"apps": ["com.obsproject.Studio"]})[:3],
+                         ["pkexec", "flatpak", "uninstall"])
+        for args in ({"remote": "--from=/tmp/x", "apps": ["com.discordapp.Discord"]},
+                     {"remote": "flathub", "apps": ["--reinstall"]}, {"remote": "flathub", "apps": []}):
+            with self.assertRaises(ValueError):
+                build_operation(fakedistro(), "flatpak_install", args)
+        with self.assertRaises(ValueError):
+            remove_command(["discord"])
+
+    def testnotinsimulation(self):
+        simulated = fakedistro()
+        simulated.pkg_mgr = "simulated"
+        for op, args in (("flatpak_refresh", {}), ("flatpak_remove", {"apps": ["com.obsproject.Studio"]}),
+                         ("flatpak_install", {"remote": "flathub", "apps": ["com.discordapp.Discord"]})):
+            with self.assertRaises(ValueError):
+                build_operation(simulated, op, args)
+        with patch("src.libinsert.flatpak.available", return_value=True):
+            self.assertFalse(enabled(simulated))
+            self.assertTrue(enabled(fakedistro()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import sys
+import socket
+import threading
+import unittest
+from src.libinsert.helper import HelperServer, HelperClient, build_operation
+
+class fakedistro:
+    def refresh_database(self, accelerate=False):
+        return [sys.executable, "-c", "print('refreshing'); print('done')"]
+
+    def get_install_command(self, packages, accelerate=False):
+        return [sys.executable, "-c", f"import sys; print('installing {' '.join(packages)}'); sys.exit({1 if 'broken' in packages else 0})"]
+
+    def get_remove_command(self, packages):
+        return []
+
+    def can_prune(self):
+        return True
+
+    def get_prune_task(self):
+        raise AssertionError("the helper leaves planning the prune to the prune command")
+
+    def get_prune_command(self):
+        return [sys.executable, "-m", "libinsert", "prune", "--keep", "3", "pacman"]
+
+    def get_cleanup_tasks(self, prune=True):
+        # planning the prune is the expensive part, the helper must not do it for other tasks
+        assert not prune
+        return [{"name": "Temporary Files", "cmd": [sys.executable, "-c", "pass"]}]
+
+    def _sudo_wrap(self, cmd):
+        return cmd
+
+class testhelper(unittest.TestCase):
+    def testbuildoperationvalidates(self):
+        dm = fakedistro()
+        self.assertEqual(build_operation(dm, "cleanup", {"name": "Temporary Files"})[0], sys.executable)
+        self.assertEqual(build_operation(dm, "cleanup", {"name": "Old Package Versions"})[3], "prune")
+        self.assertEqual(build_operation(dm, "mirrors", {"urls": ["https://a/$repo"]})[-2:], ["--", "https://a/$repo"])
+        for op, args in (("install", {"packages": ["--overwrite=*"]}), ("install", {"packages": []}),
+                         ("cleanup", {"name": "rm -rf /"}), ("remove", {"packages": ["vim"]}), ("exec", {}),
+                         ("mirrors", {"urls": ["file:///etc/shadow"]}), ("mirrors", {"urls": "https://a/"})):
+            with self.assertRaises(ValueError):
+                build_operation(dm, op, args)
+
+    def testpipelinedsession(self):
+        server_sock, client_sock = socket.socketpair()
+        server = HelperServer("/unused", 0, fakedistro())
+        thread = threading.Thread(target=server._handle, args=(server_sock,), daemon=True)
+        thread.start()
+
+        client = HelperClient()
+        client.sock = client_sock
+        client.wfile = client_sock.makefile("w", encoding="utf-8")
+        threading.Thread(target=client._read_events, daemon=True).start()
+
+        events = []
+        done = threading.Event()
+        def record(name):
+            def callback(event_type, data):
+                events.append((name, event_type, data))
+                if name == "last" and event_type != "progress":
+                    done.set()
+            return callback
+
+        # all three go out before the first one has finished
+        client.submit_batch([("refresh", {}, record("refresh")),
+                             ("install", {"packages": ["broken"]}, record("install")),
+                             ("install", {"packages": ["vim"]}, record("skipped"))])
+        client.submit("install", {"packages": ["-rf"]}, record("last"))
+        self.assertTrue(done.wait(10))
+
+        self.assertEqual([e for e in events if e[0] == "refresh"], [
+            ("refresh", "progress", "refreshing"),
+            ("refresh", "progress", "done"),
+            ("refresh", "finished", True),
+        ])
+        self.assertIn(("install", "error", "Command failed with code 1!"), events)
+        # the failed install stops its batch, a later request starts fresh
+        self.assertEqual([e for e in events if e[0] == "skipped"],
+                         [("skipped", "error", "Skipped, an earlier step failed or was cancelled")])
+        self.assertEqual(events[-1][:2], ("last", "error"))
+        self.assertIn("invalid package name", events[-1][2])
+
+        client.wfile.write('{"op": "shutdown"}\n')
+        client.wfile.flush()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        client_sock.close()
+
+    def testsubmittodeadhelper(self):
+        server_sock, client_sock = socket.socketpair()
+        server_sock.close()
+        client = HelperClient()
+        client.sock = client_sock
+        client.wfile = client_sock.makefile("w", encoding="utf-8")
+        client_sock.shutdown(socket.SHUT_WR)
+        events = []
+        client.submit_batch([("refresh", {}, lambda t, d: events.append(t)), ("install", {}, lambda t, d: events.append(t))])
+        self.assertEqual(events, ["error", "error"])
+        self.assertEqual(client._callbacks, {})
+        client_sock.close()
+
+if __name__ == "__main__":
+    unittest.main()
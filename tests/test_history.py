@@ -0,0 +1,99 @@
+import os
+import tempfile
+import threading
+import unittest
+from src.libinsert.devices import Device, DriverMatch
+from src.libinsert.history import HistoryStore, make_record, firmware_summary, count_changes, format_diff
+
+class fakedistro:
+    id = "arch"
+    family = "arch"
+    pkg_mgr = "pacman"
+
+def gpu(slot="03:00.0"):
+    return Device("pci", slot, "0300", "VGA", "1002", "AMD", "73bf", "Navi 21")
+
+def scan(installed, devices=None, **kinds):
+    devices = devices or [gpu()]
+    match = DriverMatch("AMD Mesa", "gpus", ["mesa", "vulkan-radeon"], devices[0])
+    match.set_installed(installed.__contains__)
+    return make_record(fakedistro(), devices, [match], len(installed), **kinds)
+
+class testhistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = HistoryStore(os.path.join(self.tmp.name, "history.sqlite"), max_bytes=0)
+        self.addCleanup(self.store.close)
+
+    def testroundtrip(self):
+        self.assertIsNone(self.store.load())
+        scan_id = self.store.record(scan({"mesa"}, orphans={"libfoo": 2048}), taken_at=100)
+        loaded = self.store.load()
+        self.assertEqual(loaded["id"], scan_id)
+        self.assertEqual(loaded["taken_at"], 100)
+        self.assertEqual(loaded["orphans"], {"libfoo": 2048})
+        match = DriverMatch.from_dict(loaded["matches"][0])
+        self.assertEqual(match.missing_packages, ["vulkan-radeon"])
+        self.assertEqual(match.device.hardware_id, "1002:73bf")
+
+    def testdiff(self):
+        self.store.record(scan({"mesa"}, orphans={"libfoo": 2048}))
+        # orphans weren't checked this time, the old list carries over
+        self.store.record(scan({"mesa", "vulkan-radeon"}, devices=[gpu(), gpu("04:00.0")]))
+        self.assertEqual(self.store.load()["orphans"], {"libfoo": 2048})
+
+        diff = self.store.diff()
+        self.assertEqual(len(diff["devices"]["added"]), 1)
+        self.assertEqual(diff["matches"]["changed"][0]["new"]["missing_packages"], [])
+        self.assertEqual(diff["orphans"], {"added": [], "removed": [], "changed": []})
+        self.assertEqual(count_changes(diff), 2)
+        self.assertIn("~ driver AMD Mesa (missing vulkan-radeon) -> AMD Mesa (installed)", format_diff(diff))
+
+        self.store.record(scan({"mesa", "vulkan-radeon"}, orphans={}))
+        self.assertEqual(self.store.diff()["orphans"]["removed"], [{"name": "libfoo", "size": 2048}])
+        self.assertEqual(format_diff(self.store.diff(2, 2)), "No changes")
+
+    def testunchangedvaluesareshared(self):
+        for _ in range(50):
+            self.store.record(scan({"mesa"}))
+        rows = self.store._db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        self.assertEqual(rows, 2)
+        self.assertEqual(len(self.store.scans(limit=100)), 50)
+
+    def testconcurrentwriters(self):
+        # the GUI and the service each have their own connection to the same file
+        other = HistoryStore(self.store.path, max_bytes=0)
+        self.addCleanup(other.close)
+        def record(store):
+            for _ in range(20):
+                store.record(scan({"mesa"}))
+        threads = [threading.Thread(target=record, args=(s,)) for s in (self.store, other)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # every scan still sees exactly its one device and match, nothing extended twice or dropped
+        for entry in self.store.scans(limit=100):
+            loaded = self.store.load(entry["id"])
+            self.assertEqual((len(loaded["devices"]), len(loaded["matches"])), (1, 1))
+        self.assertEqual(len(self.store.scans(limit=100)), 40)
+
+    def testprune(self):
+        self.store.max_bytes = 64 * 1024
+        for i in range(200):
+            # a changing orphan list so every scan adds rows
+            self.store.record(scan({"mesa"}, orphans={f"pkg-{i}-{n}": n for n in range(20)}))
+        self.assertLessEqual(self.store.size(), 64 * 1024)
+        latest = self.store.load()
+        self.assertEqual(len(latest["orphans"]), 20)
+        self.assertEqual(len(latest["matches"]), 1)
+        self.assertLess(len(self.store.scans(limit=1000)), 200)
+
+    def testfirmwaresummary(self):
+        fw = {"Devices": [{"Name": "UEFI dbx", "Version": "217", "Releases": [{"Version": "371"}]}]}
+        self.assertEqual(firmware_summary(fw), [{"device": "UEFI dbx", "version": "217", "update": "371"}])
+        self.assertEqual(firmware_summary(None), [])
+
+if __name__ == "__main__":
+    unittest.main()
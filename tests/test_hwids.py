@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from src.libinsert.hwids import IdsFile, HardwareNames
+
+PCI_IDS = """# pci.ids excerpt
+10de  NVIDIA Corporation
+\t2484  GA104 [GeForce RTX 3070 LHR]
+\t\t1458 4082  GeForce RTX 3070 Gaming OC
+1002  Advanced Micro Devices, Inc. [AMD/ATI]
+\t73bf  Navi 21 [Radeon RX 6800/6800 XT / 6900 XT]
+1458  Gigabyte Technology Co., Ltd
+
+C 03  Display controller
+\t00  VGA compatible controller
+\t\t00  VGA controller
+\t02  3D controller
+"""
+
+USB_IDS = """046d  Logitech, Inc.
+\tc52b  Unifying Receiver
+C 03  Human Interface Device
+R 00  Undefined
+\t01  should not become a Logitech device
+"""
+
+def write_ids(root, name, text):
+    path = os.path.join(root, "usr/share/hwdata", name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+class testhwids(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        self.cache = os.path.join(self.root, "cache")
+        self.pci_path = write_ids(self.root, "pci.ids", PCI_IDS)
+        write_ids(self.root, "usb.ids", USB_IDS)
+
+    def testlookups(self):
+        ids = IdsFile(self.pci_path, cache_dir=None)
+        self.addCleanup(ids.close)
+        self.assertEqual(ids.vendor("10de"), "NVIDIA Corporation")
+        self.assertEqual(ids.device("10de", "2484"), "GA104 [GeForce RTX 3070 LHR]")
+        self.assertEqual(ids.device(0x1002, 0x73bf), "Navi 21 [Radeon RX 6800/6800 XT / 6900 XT]")
+        self.assertEqual(ids.device_class("0300"), "VGA compatible controller")
+        self.assertEqual(ids.device_class("0380"), "Display controller")
+        self.assertIsNone(ids.vendor("8086"))
+        self.assertIsNone(ids.device("10de", "4082"))
+
+    def testcachedindex(self):
+        first = IdsFile(self.pci_path, self.cache)
+        self.assertEqual(first.vendor("1458"), "Gigabyte Technology Co., Ltd")
+        first.close()
+        self.assertEqual(len(os.listdir(self.cache)), 1)
+
+        cached = IdsFile(self.pci_path, self.cache)
+        self.addCleanup(cached.close)
+        self.assertEqual(cached.device("10de", "2484"), "GA104 [GeForce RTX 3070 LHR]")
+        # served from the mapped cache, not rebuilt
+        self.assertIsInstance(cached._keys, memoryview)
+
+        # a changed ids file invalidates it
+        with open(self.pci_path, "a") as f:
+            f.write("8086  Intel Corporation\n")
+        fresh = IdsFile(self.pci_path, self.cache)
+        self.addCleanup(fresh.close)
+        self.assertEqual(fresh.vendor("8086"), "Intel Corporation")
+
+    def testhardwarenames(self):
+        names = HardwareNames(self.root, cache_dir=None)
+        self.addCleanup(names.close)
+        self.assertEqual(names.device("usb", "046d", "c52b"), "Unifying Receiver")
+        self.assertIsNone(names.device("usb", "046d", "0001"))
+        self.assertEqual(names.pci_class("0302"), "3D controller")
+        self.assertIsNone(names.vendor("pci", None))
+        self.assertIsNone(HardwareNames(os.path.join(self.root, "empty")).vendor("pci", "10de"))
+
+if __name__ == "__main__":
+    unittest.main()
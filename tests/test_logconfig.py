@@ -0,0 +1,29 @@
+import os
+import gzip
+import logging
+import tempfile
+import unittest
+from src.libinsert.logconfig import parse_levels, make_file_handler
+
+class testlogconfig(unittest.TestCase):
+    def testparselevels(self):
+        levels = parse_levels("TaskWorker=debug, SysProbe=WARNING,bogus,DistroManager=nope")
+        self.assertEqual(levels, {"TaskWorker": logging.DEBUG, "SysProbe": logging.WARNING})
+
+    def testrotationcompresses(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "insert.log")
+            handler = make_file_handler(path, max_bytes=200, backup_count=2)
+            log = logging.getLogger("test-rotation")
+            log.propagate = False
+            log.addHandler(handler)
+            for i in range(50):
+                log.warning(f"line number {i} with some padding to fill the file")
+            handler.close()
+            self.assertTrue(os.path.exists(path + ".1.gz"))
+            self.assertFalse(os.path.exists(path + ".3.gz"))
+            with gzip.open(path + ".1.gz", "rt") as f:
+                self.assertIn("line number", f.read())
+
+if __name__ == "__main__":
+    unittest.main()
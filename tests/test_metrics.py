@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+from src.libinsert.devices import Device, DriverMatch
+from src.libinsert.metrics import MetricsFile, record_matches, record_transaction, collect_scan
+
+def match(category, packages, installed, state=None):
+    m = DriverMatch(f"{category} driver", category, packages, Device("pci", "00:01.0"))
+    m.set_installed(lambda p: p in installed)
+    m.state = state
+    return m
+
+class fakedistro:
+    family = "arch"
+
+    def get_installed_packages(self):
+        return ["mesa"]
+
+    def is_package_installed(self, package):
+        return package == "mesa"
+
+    def get_orphans(self):
+        return ["libfoo", "libbar"]
+
+    def get_cleanup_tasks(self):
+        return [{"name": "Package Cache", "reclaimable": 1024}, {"name": "Logs"}]
+
+class fakeprobe:
+    def scan_devices(self):
+        return []
+
+    def match_devices(self, family, devices):
+        return [match("gpu", ["mesa"], set()), match("wifi", ["broadcom-wl"], set())]
+
+    def check_bindings(self, matches):
+        return matches
+
+    def get_firmware_updates(self):
+        return {"Devices": [{"Name": "UEFI"}]}
+
+class testmetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testrender(self):
+        metrics = MetricsFile(self.tmp.name)
+        metrics.set("insert_orphan_packages", 3, help="Orphans.")
+        metrics.set("insert_reclaimable_bytes", 2.5, {"task": 'Old "Package" Versions'})
+        text = metrics.render()
+        self.assertIn("# HELP insert_orphan_packages Orphans.\n# TYPE insert_orphan_packages gauge\ninsert_orphan_packages 3\n", text)
+        self.assertIn('insert_reclaimable_bytes{task="Old \\"Package\\" Versions"} 2.5', text)
+
+    def testatomicwriteandreload(self):
+        metrics = MetricsFile(self.tmp.name)
+        record_transaction(metrics, "install", True, 1.5)
+        self.assertEqual(metrics.write(), os.path.join(self.tmp.name, "insert.prom"))
+        # nothing but the finished file is left behind
+        self.assertEqual(os.listdir(self.tmp.name), ["insert.prom"])
+
+        again = MetricsFile(self.tmp.name)
+        record_transaction(again, "install", False, 0.5)
+        again.write()
+        reloaded = MetricsFile(self.tmp.name)
+        self.assertEqual(reloaded.get("insert_transactions_total", {"op": "install", "result": "success"}), 1)
+        self.assertEqual(reloaded.get("insert_transactions_total", {"op": "install", "result": "failure"}), 1)
+        self.assertEqual(reloaded.get("insert_transaction_last_success", {"op": "install"}), 0)
+        self.assertIn("# TYPE insert_transactions_total counter", reloaded.render())
+
+    def testmissingdrivers(self):
+        metrics = MetricsFile(self.tmp.name)
+        record_matches(metrics, [match("gpu", ["mesa"], set()), match("wifi", ["wl"], {"wl"}, "inactive")])
+        self.assertEqual(metrics.get("insert_missing_drivers", {"category": "gpu"}), 1)
+        self.assertEqual(metrics.get("insert_missing_drivers", {"category": "wifi"}), 0)
+        self.assertEqual(metrics.get("insert_inactive_drivers"), 1)
+
+        # categories that disappear from the scan do not linger
+        record_matches(metrics, [])
+        self.assertIsNone(metrics.get("insert_missing_drivers", {"category": "gpu"}))
+
+    def testcollectscan(self):
+        metrics = MetricsFile(self.tmp.name)
+        collect_scan(metrics, fakedistro(), fakeprobe())
+        self.assertEqual(metrics.get("insert_missing_drivers", {"category": "wifi"}), 1)
+        self.assertEqual(metrics.get("insert_missing_drivers", {"category": "gpu"}), 0)
+        self.assertEqual(metrics.get("insert_orphan_packages"), 2)
+        self.assertEqual(metrics.get("insert_reclaimable_bytes", {"task": "Package Cache"}), 1024)
+        self.assertEqual(metrics.get("insert_firmware_updates_pending"), 1)
+        for phase in ("devices", "match", "installed", "bindings", "orphans", "firmware"):
+            self.assertIsNotNone(metrics.get("insert_scan_phase_duration_seconds", {"phase": phase}))
+
+    def testnowheretowrite(self):
+        self.assertIsNone(MetricsFile(directory="").write())
+        self.assertIsNone(MetricsFile(os.path.join(self.tmp.name, "missing")).write())
+
+if __name__ == "__main__":
+    unittest.main()
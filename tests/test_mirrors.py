@@ -0,0 +1,134 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from src.libinsert.mirrors import (pacman_candidates, apt_candidates, rank_mirrors, reorder_pacman_mirrorlist,
+                                   reorder_apt_sources, apply_mirrors, proposal, MirrorResult, BACKUP_SUFFIX)
+
+BODY = b"x" * 128 * 1024
+
+class standin(BaseHTTPRequestHandler):
+    """Mirror stand-in, `delay` seconds before answering, counts requests in flight."""
+    delay = 0.0
+    status = 200
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            standin.active += 1
+            standin.peak = max(standin.peak, standin.active)
+        try:
+            time.sleep(cls.delay)
+            self.send_response(cls.status)
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+        finally:
+            with cls.lock:
+                standin.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+def serve(delay=0.0, status=200):
+    handler = type("handler", (standin,), {"delay": delay, "status": status})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+class testmirrors(unittest.TestCase):
+    def setUp(self):
+        standin.peak = 0
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def start(self, **kwargs):
+        server, url = serve(**kwargs)
+        self.servers.append(server)
+        return url
+
+    def testcandidates(self):
+        text = "## Germany\nServer = https://a.example/$repo/os/$arch\n#Server = https://b.example/$repo/os/$arch\n"
+        mirrors = pacman_candidates(text, arch="x86_64")
+        self.assertEqual([m.url for m in mirrors], ["https://a.example/$repo/os/$arch", "https://b.example/$repo/os/$arch"])
+        self.assertEqual(mirrors[0].probe_url, "https://a.example/core/os/x86_64/core.db")
+
+        sources = "deb [arch=amd64] http://deb.example/debian bookworm main\ndeb-src http://deb.example/debian bookworm main\n# deb http://old.example/ x y\n"
+        mirrors = apt_candidates(sources)
+        self.assertEqual([m.url for m in mirrors], ["http://deb.example/debian"])
+        self.assertEqual(mirrors[0].probe_url, "http://deb.example/debian/dists/bookworm/InRelease")
+
+    def testrankagainstlocalservers(self):
+        slow = self.start(delay=0.4)
+        fast = self.start()
+        missing = self.start(status=404)
+        text = "\n".join(f"Server = {url}/$repo/os/$arch" for url in (slow, missing, fast))
+        text += "\nServer = http://127.0.0.1:1/$repo/os/$arch\n"
+        ranked = rank_mirrors(pacman_candidates(text, arch="x86_64"), timeout=3)
+
+        self.assertEqual([r.url.split("/$repo")[0] for r in ranked[:2]], [fast, slow])
+        self.assertTrue(ranked[0].ok)
+        self.assertGreater(ranked[1].latency, ranked[0].latency)
+        self.assertGreater(ranked[0].throughput, 0)
+        self.assertFalse(any(r.ok for r in ranked[2:]))
+        self.assertIn("HTTP 404", [r.error for r in ranked[2:]])
+
+    def testboundedconcurrency(self):
+        url = self.start(delay=0.2)
+        text = "\n".join(f"Server = {url}/{i}/$repo" for i in range(6))
+        ranked = rank_mirrors(pacman_candidates(text), concurrency=2, timeout=5)
+        self.assertTrue(all(r.ok for r in ranked))
+        self.assertLessEqual(standin.peak, 2)
+
+    def testtimeout(self):
+        url = self.start(delay=1.0)
+        ranked = rank_mirrors(pacman_candidates(f"Server = {url}/$repo\n"), timeout=0.2)
+        self.assertEqual(ranked[0].error, "timed out")
+
+    def testreorder(self):
+        text = "Server = https://a/$repo\n#Server = https://b/$repo\nServer = https://c/$repo\n"
+        out = reorder_pacman_mirrorlist(text, ["https://b/$repo", "https://a/$repo"])
+        servers = [line for line in out.splitlines() if line.startswith("Server")]
+        self.assertEqual(servers, ["Server = https://b/$repo", "Server = https://a/$repo", "Server = https://c/$repo"])
+
+        sources = "# main\ndeb http://a/ x main\ndeb-src http://a/ x main\ndeb http://b/ x main\n"
+        out = reorder_apt_sources(sources, ["http://b/"])
+        self.assertEqual(out.splitlines(), ["# main", "deb http://b/ x main", "deb http://a/ x main", "deb-src http://a/ x main"])
+
+    def testproposalkeepsthecut(self):
+        ranked = [MirrorResult(f"https://{name}/$repo", "https") for name in "abcd"]
+        for result, elapsed in zip(ranked, (0.1, 0.2, 0.3, None)):
+            result.elapsed = elapsed
+            if elapsed is None:
+                result.error = "timed out"
+        text = "Server = https://a/$repo\n#Server = https://c/$repo\n#Server = https://b/$repo\nServer = https://d/$repo\n"
+        fastest = proposal(ranked, count=2)
+        self.assertEqual([r.url for r in fastest], ["https://a/$repo", "https://b/$repo"])
+        out = reorder_pacman_mirrorlist(text, [r.url for r in fastest])
+        # c answered too but ranks below the cut, so it stays commented
+        self.assertEqual(out.splitlines()[1:], ["Server = https://a/$repo", "Server = https://b/$repo", "",
+                                                "#Server = https://c/$repo", "Server = https://d/$repo"])
+
+    def testapplyonlyknownmirrors(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "mirrorlist")
+            with open(path, "w") as f:
+                f.write("Server = https://a/$repo\n#Server = https://b/$repo\n")
+            with self.assertRaises(ValueError):
+                apply_mirrors("pacman", ["https://evil/$repo"], path)
+            apply_mirrors("pacman", ["https://b/$repo"], path)
+            with open(path) as f:
+                self.assertIn("Server = https://b/$repo\n", f.read())
+            self.assertTrue(os.path.exists(path + BACKUP_SUFFIX))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import time
+import tempfile
+import unittest
+from src.libinsert.pkgcache import (
+    pacman_vercmp, evr_compare, dpkg_compare, parse_package_filename, plan_prune, prune_cache
+)
+
+class testpkgcache(unittest.TestCase):
+    def testpacmanvercmp(self):
+        self.assertEqual(pacman_vercmp("1.0-1", "1.0-1"), 0)
+        self.assertEqual(pacman_vercmp("1.10-1", "1.9-1"), 1)
+        self.assertEqual(pacman_vercmp("1.0-2", "1.0-10"), -1)
+        self.assertEqual(pacman_vercmp("1:0.5-1", "2.0-1"), 1)
+        self.assertEqual(pacman_vercmp("1.0a-1", "1.0-1"), -1)
+        self.assertEqual(pacman_vercmp("1.0.a", "1.0"), 1)
+        self.assertEqual(pacman_vercmp("1.0", "1.0.a"), -1)
+        self.assertEqual(pacman_vercmp("1.0", "1.0rc1"), 1)
+        self.assertEqual(pacman_vercmp("1.0.1-1", "1.0-1"), 1)
+
+    def testrpmcompare(self):
+        self.assertEqual(evr_compare("1.0a-1", "1.0-1"), 1)
+        self.assertEqual(evr_compare("2.1-3.fc40", "2.1-12.fc40"), -1)
+
+    def testdpkgcompare(self):
+        self.assertEqual(dpkg_compare("1.0~rc1-1", "1.0-1"), -1)
+        self.assertEqual(dpkg_compare("1:1.0-1", "2.0-1"), 1)
+        self.assertEqual(dpkg_compare("2.30-1ubuntu1", "2.30-1"), 1)
+        self.assertEqual(dpkg_compare("1.0+dfsg-1", "1.0-1"), 1)
+        self.assertEqual(dpkg_compare("1.01", "1.1"), 0)
+
+    def testparsefilenames(self):
+        self.assertEqual(parse_package_filename("pacman", "linux-firmware-20240312.3f3e8d1-1-any.pkg.tar.zst"), ("linux-firmware", "20240312.3f3e8d1-1", "any"))
+        self.assertEqual(parse_package_filename("apt", "libc6_2.35-0ubuntu3%3a1_amd64.deb"), ("libc6", "2.35-0ubuntu3:1", "amd64"))
+        self.assertEqual(parse_package_filename("dnf", "mesa-dri-drivers-24.0.5-1.fc40.x86_64.rpm"), ("mesa-dri-drivers", "24.0.5-1.fc40", "x86_64"))
+        self.assertIsNone(parse_package_filename("pacman", "pacman.db.lck"))
+
+    def testplanprune(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            names = [f"mesa-24.{minor}.0-1-x86_64.pkg.tar.zst" for minor in (1, 2, 10, 9)]
+            names += ["mesa-24.1.0-1-x86_64.pkg.tar.zst.sig", "nvidia-550.1-1-x86_64.pkg.tar.zst"]
+            for name in names:
+                with open(os.path.join(tmp, name), "wb") as f:
+                    f.write(b"x" * 10)
+
+            paths, freed = plan_prune("pacman", [tmp], keep=2)
+            self.assertEqual(sorted(os.path.basename(p) for p in paths), [
+                "mesa-24.1.0-1-x86_64.pkg.tar.zst",
+                "mesa-24.1.0-1-x86_64.pkg.tar.zst.sig",
+                "mesa-24.2.0-1-x86_64.pkg.tar.zst",
+            ])
+            self.assertEqual(freed, 20)
+
+    def testprunecache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for ver in range(5):
+                open(os.path.join(tmp, f"mesa-24.{ver}.0-1-x86_64.pkg.tar.zst"), "w").close()
+            self.assertEqual(prune_cache("pacman", [tmp], keep=2), (3, 0))
+            self.assertEqual(sorted(os.listdir(tmp)), ["mesa-24.3.0-1-x86_64.pkg.tar.zst", "mesa-24.4.0-1-x86_64.pkg.tar.zst"])
+            self.assertEqual(prune_cache("pacman", [tmp], keep=2), (0, 0))
+
+    def testplanprunelargecache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for pkg in range(2000):
+                for ver in range(10):
+                    open(os.path.join(tmp, f"pkg{pkg}-1.{ver}-1-x86_64.pkg.tar.zst"), "w").close()
+            start = time.monotonic()
+            paths, _ = plan_prune("pacman", [tmp], keep=3)
+            self.assertEqual(len(paths), 2000 * 7)
+            self.assertLess(time.monotonic() - start, 5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import io
+import os
+import gzip
+import tarfile
+import tempfile
+import unittest
+from src.libinsert.pkgindex import PackageIndex, build_index
+
+APT_PACKAGES = """Package: btop
+Version: 1.2.13-1
+Description: Modern and colorful command line resource monitor
+ Longer text that should not be indexed.
+
+Package: htop
+Version: 3.2.2-2
+Description: interactive processes viewer
+
+Package: 7zip
+Version: 23.01
+Provides: p7zip (= 16.02), p7zip-full
+Description: 7-Zip file archiver with a high compression ratio
+
+Package: python3-btrfs
+Version: 13-1
+Description: Python library for btrfs
+"""
+
+PRIMARY_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="1">
+<package type="rpm"><name>mpv</name><summary>Movie player playing most video formats and DVDs</summary>
+<format><rpm:provides><rpm:entry name="mpv-player"/><rpm:entry name="libmpv.so.2()(64bit)"/><rpm:entry name="/usr/bin/mpv"/></rpm:provides></format></package>
+</metadata>
+"""
+
+def add_tar_file(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+class testpkgindex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testapt(self):
+        lists = os.path.join(self.root, "var/lib/apt/lists")
+        os.makedirs(lists)
+        with open(os.path.join(lists, "deb.debian.org_debian_dists_bookworm_main_binary-amd64_Packages"), "w") as f:
+            f.write(APT_PACKAGES)
+        index = build_index("apt", self.root)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.provides, {"p7zip": ["7zip"], "p7zip-full": ["7zip"]})
+        self.assertEqual(index.get("btop")["description"], "Modern and colorful command line resource monitor")
+        self.assertEqual([p["name"] for p in index.search("bt")], ["btop"])
+        # prefix hit first, then substring hits on the name, then description-only ones
+        self.assertEqual([p["name"] for p in index.search("btr")], ["python3-btrfs"])
+        self.assertEqual([p["name"] for p in index.search("monitor")], ["btop"])
+        self.assertEqual(index.search("nothing-like-this"), [])
+
+    def testpacman(self):
+        sync = os.path.join(self.root, "var/lib/pacman/sync")
+        os.makedirs(sync)
+        with tarfile.open(os.path.join(sync, "extra.db"), "w:gz") as tar:
+            add_tar_file(tar, "fastfetch-2.8.10-1/desc", b"%NAME%\nfastfetch\n\n%VERSION%\n2.8.10-1\n\n%DESC%\nLike neofetch, but much faster\n")
+            add_tar_file(tar, "cava-0.10.1-1/desc", b"%NAME%\ncava\n\n%DESC%\nConsole-based Audio Visualizer for Alsa\n")
+            add_tar_file(tar, "7zip-24.08-1/desc", b"%NAME%\n7zip\n\n%PROVIDES%\np7zip=24.08\n\n%REPLACES%\np7zip\n")
+        index = build_index("pacman", self.root)
+        self.assertIn("cava", index)
+        self.assertEqual(index.get("fastfetch")["repo"], "extra")
+        self.assertEqual(index.provides["p7zip"], ["7zip"])
+        self.assertEqual([p["name"] for p in index.search("neofetch")], ["fastfetch"])
+
+    def testdnf(self):
+        repodata = os.path.join(self.root, "var/cache/dnf/fedora-abc123/repodata")
+        os.makedirs(repodata)
+        with gzip.open(os.path.join(repodata, "deadbeef-primary.xml.gz"), "wt") as f:
+            f.write(PRIMARY_XML)
+        index = build_index("dnf", self.root)
+        self.assertEqual(index.get("mpv")["repo"], "fedora-abc123")
+        # sonames and paths are left out
+        self.assertEqual(index.provides, {"mpv-player": ["mpv"]})
+
+    def testmanypackages(self):
+        index = PackageIndex()
+        for i in range(20000):
+            index.add(f"pkg{i}", f"description number {i}")
+        index.finish()
+        self.assertEqual(len(index.search("pkg1", limit=10)), 10)
+        self.assertEqual(index.search("number 19999")[0]["name"], "pkg19999")
+
+if __name__ == "__main__":
+    unittest.main()
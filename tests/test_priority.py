@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+from src.libinsert.priority import background_command, resolve_mode, ThrottleMonitor
+from src.libinsert.helper import build_operation
+from src.libinsert.runner import run
+
+class fakedistro:
+    def refresh_database(self, accelerate=False):
+        return ["pkexec", "pacman", "-Sy"]
+
+def which(name):
+    return f"/usr/bin/{name}"
+
+class testpriority(unittest.TestCase):
+    @patch("src.libinsert.priority.shutil.which", which)
+    def testnice(self):
+        self.assertEqual(background_command(["pacman", "-Sy"], "nice"),
+                         ["nice", "-n", "19", "ionice", "-c", "2", "-n", "7", "pacman", "-Sy"])
+        self.assertEqual(background_command(["pacman", "-Sy"], "off"), ["pacman", "-Sy"])
+
+    @patch("src.libinsert.priority.shutil.which", which)
+    @patch("src.libinsert.priority.os.path.isdir", lambda path: True)
+    def testsystemdkeepspkexecfirst(self):
+        cmd = background_command(["pkexec", "fwupdmgr", "refresh"], "auto")
+        self.assertEqual(cmd[:3], ["pkexec", "systemd-run", "--scope"])
+        self.assertIn("CPUWeight=20", cmd)
+        self.assertEqual(cmd[-7:], ["ionice", "-c", "2", "-n", "7", "fwupdmgr", "refresh"])
+        self.assertEqual(resolve_mode("auto", privileged=False), "nice")
+
+    @patch("src.libinsert.priority.shutil.which", which)
+    def testbuildoperation(self):
+        dm = fakedistro()
+        self.assertEqual(build_operation(dm, "refresh", {}), ["pkexec", "pacman", "-Sy"])
+        self.assertEqual(build_operation(dm, "refresh", {"background": True, "priority": "nice"})[:4],
+                         ["pkexec", "nice", "-n", "19"])
+        with self.assertRaises(ValueError):
+            build_operation(dm, "refresh", {"background": True, "priority": "rm -rf /"})
+
+    @unittest.skipUnless(os.path.exists("/proc/self/schedstat"), "needs schedstat")
+    def testmeasurethrottle(self):
+        result = run([sys.executable, "-c", "import time; time.sleep(0.6)"], measure_throttle=True)
+        self.assertTrue(result.ok)
+        self.assertGreaterEqual(result.throttled_time, 0.0)
+        self.assertLess(result.throttled_time, result.wall_time + 1)
+        monitor = ThrottleMonitor(os.getpgrp())
+        monitor.sample()
+        self.assertGreaterEqual(monitor.throttled, 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.libinsert.pkgindex import PackageIndex
+from src.libinsert.resolver import Resolver, build_resolver, load_provides
+from tests.test_pkgindex import add_tar_file
+
+ALIASES = {
+    "p7zip": {"arch": ["7zip", "p7zip"], "debian": ["7zip", "p7zip-full"]},
+    "development-tools": {"arch": ["base-devel"], "fedora": ["@development-tools"]},
+}
+GROUPS = {"@development-tools": ["gcc", "make"]}
+
+class fakedistro:
+    family = "arch"
+    pkg_mgr = "pacman"
+
+    def get_installed_packages(self):
+        return ["base-devel"]
+
+class testresolver(unittest.TestCase):
+    def testresolve(self):
+        resolver = Resolver("debian", "apt", {"7zip", "htop"}, {"p7zip-full": ["7zip"]}, ["htop"], ALIASES, GROUPS)
+        self.assertEqual(resolver.resolve("p7zip"), "7zip")
+        self.assertFalse(resolver.is_installed("p7zip"))
+        self.assertTrue(resolver.is_installed("htop"))
+        self.assertIsNone(resolver.resolve("not-a-package"))
+        # other families' names are tried too, but apt can't install a dnf group
+        self.assertIsNone(resolver.resolve("development-tools"))
+
+        resolver.update_installed(["htop", "7zip"])
+        self.assertTrue(resolver.is_installed("p7zip"))
+
+    def testinstalledprovider(self):
+        # the repos only know the new name, the system has the old one that provides the logical name
+        resolver = Resolver("suse", "zypper", {"7zip"}, {"p7zip": ["p7zip-full"]}, ["p7zip-full"], ALIASES, GROUPS)
+        self.assertEqual(resolver.resolve("p7zip"), "p7zip-full")
+        self.assertTrue(resolver.is_installed("p7zip"))
+
+    def testgroups(self):
+        resolver = Resolver("fedora", "dnf", {"gcc", "make"}, {}, ["gcc"], ALIASES, GROUPS)
+        self.assertEqual(resolver.resolve("development-tools"), "@development-tools")
+        self.assertFalse(resolver.is_installed("development-tools"))
+        resolver.update_installed(["gcc", "make"])
+        self.assertTrue(resolver.is_installed("development-tools"))
+
+    def testnometadata(self):
+        resolver = Resolver("arch", "pacman", set(), {}, [], ALIASES, GROUPS)
+        self.assertEqual(resolver.resolve("cava"), "cava")
+
+    def testdiskcache(self):
+        with tempfile.TemporaryDirectory() as root:
+            sync = os.path.join(root, "var/lib/pacman/sync")
+            os.makedirs(sync)
+            db = os.path.join(sync, "extra.db")
+            with tarfile.open(db, "w:gz") as tar:
+                add_tar_file(tar, "7zip-24.08-1/desc", b"%NAME%\n7zip\n\n%PROVIDES%\np7zip=24.08\n")
+            cache = os.path.join(root, "cache")
+            names, provides = load_provides("pacman", root, cache)
+            self.assertEqual((names, provides), ({"7zip"}, {"p7zip": ["7zip"]}))
+            self.assertTrue(os.path.exists(os.path.join(cache, "provides-pacman.json")))
+
+            with patch("src.libinsert.resolver.build_index", return_value=PackageIndex().finish()) as build:
+                self.assertEqual(load_provides("pacman", root, cache), (names, provides))
+                build.assert_not_called()
+                # a refreshed sync db invalidates it
+                os.utime(db, ns=(0, 0))
+                load_provides("pacman", root, cache)
+                build.assert_called_once()
+
+            os.remove(os.path.join(cache, "provides-pacman.json"))
+            resolver = build_resolver(fakedistro(), root=root, cache_dir=cache)
+            self.assertEqual(resolver.resolve("p7zip"), "7zip")
+            self.assertTrue(resolver.is_installed("development-tools"))
+
+if __name__ == "__main__":
+    unittest.main()
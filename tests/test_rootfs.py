@@ -0,0 +1,86 @@
+import os
+import struct
+import sqlite3
+import tempfile
+import unittest
+from src.libinsert.rootfs import resolve, read_os_release, read_installed, parse_rpm_header, RPMTAG_NAME, RPMTAG_PROVIDENAME
+from src.libinsert.distro import DistroManager
+
+def write(root, path, text):
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+def rpm_header(name, provides):
+    # (tag, type, values), the same layout rpm keeps in rpmdb.sqlite
+    entries = [(RPMTAG_NAME, 6, [name]), (RPMTAG_PROVIDENAME, 8, provides)]
+    index, data = b"", b""
+    for tag, kind, values in entries:
+        index += struct.pack(">iiii", tag, kind, len(data), len(values))
+        data += b"".join(v.encode() + b"\0" for v in values)
+    return struct.pack(">ii", len(entries), len(data)) + index + data
+
+class testrootfs(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+
+    def testsymlinksstayinroot(self):
+        write(self.root, "usr/lib/os-release", "ID=fedora\n")
+        os.makedirs(os.path.join(self.root, "etc"))
+        # absolute, like some images ship it, must not read the host's file
+        os.symlink("/usr/lib/os-release", os.path.join(self.root, "etc/os-release"))
+        self.assertEqual(resolve(self.root, "etc/os-release"), os.path.join(self.root, "usr/lib/os-release"))
+        self.assertEqual(resolve(self.root, "../../etc/passwd"), os.path.join(self.root, "etc/passwd"))
+        self.assertEqual(read_os_release(self.root), "ID=fedora\n")
+
+    def testpacman(self):
+        write(self.root, "var/lib/pacman/local/ALPM_DB_VERSION", "9\n")
+        write(self.root, "var/lib/pacman/local/7zip-24.08-1/desc",
+              "%NAME%\n7zip\n\n%VERSION%\n24.08-1\n\n%PROVIDES%\np7zip=24.08\nlibfoo.so=1-64\n\n")
+        names, provides = read_installed("pacman", self.root)
+        self.assertEqual(names, {"7zip"})
+        self.assertEqual(provides["p7zip"], ["7zip"])
+
+    def testdpkg(self):
+        write(self.root, "var/lib/dpkg/status",
+              "Package: vim\nStatus: install ok installed\nProvides: editor\n\n"
+              "Package: nano\nStatus: deinstall ok config-files\n\n")
+        names, provides = read_installed("apt", self.root)
+        self.assertEqual(names, {"vim"})
+        self.assertEqual(provides, {"editor": ["vim"]})
+
+    def testrpmdb(self):
+        path = os.path.join(self.root, "usr/lib/sysimage/rpm/rpmdb.sqlite")
+        os.makedirs(os.path.dirname(path))
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE Packages (hnum INTEGER PRIMARY KEY AUTOINCREMENT, blob BLOB NOT NULL)")
+        db.execute("INSERT INTO Packages (blob) VALUES (?)", (rpm_header("p7zip", ["p7zip", "7zip = 16.02", "/usr/bin/7za"]),))
+        db.execute("INSERT INTO Packages (blob) VALUES (?)", (b"\0\0",))
+        db.commit()
+        db.close()
+        self.assertEqual(parse_rpm_header(rpm_header("a", ["b"]))[RPMTAG_PROVIDENAME], ["b"])
+        names, provides = read_installed("dnf", self.root)
+        self.assertEqual(names, {"p7zip"})
+        self.assertEqual(provides, {"7zip": ["p7zip"]})
+
+    def testapk(self):
+        write(self.root, "lib/apk/db/installed", "C:Q1abc\nP:busybox\nV:1.36\np:cmd:sh /bin/sh\n\nP:musl\n")
+        self.assertEqual(read_installed("apk", self.root)[0], {"busybox", "musl"})
+
+    def testdistromanager(self):
+        write(self.root, "etc/os-release", 'ID="arch"\n')
+        write(self.root, "var/lib/pacman/local/mesa-1-1/desc", "%NAME%\nmesa\n")
+        dm = DistroManager(self.root)
+        self.assertEqual((dm.id, dm.family, dm.pkg_mgr), ("arch", "arch", "pacman"))
+        self.assertEqual(dm.get_installed_packages(), ["mesa"])
+        self.assertTrue(dm.is_package_installed("mesa"))
+        # never touches the host
+        self.assertEqual(dm.get_install_command(["vim"]), [])
+        self.assertEqual(dm.get_cleanup_tasks(), [])
+        self.assertIsNone(read_installed("dnf", self.root))
+
+if __name__ == "__main__":
+    unittest.main()
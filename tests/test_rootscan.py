@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+from src.libinsert.devices import parse_devices
+from src.libinsert.rootscan import scan_roots, format_results
+
+NVIDIA_GPU = '01:00.0 "VGA compatible controller [0300]" "NVIDIA Corporation [10de]" "GA104 [GeForce RTX 3070 LHR] [2484]" -ra1 "Gigabyte Technology Co., Ltd [1458]" "Device [4082]"'
+
+def write(root, path, text):
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+class testrootscan(unittest.TestCase):
+    def testparallelroots(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            arch = os.path.join(tmp, "arch")
+            write(arch, "etc/os-release", "ID=arch\n")
+            for name in ("nvidia", "nvidia-utils", "lib32-nvidia-utils", "7zip"):
+                write(arch, f"var/lib/pacman/local/{name}-1-1/desc", f"%NAME%\n{name}\n")
+            debian = os.path.join(tmp, "debian")
+            write(debian, "etc/os-release", "ID=debian\n")
+            write(debian, "var/lib/dpkg/status", "Package: htop\nStatus: install ok installed\n\n")
+            empty = os.path.join(tmp, "empty")
+            os.makedirs(empty)
+
+            results = scan_roots([arch, debian, empty], parse_devices([NVIDIA_GPU]), db_path="data/drivers.json", jobs=2)
+            self.assertEqual([r["root"] for r in results], [arch, debian, empty])
+            self.assertEqual(results[0]["installed_count"], 4)
+            nvidia = [m for m in results[0]["matches"] if m["driver_name"] == "Nvidia Proprietary Drivers"]
+            self.assertTrue(nvidia and nvidia[0]["is_installed"])
+            # p7zip is 7zip on arch
+            self.assertNotIn("p7zip", results[0]["missing_essentials"])
+            self.assertNotIn("htop", results[1]["missing_essentials"])
+            self.assertIn("neovim", results[1]["missing_essentials"])
+            self.assertEqual(results[2]["error"], "no os-release found")
+            self.assertIn("essentials missing", format_results(results))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import sys
+import time
+import threading
+import unittest
+from src.libinsert.runner import run, CommandStats, STATS
+
+class testrunner(unittest.TestCase):
+    def testcaptureandusage(self):
+        result = run([sys.executable, "-c", "import sys; print('out'); print('err', file=sys.stderr); sum(range(10**6))"])
+        self.assertTrue(result.ok)
+        self.assertEqual(result.stdout, "out\n")
+        self.assertEqual(result.stderr, "err\n")
+        self.assertGreater(result.max_rss_kb, 0)
+        self.assertGreater(result.wall_time, 0)
+
+    def teststreaming(self):
+        lines = []
+        result = run([sys.executable, "-c", "print('a'); print('b')"], on_line=lines.append, capture=False, merge_stderr=True)
+        self.assertEqual(lines, ["a", "b"])
+        self.assertEqual(result.stdout, "")
+
+    def testtimeoutkillsgroup(self):
+        # the grandchild holds stdout open, only a group kill ends this quickly
+        script = "import subprocess, sys, time; subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)']); time.sleep(30)"
+        start = time.monotonic()
+        result = run([sys.executable, "-c", script], timeout=0.5)
+        self.assertTrue(result.timed_out)
+        self.assertFalse(result.ok)
+        self.assertLess(time.monotonic() - start, 10)
+
+    def testcancel(self):
+        cancel = threading.Event()
+        threading.Timer(0.3, cancel.set).start()
+        result = run([sys.executable, "-c", "import time; time.sleep(30)"], cancel_event=cancel)
+        self.assertTrue(result.cancelled)
+
+    def testfailingcallbackreapschild(self):
+        def on_line(line):
+            raise RuntimeError("callback broke")
+        before = threading.active_count()
+        start = time.monotonic()
+        with self.assertRaises(RuntimeError):
+            run([sys.executable, "-c", "import time; print('x', flush=True); time.sleep(30)"], on_line=on_line,
+                cancel_event=threading.Event(), measure_throttle=True)
+        self.assertLess(time.monotonic() - start, 10)
+        # the watchdog and the throttle monitor are gone with it
+        time.sleep(0.3)
+        self.assertLessEqual(threading.active_count(), before)
+
+    def testmissingprogram(self):
+        with self.assertRaises(FileNotFoundError):
+            run(["definitely-not-a-real-program-insert"])
+
+    def teststats(self):
+        self.assertEqual(CommandStats.key(["pkexec", "pacman", "-S", "vim"]), "pacman")
+        self.assertEqual(CommandStats.key(["nice", "-n", "19", "ionice", "-c", "3", "/usr/bin/dnf"]), "dnf")
+        self.assertEqual(CommandStats.key(["systemd-run", "--scope", "-p", "CPUWeight=20", "--", "nice", "-n", "19", "pacman"]), "pacman")
+        self.assertEqual(CommandStats.key(["env", "A=b", "python3", "-m", "x"]), "python3")
+        STATS.clear()
+        run([sys.executable, "-c", "raise SystemExit(3)"])
+        name = CommandStats.key([sys.executable])
+        self.assertEqual(STATS.snapshot()[name]["failures"], 1)
+        self.assertIn(name, STATS.format())
+
+if __name__ == "__main__":
+    unittest.main()
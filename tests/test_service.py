@@ -0,0 +1,143 @@
+import threading
+import unittest
+from src.libinsert.devices import Device
+from src.libinsert.pkgindex import PackageIndex
+from src.libinsert.state import ScanState
+
+try:
+    from gi.repository import Gio, GLib
+    from src.libinsert.service import InsertService, ServiceClient
+except ImportError:
+    Gio = None
+
+class fakedistro:
+    id = "arch"
+    family = "arch"
+    pkg_mgr = "pacman"
+
+    def __init__(self):
+        self.installed = ["mesa"]
+
+    def get_installed_packages(self):
+        return list(self.installed)
+
+    def is_package_installed(self, package):
+        return package in self.installed
+
+class fakeprobe:
+    def __init__(self):
+        self.scans = 0
+
+    def scan_devices(self):
+        self.scans += 1
+        return [Device("pci", "03:00.0", "0300", "VGA", "1002", "AMD", "73bf", "Navi 21")]
+
+    def match_devices(self, family, devices):
+        from src.libinsert.devices import DriverMatch
+        return [DriverMatch("AMD Mesa", "gpus", ["mesa", "vulkan-radeon"], devices[0], ["amdgpu"])]
+
+    def check_bindings(self, matches):
+        for match in matches:
+            match.state = "active"
+        return matches
+
+def fake_index(pkg_mgr):
+    index = PackageIndex()
+    index.add("vulkan-radeon", "Radeon Vulkan driver", "extra")
+    return index.finish()
+
+class teststate(unittest.TestCase):
+    def testrefresh(self):
+        distro, probe = fakedistro(), fakeprobe()
+        state = ScanState(distro, probe, index_builder=fake_index)
+        self.assertEqual(state.to_dict()["generation"], 0)
+        self.assertEqual(state.refresh(), 1)
+        data = state.to_dict()
+        self.assertEqual(data["matches"][0]["missing_packages"], ["vulkan-radeon"])
+        self.assertEqual((data["installed_count"], data["indexed_packages"]), (1, 1))
+
+        distro.installed.append("vulkan-radeon")
+        state.refresh(packages_only=True)
+        self.assertTrue(state.matches[0].is_installed)
+        self.assertEqual(probe.scans, 1)
+        self.assertEqual(state.search("radeon", 5)[0]["name"], "vulkan-radeon")
+
+@unittest.skipIf(Gio is None, "PyGObject is not installed")
+class testservice(unittest.TestCase):
+    """Service and client talk over a private bus, never the user's session bus."""
+
+    def setUp(self):
+        self.bus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+        self.bus.up()
+        address = self.bus.get_bus_address()
+        flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+
+        self.distro = fakedistro()
+        self.probe = fakeprobe()
+        self.state = ScanState(self.distro, self.probe, index_builder=fake_index)
+        self.service = InsertService(self.state, rescan_interval=0)
+
+        # the service gets its own thread and main context, like the real process
+        ready = threading.Event()
+        def serve():
+            context = GLib.MainContext.new()
+            context.push_thread_default()
+            connection = Gio.DBusConnection.new_for_address_sync(address, flags, None, None)
+            connection.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus", "org.freedesktop.DBus",
+                                 "RequestName", GLib.Variant("(su)", ("io.github.hnpf.InsertSource.Service", 0)),
+                                 None, Gio.DBusCallFlags.NONE, -1, None)
+            self.service.register(connection)
+            self.loop = GLib.MainLoop.new(context, False)
+            ready.set()
+            self.loop.run()
+            context.pop_thread_default()
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        self.assertTrue(ready.wait(5))
+
+        self.client_connection = Gio.DBusConnection.new_for_address_sync(address, flags, None, None)
+        self.client = ServiceClient(self.client_connection, autostart=False)
+
+    def tearDown(self):
+        self.loop.quit()
+        self.thread.join(5)
+        self.client_connection.close_sync(None)
+        self.bus.down()
+
+    def wait_for_generation(self, generation):
+        for _ in range(100):
+            state = self.client.get_state()
+            if state and state["generation"] >= generation:
+                return state
+            GLib.usleep(50000)
+        self.fail(f"service never reached generation {generation}")
+
+    def testnotreadybeforefirstscan(self):
+        self.assertIsNone(self.client.get_state())
+        self.assertIsNone(self.client.get_matches())
+
+    def testwarmstate(self):
+        self.state.refresh()
+        matches = self.client.get_matches()
+        self.assertEqual(len(matches), 1)
+        self.assertEqual(matches[0].missing_packages, ["vulkan-radeon"])
+        self.assertEqual(matches[0].device.hardware_id, "1002:73bf")
+        self.assertEqual(self.client.installed(), {"mesa"})
+        self.assertEqual(self.client.search("vulkan")[0]["name"], "vulkan-radeon")
+
+    def testrefreshpackagesonly(self):
+        self.state.refresh()
+        self.distro.installed.append("vulkan-radeon")
+        self.client.refresh(packages_only=True)
+        state = self.wait_for_generation(2)
+        self.assertTrue(state["matches"][0]["is_installed"])
+        # hardware was not probed again
+        self.assertEqual(self.probe.scans, 1)
+
+    def testunreachable(self):
+        self.service.unregister()
+        self.assertIsNone(self.client.get_state())
+        self.assertIsNone(self.client.installed())
+
+if __name__ == "__main__":
+    unittest.main()
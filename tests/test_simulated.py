@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.libinsert.distro import DistroManager
+from src.libinsert.helper import build_operation
+from src.libinsert.probe import firmware_command, parse_firmware_result
+from src.libinsert.pkgindex import build_index
+from src.libinsert.runner import run
+from src.libinsert.simulated import SimConfig, Universe
+
+class testsimulated(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = {
+            "INSERT_PKG_MGR": "simulated",
+            "INSERT_SIM_STATE": os.path.join(self.tmp.name, "state.json"),
+            "INSERT_SIM_PACKAGES": "500",
+            "INSERT_SIM_LATENCY": "0",
+            "INSERT_SIM_SPEED": "1e12",
+            "INSERT_SIM_VERBOSITY": "1",
+        }
+        patcher = patch.dict(os.environ, self.env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dm = DistroManager()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testuniverse(self):
+        a = Universe(SimConfig.from_env())
+        b = Universe(SimConfig.from_env())
+        self.assertEqual(a.names, b.names)
+        self.assertEqual(a.installed, b.installed)
+        # driver packages are always there to install
+        self.assertIn("vulkan-radeon", a)
+        for name in a.closure(["vulkan-radeon"]):
+            self.assertNotIn(name, a.installed)
+
+    def testinstallandremove(self):
+        self.assertEqual(self.dm.pkg_mgr, "simulated")
+        self.assertFalse(self.dm.is_package_installed("vulkan-radeon"))
+        lines = []
+        result = run(self.dm.get_install_command(["vulkan-radeon"]), on_line=lines.append)
+        self.assertTrue(result.ok, result.stdout)
+        self.assertTrue(any(line.startswith("installing vulkan-radeon") for line in lines))
+        self.assertTrue(self.dm.is_package_installed("vulkan-radeon"))
+        self.assertIn("vulkan-radeon", self.dm.get_installed_packages())
+        sizes = self.dm.get_package_sizes(["vulkan-radeon", "no-such-package"])
+        self.assertEqual(list(sizes), ["vulkan-radeon"])
+        self.assertGreater(sizes["vulkan-radeon"], 0)
+
+        self.assertTrue(run(self.dm.get_remove_command(["vulkan-radeon"])).ok)
+        self.assertFalse(self.dm.is_package_installed("vulkan-radeon"))
+        # the cleanup tasks never point at the real system
+        self.assertTrue(all(t["cmd"][-1] == "clean" for t in self.dm.get_cleanup_tasks()))
+
+    def testfailureinjection(self):
+        with patch.dict(os.environ, {"INSERT_SIM_FAIL_MATCH": "vulkan-*"}):
+            result = run(self.dm.get_install_command(["vulkan-radeon"]))
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("simulated failure", result.stdout)
+        self.assertFalse(run(self.dm.get_install_command(["no-such-package"])).ok)
+
+    def testfirmwareneverreal(self):
+        for op in ("firmware_refresh", "firmware_update"):
+            cmd = build_operation(self.dm, op)
+            self.assertNotIn(cmd[0], ("pkexec", "fwupdmgr"))
+            self.assertNotIn("fwupdmgr", cmd)
+            self.assertTrue(run(cmd).ok)
+        self.assertNotIn("fwupdmgr", firmware_command())
+        updates = parse_firmware_result(run(firmware_command()))
+        self.assertEqual(updates["Devices"][0]["Releases"][0]["Version"], "1.0.1")
+        with patch.dict(os.environ, {"INSERT_SIM_FAIL_MATCH": "firmware"}):
+            self.assertFalse(run(build_operation(self.dm, "firmware_update")).ok)
+
+    def teststalltimesout(self):
+        with patch.dict(os.environ, {"INSERT_SIM_STALL": "30"}):
+            result = run(self.dm.refresh_database(), timeout=0.5)
+        self.assertTrue(result.timed_out)
+
+    def testlargeuniverseandtranscript(self):
+        with patch.dict(os.environ, {"INSERT_SIM_PACKAGES": "5000", "INSERT_SIM_VERBOSITY": "200"}):
+            installed = self.dm.get_installed_packages()
+            self.assertGreater(len(installed), 1000)
+            self.assertGreater(len(build_index("simulated")), 5000)
+            lines = []
+            result = run(self.dm.get_install_command(["mesa"]), on_line=lines.append)
+        self.assertTrue(result.ok)
+        self.assertGreaterEqual(len(lines), 200)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import json
+import tempfile
+import unittest
+from src.libinsert.snapshot import SNAPSHOT_VERSION, SNAPSHOT_SUFFIX, analyze_fleet
+
+AMD_GPU = '03:00.0 "VGA compatible controller [0300]" "Advanced Micro Devices, Inc. [AMD/ATI] [1002]" "Navi 21 [Radeon RX 6800/6800 XT / 6900 XT] [73bf]" -rc1 -p00 "Sapphire Technology Limited [1da2]" "Device [439e]"'
+NVIDIA_GPU = '01:00.0 "VGA compatible controller [0300]" "NVIDIA Corporation [10de]" "GA104 [GeForce RTX 3070 LHR] [2484]" -ra1 "Gigabyte Technology Co., Ltd [1458]" "Device [4082]"'
+
+def make_snapshot(hostname, os_id, pci, installed):
+    return {
+        "version": SNAPSHOT_VERSION,
+        "hostname": hostname,
+        "captured_at": 0,
+        "os_release": f'NAME="Test"\nID={os_id}\n',
+        "pci": pci,
+        "usb": ["Bus 001 Device 002: ID 8087:0024 Intel Corp. Integrated Rate Matching Hub"],
+        "installed": installed,
+    }
+
+class testsnapshot(unittest.TestCase):
+    def testfleetreport(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshots = [
+                make_snapshot("a", "arch", [NVIDIA_GPU], []),
+                make_snapshot("b", "arch", [NVIDIA_GPU], ["nvidia", "nvidia-utils", "lib32-nvidia-utils"]),
+                make_snapshot("c", "ubuntu", [AMD_GPU], ["libglx-mesa0"]),
+            ]
+            for snap in snapshots:
+                with open(os.path.join(tmp, snap["hostname"] + SNAPSHOT_SUFFIX), "w") as f:
+                    json.dump(snap, f)
+            with open(os.path.join(tmp, "broken" + SNAPSHOT_SUFFIX), "w") as f:
+                f.write("{")
+
+            report = analyze_fleet(tmp, db_path="data/drivers.json", jobs=2)
+            self.assertEqual(report["machines"], 3)
+            self.assertIn("broken" + SNAPSHOT_SUFFIX, report["failed"])
+            self.assertEqual(report["families"]["arch"]["machines_missing"], 1)
+            self.assertEqual(report["families"]["arch"]["missing"]["Nvidia Proprietary Drivers"], 1)
+            self.assertEqual(report["families"]["debian"]["machines"], 1)
+            self.assertEqual(report["hardware"]["10de:2484"]["machines"], 2)
+            self.assertEqual(report["hardware"]["10de:2484"]["missing"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.libinsert.space import SpaceEstimator
+
+class testspace(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, "a", "b"))
+        for rel, size in (("one", 4096), ("a/two", 8192), ("a/b/three", 4096)):
+            with open(os.path.join(self.root, rel), "wb") as f:
+                f.write(b"x" * size)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testestimate(self):
+        sizes = SpaceEstimator().estimate([self.root, "/does/not/exist"])
+        self.assertEqual(list(sizes), [self.root])
+        self.assertGreaterEqual(sizes[self.root], 16384)
+
+    def testrescanusescache(self):
+        estimator = SpaceEstimator()
+        first = estimator.directory_size(self.root)
+        with patch("os.scandir", side_effect=AssertionError("rescanned")):
+            self.assertEqual(estimator.directory_size(self.root), first)
+
+        # adding a file bumps the directory mtime so only that directory is walked again
+        with open(os.path.join(self.root, "a", "b", "four"), "wb") as f:
+            f.write(b"x" * 4096)
+        os.utime(os.path.join(self.root, "a", "b"), ns=(0, 1))
+        self.assertGreater(estimator.directory_size(self.root), first)
+
+    def testgrowinginplace(self):
+        estimator = SpaceEstimator()
+        first = estimator.directory_size(self.root)
+        journal = os.path.join(self.root, "a", "two")
+        stat = os.stat(os.path.join(self.root, "a"))
+        with open(journal, "ab") as f:
+            f.write(b"x" * 65536)
+        os.utime(os.path.join(self.root, "a"), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        with patch("os.scandir", side_effect=AssertionError("rescanned")):
+            self.assertGreaterEqual(estimator.directory_size(self.root), first + 65536)
+
+    def testestimatetasks(self):
+        tasks = [{"name": "Cache", "paths": [self.root]}, {"name": "No paths"}]
+        SpaceEstimator().estimate_tasks(tasks)
+        self.assertGreater(tasks[0]["reclaimable"], 0)
+        self.assertNotIn("reclaimable", tasks[1])
+
+if __name__ == "__main__":
+    unittest.main()
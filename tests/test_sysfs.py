@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from src.libinsert.sysfs import SysfsReader, ACTIVE, INACTIVE, MISSING
+from src.libinsert.devices import DriverMatch, parse_lspci_line, parse_lsusb_line
+from src.libinsert.hwids import HardwareNames
+
+NVIDIA_GPU = '01:00.0 "VGA compatible controller [0300]" "NVIDIA Corporation [10de]" "GA104 [GeForce RTX 3070 LHR] [2484]" -ra1 "Gigabyte Technology Co., Ltd [1458]" "Device [4082]"'
+BROADCOM = '02:00.0 "Network controller [0280]" "Broadcom Inc. and subsidiaries [14e4]" "BCM4360 802.11ac Wireless Network Adapter [43a0]" -r03 "Apple Inc. [106b]" "Device [0117]"'
+
+class testsysfs(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        drivers = os.path.join(root, "sys/bus/pci/drivers")
+        devices = os.path.join(root, "sys/bus/pci/devices")
+        for name in ("nouveau", "bcma-pci-bridge"):
+            os.makedirs(os.path.join(drivers, name))
+        os.makedirs(os.path.join(devices, "0000:01:00.0"))
+        os.makedirs(os.path.join(devices, "0000:02:00.0"))
+        os.symlink("../../../bus/pci/drivers/nouveau", os.path.join(devices, "0000:01:00.0/driver"))
+        for name, value in (("vendor", "0x10de"), ("device", "0x2484"), ("class", "0x030000"),
+                            ("subsystem_vendor", "0x1458"), ("subsystem_device", "0x4082")):
+            with open(os.path.join(devices, "0000:01:00.0", name), "w") as f:
+                f.write(value + "\n")
+        usb = os.path.join(root, "sys/bus/usb/devices")
+        for entry, values in (("1-2", {"idVendor": "8087", "idProduct": "0029", "busnum": "1", "devnum": "3"}),
+                              ("1-2:1.0", {"bInterfaceClass": "e0"})):
+            os.makedirs(os.path.join(usb, entry))
+            for name, value in values.items():
+                with open(os.path.join(usb, entry, name), "w") as f:
+                    f.write(value + "\n")
+        ids = os.path.join(root, "usr/share/hwdata")
+        os.makedirs(ids)
+        with open(os.path.join(ids, "pci.ids"), "w") as f:
+            f.write("10de  NVIDIA Corporation\n\t2484  GA104 [GeForce RTX 3070 LHR]\n1458  Gigabyte Technology Co., Ltd\n"
+                    "C 03  Display controller\n\t00  VGA compatible controller\n")
+        with open(os.path.join(ids, "usb.ids"), "w") as f:
+            f.write("8087  Intel Corp.\n\t0029  AX200 Bluetooth\n")
+        for module in ("nouveau", "btusb"):
+            os.makedirs(os.path.join(root, "sys/module", module))
+        self.sysfs = SysfsReader(root)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def match(self, line, modules, installed=True):
+        device = parse_lspci_line(line) if not line.startswith("Bus") else parse_lsusb_line(line)
+        match = DriverMatch("test", "gpus", ["pkg"], device, modules)
+        match.set_installed(lambda p: installed)
+        return match
+
+    def testbounddriver(self):
+        self.assertEqual(self.sysfs.bound_driver(parse_lspci_line(NVIDIA_GPU)), "nouveau")
+        self.assertIsNone(self.sysfs.bound_driver(parse_lspci_line(BROADCOM)))
+
+    def teststates(self):
+        loaded = self.sysfs.loaded_modules()
+        self.assertEqual(loaded, {"nouveau", "btusb"})
+        # nvidia packages installed, but nouveau owns the card
+        self.assertEqual(self.sysfs.driver_state(self.match(NVIDIA_GPU, ["nvidia"]), ["nvidia"], loaded), INACTIVE)
+        self.assertEqual(self.sysfs.driver_state(self.match(NVIDIA_GPU, ["nouveau"]), ["nouveau"], loaded), ACTIVE)
+        self.assertEqual(self.sysfs.driver_state(self.match(NVIDIA_GPU, ["nvidia"], installed=False), ["nvidia"], loaded), MISSING)
+        # unbound device falls back to the module list
+        self.assertEqual(self.sysfs.driver_state(self.match(BROADCOM, ["wl"]), ["wl"], loaded), INACTIVE)
+        usb = self.match("Bus 001 Device 003: ID 8087:0029 Intel Corp. AX200 Bluetooth", ["btusb"])
+        self.assertEqual(self.sysfs.driver_state(usb, ["btusb"], loaded), ACTIVE)
+
+    def testenumeration(self):
+        names = HardwareNames(self.tmp.name, cache_dir=None)
+        self.addCleanup(names.close)
+        pci = self.sysfs.pci_devices(names)
+        # 02:00.0 has no ids at all and is skipped
+        self.assertEqual(len(pci), 1)
+        expected = parse_lspci_line(NVIDIA_GPU)
+        for field in ("slot", "class_id", "class_name", "vendor_id", "vendor_name", "device_id", "device_name",
+                      "subsys_vendor_id", "subsys_vendor_name"):
+            self.assertEqual(getattr(pci[0], field), getattr(expected, field), field)
+        usb = self.sysfs.usb_devices(names)
+        self.assertEqual([(d.slot, d.hardware_id, d.device_name) for d in usb],
+                         [("001:003", "8087:0029", "Intel Corp. AX200 Bluetooth")])
+
+if __name__ == "__main__":
+    unittest.main()
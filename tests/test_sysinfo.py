@@ -0,0 +1,65 @@
+import os
+import time
+import tempfile
+import unittest
+from src.libinsert.sysinfo import SystemInfo, Collector, SECURE_BOOT_VAR
+
+class fakeprobe:
+    def _get_cpu_info(self):
+        return "Test CPU"
+
+    def _get_gpu_info(self):
+        return "Test GPU"
+
+    def _get_ram_info(self):
+        return "8 GB"
+
+def write(root, rel, data, mode="w"):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode) as f:
+        f.write(data)
+
+class testsysinfo(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.root = self.tmp.name
+        write(root, "sys/class/drm/card0/device/vendor", "0x1002\n")
+        write(root, "sys/class/drm/card0/device/device", "0x73bf\n")
+        os.makedirs(os.path.join(root, "sys/bus/pci/drivers/amdgpu"))
+        os.symlink(os.path.join(root, "sys/bus/pci/drivers/amdgpu"), os.path.join(root, "sys/class/drm/card0/device/driver"))
+        os.makedirs(os.path.join(root, "sys/class/drm/card0-DP-1"))
+        write(root, "sys/block/nvme0n1/size", "1953525168\n")
+        write(root, "sys/block/nvme0n1/queue/rotational", "0\n")
+        write(root, "sys/block/loop0/size", "100\n")
+        write(root, "proc/modules", "amdgpu 1 0 - Live\nwl 2 0 - Live\n")
+        write(root, SECURE_BOOT_VAR, b"\x06\x00\x00\x00\x01", "wb")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testfakesysfs(self):
+        info = SystemInfo(fakeprobe(), root=self.root).collect()
+        self.assertEqual(info["displays"], "card0: amdgpu (1002:73bf)")
+        self.assertEqual(info["disks"], "nvme0n1 1000 GB SSD")
+        self.assertEqual(info["modules"], "2 loaded")
+        self.assertEqual(info["secure_boot"], "Enabled")
+        self.assertEqual(info["cpu"], "Test CPU")
+
+    def testcachingandtimeouts(self):
+        info = SystemInfo(fakeprobe(), root=self.root)
+        info.collectors = []
+        calls = []
+        info.register(Collector("static", "Static", "x", lambda: calls.append("s") or "s"))
+        info.register(Collector("volatile", "Volatile", "x", lambda: calls.append("v") or "v", ttl=0))
+        info.register(Collector("slow", "Slow", "x", lambda: time.sleep(1) or "late", timeout=0.1))
+        seen = []
+        first = info.collect(lambda collector, value: seen.append(collector.key))
+        self.assertEqual(first["slow"], "Timed out")
+        self.assertEqual(seen[-1], "slow")
+        info.collect()
+        self.assertEqual(calls.count("s"), 1)
+        self.assertEqual(calls.count("v"), 2)
+
+if __name__ == "__main__":
+    unittest.main()